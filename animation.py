@@ -0,0 +1,109 @@
+# Quadros de animação com armazenamento compartilhado e papel cebola
+from history import History
+from layers import LayerStack, blend_span, read_region, write_region
+from pixelbuffer import new_buffer
+
+ONION_OPACITY = 0.3  # opacidade dos quadros vizinhos no papel cebola
+
+
+class Frame:
+    """Um quadro: suas camadas, seu histórico e quanto tempo fica na tela."""
+
+    def __init__(self, layers, history, duration=100):
+        self.layers = layers
+        self.history = history
+        self.duration = duration  # ms
+
+
+class Timeline:
+    """Sequência de quadros de um documento.
+
+    Um quadro novo começa como cópia do atual, mas os pixels são
+    compartilhados (copy-on-write): só as partes em que se desenhar depois
+    são realmente copiadas. Cada quadro tem o próprio histórico.
+    """
+
+    def __init__(self, cols, rows, history_budget=64 * 1024 * 1024, factory=new_buffer):
+        self.cols = cols
+        self.rows = rows
+        self.history_budget = history_budget
+        self.factory = factory  # cria os buffers das camadas de quadros vazios
+        self.frames = [Frame(LayerStack(cols, rows, factory=factory), History(budget=history_budget))]
+        self.current = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def frame(self):
+        return self.frames[self.current]
+
+    def add_frame(self, duplicate=True):
+        """Insere um quadro depois do atual (cópia compartilhada ou vazio) e o seleciona."""
+        frame = self.frame
+        layers = frame.layers.duplicate() if duplicate else LayerStack(self.cols, self.rows, factory=self.factory)
+        self.frames.insert(self.current + 1, Frame(layers, History(budget=self.history_budget),
+                                                   frame.duration))
+        self.current += 1
+        return self.frame
+
+    def remove_frame(self):
+        if len(self.frames) == 1:
+            return None
+        frame = self.frames.pop(self.current)
+        self.current = min(self.current, len(self.frames) - 1)
+        return frame
+
+    def select(self, index):
+        self.current = index % len(self.frames)
+
+    def neighbours(self):
+        """Quadros anterior e seguinte ao atual (os que existirem)."""
+        return [self.frames[i] for i in (self.current - 1, self.current + 1)
+                if 0 <= i < len(self.frames)]
+
+
+class OnionSkin:
+    """Quadros vizinhos translúcidos por baixo do quadro atual.
+
+    A mistura dos vizinhos (`cache`) é calculada uma vez por troca de quadro;
+    enquanto se desenha, `refresh` só recompõe os retângulos alterados do
+    quadro atual por cima dela, no buffer `display`.
+    """
+
+    def __init__(self, cols, rows, opacity=ONION_OPACITY):
+        self.cols = cols
+        self.rows = rows
+        self.opacity = opacity
+        self.cache = None
+        self.display = None
+
+    def build(self, neighbours, view):
+        """Refaz a mistura dos vizinhos e a imagem mostrada."""
+        self.cache = new_buffer(self.cols, self.rows)
+        rects = set()
+        for frame in neighbours:
+            other = frame.layers.view()
+            for rect in set(other.populated(0, 0, self.rows, self.cols)):
+                region = read_region(self.cache, *rect)
+                blend_span(region, read_region(other, *rect), self.opacity)
+                write_region(self.cache, *rect, region)
+                rects.add(rect)
+        self.display = new_buffer(self.cols, self.rows)
+        rects.update(view.populated(0, 0, self.rows, self.cols))
+        self.refresh(sorted(rects), view)
+
+    def refresh(self, rects, view):
+        if self.display is None:
+            return
+        for r0, c0, r1, c1 in rects:
+            r0, c0 = max(0, r0), max(0, c0)
+            r1, c1 = min(self.rows, r1), min(self.cols, c1)
+            if r0 >= r1 or c0 >= c1:
+                continue
+            region = read_region(self.cache, r0, c0, r1, c1)
+            blend_span(region, read_region(view, r0, c0, r1, c1))
+            write_region(self.display, r0, c0, r1, c1, region)
+
+    def clear(self):
+        self.cache = self.display = None
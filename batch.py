@@ -0,0 +1,214 @@
+# Processamento em lote, sem interface: aplica um script de operações a muitos PNGs
+#
+#   python batch.py script.jsonl sprites/ -o saida/ -j 8
+#   python pixelart.py batch script.jsonl sprites/ -o saida/
+#
+# O script tem uma operação JSON por linha (linhas vazias e começando com
+# "#" são ignoradas). Coordenadas são [linha, coluna]; cores, "#rrggbb",
+# "#rrggbbaa" ou null (transparente):
+#
+#   {"op": "fill", "at": [0, 0], "color": "#ff0000", "tolerance": 0, "connectivity": 4}
+#   {"op": "line", "from": [0, 0], "to": [15, 15], "color": "#000000"}
+#   {"op": "rect", "from": [2, 2], "to": [8, 8], "color": "#000000", "fill": false}
+#   {"op": "circle", "from": [2, 2], "to": [12, 12], "color": "#000000", "fill": false}
+#   {"op": "replace-color", "from": "#ff0000", "to": "#00ff00"}
+#   {"op": "replace-colors", "map": {"#ff0000": "#00ff00", "#00ff00": "#ff0000"}}   numa passada
+#   {"op": "mirror", "mode": "HORIZONTAL"}       espelha a imagem inteira
+#   {"op": "symmetry", "mode": "VERTICAL"}       espelho das ferramentas seguintes
+#   {"op": "save", "suffix": "_verde"}           grava a variação atual
+#
+# Cada arquivo é processado inteiro num processo do pool, que grava o
+# resultado direto no disco: só nomes e estatísticas voltam ao processo
+# principal. Sem nenhum "save", o resultado final é gravado com o mesmo nome.
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from colors import parse_color
+from importer import load_image
+from pixelbuffer import png_bytes
+from pixelcore import MIRROR_MODES
+
+OPERATIONS = ("fill", "line", "rect", "circle", "replace-color", "replace-colors", "mirror", "symmetry", "save")
+
+
+def load_script(path):
+    """Lê e valida o script antes de abrir qualquer imagem."""
+    ops = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                op = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{number}: JSON inválido ({e.msg})") from None
+            if op.get("op") not in OPERATIONS:
+                raise ValueError(f"{path}:{number}: operação desconhecida: {op.get('op')!r}")
+            if op["op"] in ("mirror", "symmetry") and op.get("mode") not in MIRROR_MODES:
+                raise ValueError(f"{path}:{number}: modo de espelho desconhecido: {op.get('mode')!r}")
+            ops.append(op)
+    return ops
+
+
+def apply_op(doc, op):
+    kind = op["op"]
+    if kind == "fill":
+        row, col = op["at"]
+        doc.fill(row, col, parse_color(op.get("color")),
+                 connectivity=op.get("connectivity", 4), tolerance=op.get("tolerance", 0))
+    elif kind == "line":
+        doc.draw_line(*op["from"], *op["to"], parse_color(op.get("color")))
+    elif kind == "rect":
+        doc.draw_rectangle(*op["from"], *op["to"], parse_color(op.get("color")), fill=op.get("fill", False))
+    elif kind == "circle":
+        doc.draw_ellipse(*op["from"], *op["to"], parse_color(op.get("color")), fill=op.get("fill", False))
+    elif kind == "replace-color":
+        doc.replace_color(parse_color(op["from"]), parse_color(op["to"]))
+    elif kind == "replace-colors":
+        doc.replace_colors({parse_color(old): parse_color(new) for old, new in op["map"].items()})
+    elif kind == "mirror":
+        doc.flip(op["mode"])
+    elif kind == "symmetry":
+        doc.mirror_mode = op["mode"]
+
+
+def output_path(src, out_dir, suffix=""):
+    name, _ = os.path.splitext(os.path.basename(src))
+    return os.path.join(out_dir, f"{name}{suffix}.png")
+
+
+def process_file(src, out_dir, ops, compress_level=6):
+    """Aplica o script a um arquivo (num processo do pool) e grava as saídas.
+
+    Devolve (pid, src, arquivos gravados, pixels, segundos, erro ou None).
+    """
+    start = time.perf_counter()
+    written = pixels = 0
+    try:
+        # Num lote ninguém desfaz nada: as ações não precisam virar deltas
+        doc, _ = load_image(src, keep_history=False)
+        pixels = doc.cols * doc.rows
+        pending = False
+        for op in ops:
+            if op["op"] == "save":
+                with open(output_path(src, out_dir, op.get("suffix", "")), "wb") as f:
+                    f.write(png_bytes(doc.composite(), compress_level))
+                written += 1
+                pending = False
+            else:
+                apply_op(doc, op)
+                pending = True
+        if pending or not written:
+            with open(output_path(src, out_dir), "wb") as f:
+                f.write(png_bytes(doc.composite(), compress_level))
+            written += 1
+    except Exception as e:  # um arquivo ruim não derruba o lote
+        return os.getpid(), src, written, pixels, time.perf_counter() - start, f"{type(e).__name__}: {e}"
+    return os.getpid(), src, written, pixels, time.perf_counter() - start, None
+
+
+def find_inputs(paths):
+    """PNGs dados diretamente ou contidos nos diretórios (sem recursão), em ordem."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                if name.lower().endswith(".png")))
+        else:
+            files.append(path)
+    return files
+
+
+def run(files, out_dir, ops, workers=None, compress_level=6, report=None):
+    """Processa os arquivos e devolve as estatísticas por processo.
+
+    `report(result)` é chamado a cada arquivo concluído, na ordem em que terminam.
+    Com um único worker tudo roda neste processo, sem pool.
+    """
+    workers = workers or os.cpu_count() or 1
+    stats = {}  # pid -> [arquivos, saídas, pixels, segundos ocupados, erros]
+
+    def collect(result):
+        pid, _, written, pixels, seconds, error = result
+        entry = stats.setdefault(pid, [0, 0, 0, 0.0, 0])
+        entry[0] += 1
+        entry[1] += written
+        entry[2] += pixels
+        entry[3] += seconds
+        entry[4] += error is not None
+        if report is not None:
+            report(result)
+
+    if workers == 1:
+        for src in files:
+            collect(process_file(src, out_dir, ops, compress_level))
+        return stats
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(process_file, src, out_dir, ops, compress_level) for src in files]
+        for future in as_completed(futures):
+            collect(future.result())
+    return stats
+
+
+def format_summary(stats, elapsed):
+    lines = [f"{'worker':>8} {'arquivos':>9} {'saídas':>7} {'erros':>6} {'ocupado':>9} {'arq/s':>8} {'Mpx/s':>8}"]
+    total_files = total_pixels = 0
+    for pid, (files, written, pixels, seconds, errors) in sorted(stats.items()):
+        rate = files / seconds if seconds else 0.0
+        mpx = pixels / seconds / 1e6 if seconds else 0.0
+        lines.append(f"{pid:>8} {files:>9} {written:>7} {errors:>6} {seconds:>8.2f}s {rate:>8.1f} {mpx:>8.2f}")
+        total_files += files
+        total_pixels += pixels
+    if elapsed:
+        lines.append(f"total: {total_files} arquivos em {elapsed:.2f}s "
+                     f"({total_files / elapsed:.1f} arq/s, {total_pixels / elapsed / 1e6:.2f} Mpx/s)")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="pixelart batch",
+                                     description="Aplica um script de operações a PNGs, sem interface.")
+    parser.add_argument("script", help="arquivo JSON lines com uma operação por linha")
+    parser.add_argument("inputs", nargs="+", help="PNGs ou diretórios com PNGs")
+    parser.add_argument("-o", "--output", required=True, help="diretório de saída")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="processos em paralelo (padrão: número de CPUs)")
+    parser.add_argument("--compress-level", type=int, default=6, choices=range(10), metavar="0-9",
+                        help="nível do zlib nos PNGs gravados")
+    parser.add_argument("-q", "--quiet", action="store_true", help="não lista cada arquivo")
+    args = parser.parse_args(argv)
+
+    try:
+        ops = load_script(args.script)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    files = find_inputs(args.inputs)
+    if not files:
+        print("nenhum PNG encontrado", file=sys.stderr)
+        return 2
+    os.makedirs(args.output, exist_ok=True)
+
+    failed = []
+
+    def report(result):
+        _, src, written, _, seconds, error = result
+        if error is not None:
+            failed.append(src)
+            print(f"ERRO {src}: {error}", file=sys.stderr)
+        elif not args.quiet:
+            print(f"{src}: {written} arquivo(s) em {seconds * 1000:.1f} ms")
+
+    start = time.perf_counter()
+    stats = run(files, args.output, ops, args.workers, args.compress_level, report)
+    print(format_summary(stats, time.perf_counter() - start))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
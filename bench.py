@@ -0,0 +1,400 @@
+# Benchmarks sem display das ferramentas e da renderização do PixelEditor
+#
+#   python bench.py                              tamanhos padrão, grava bench.json
+#   python bench.py --sizes 32 512 -r 5 -o antes.json
+#   python bench.py --compare antes.json         compara com uma execução anterior
+#
+# Antes de importar o editor o tkinter é trocado por um substituto em memória:
+# os widgets não fazem nada, o canvas só guarda os itens (para contá-los) e o
+# `after` enfileira as tarefas, executadas ao fim de cada operação. Assim
+# roda em CI e servidores, sem X. Para cada tamanho de documento e operação
+# são medidos o tempo (mediana das repetições), os itens criados no canvas e
+# o pico de memória (tracemalloc, numa passada separada para não pesar no
+# tempo). Com --compare, operações que ficaram mais lentas que --threshold
+# vezes o tempo anterior são listadas e o código de saída é 1.
+import argparse
+import itertools
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import types
+
+SIZES = (32, 128, 512, 1024, 4096)
+OPERATIONS = ("line", "rectangle", "circle", "fill", "redraw", "undo")
+WINDOW = (800, 600)  # tamanho do canvas simulado, em pixels de tela
+MAX_ZOOM = 16
+
+
+# Substituto do tkinter
+class _Widget:
+    """Widget que aceita qualquer chamada e guarda só a configuração."""
+
+    def __init__(self, *args, **kwargs):
+        self._options = dict(kwargs)
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+    def __getitem__(self, key):
+        return self._options.get(key, "")
+
+    def __setitem__(self, key, value):
+        self._options[key] = value
+
+    def config(self, **kwargs):
+        self._options.update(kwargs)
+
+    configure = config
+
+    def cget(self, key):
+        return self._options.get(key, "")
+
+    def get(self):
+        return self._options.get("value", "0")
+
+    def winfo_children(self):
+        return []
+
+
+class _Var:
+    def __init__(self, master=None, value=None, **kwargs):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+class FakeTk(_Widget):
+    """Janela principal; `run_pending` faz o papel do mainloop."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.jobs = {}
+        self._ids = itertools.count(1)
+
+    def after(self, ms, func=None, *args):
+        if func is None:
+            return None
+        job = f"after#{next(self._ids)}"
+        self.jobs[job] = (func, args)
+        return job
+
+    def after_idle(self, func, *args):
+        return self.after(0, func, *args)
+
+    def after_cancel(self, job):
+        self.jobs.pop(job, None)
+
+    def run_pending(self, rounds=100):
+        # Tarefas que se reagendam para sempre (p. ex. a animação) param em `rounds`
+        for _ in range(rounds):
+            if not self.jobs:
+                return
+            jobs, self.jobs = self.jobs, {}
+            for func, args in jobs.values():
+                func(*args)
+
+    def winfo_screenwidth(self):
+        return 1920
+
+    def winfo_screenheight(self):
+        return 1080
+
+
+class FakeCanvas(_Widget):
+    """Canvas que só mantém os itens e suas tags; `created` conta as criações."""
+
+    def __init__(self, master=None, **kwargs):
+        super().__init__(**kwargs)
+        self.items = {}  # id -> coordenadas
+        self.item_tags = {}  # id -> tags
+        self.tags = {}  # tag -> ids
+        self.created = 0
+        self._ids = itertools.count(1)
+
+    def _create(self, *coords, **kwargs):
+        item = next(self._ids)
+        self.created += 1
+        self.items[item] = list(coords)
+        tags = kwargs.get("tags", ())
+        tags = (tags,) if isinstance(tags, str) else tuple(tags)
+        self.item_tags[item] = tags
+        for tag in tags:
+            self.tags.setdefault(tag, set()).add(item)
+        return item
+
+    create_rectangle = create_line = create_image = create_text = _create
+
+    def _find(self, tag):
+        if tag == "all":
+            return list(self.items)
+        if tag in self.items:
+            return [tag]
+        return list(self.tags.get(tag, ()))
+
+    def delete(self, *tags):
+        for tag in tags:
+            for item in self._find(tag):
+                self.items.pop(item, None)
+                for name in self.item_tags.pop(item, ()):
+                    self.tags[name].discard(item)
+
+    def coords(self, tag, *coords):
+        items = self._find(tag)
+        if coords:
+            if len(coords) == 1:
+                coords = coords[0]
+            for item in items:
+                self.items[item] = list(coords)
+        return self.items[items[0]] if items else []
+
+    def find_all(self):
+        return tuple(self.items)
+
+    def find_withtag(self, tag):
+        return tuple(self._find(tag))
+
+    def canvasx(self, x):
+        return x
+
+    def canvasy(self, y):
+        return y
+
+    def winfo_width(self):
+        return WINDOW[0]
+
+    def winfo_height(self):
+        return WINDOW[1]
+
+    def xview(self, *args):
+        return 0.0, 1.0
+
+    yview = xview
+
+
+class FakePhotoImage:
+    def __init__(self, master=None, width=0, height=0, **kwargs):
+        self.w, self.h = width, height
+        self.name = f"image{id(self)}"
+        self.tk = self
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+    def width(self):
+        return self.w
+
+    def height(self):
+        return self.h
+
+    def zoom(self, x, y=None):
+        return FakePhotoImage(width=self.w * x, height=self.h * (y or x))
+
+    def __str__(self):
+        return self.name
+
+
+def install_fake_tk():
+    """Registra o substituto como `tkinter` (antes de importar pixelart)."""
+    tk = types.ModuleType("tkinter")
+    for name in ("Frame", "Button", "Label", "Scrollbar", "Spinbox", "Checkbutton", "Scale",
+                 "Toplevel", "OptionMenu", "Listbox", "Entry", "Menu"):
+        setattr(tk, name, type(name, (_Widget,), {}))
+    tk.Tk, tk.Canvas, tk.PhotoImage = FakeTk, FakeCanvas, FakePhotoImage
+    tk.IntVar = tk.StringVar = tk.BooleanVar = tk.DoubleVar = _Var
+    tk.SUNKEN, tk.RAISED, tk.HORIZONTAL, tk.VERTICAL = "sunken", "raised", "horizontal", "vertical"
+    tk.TclError = RuntimeError
+    dialogs = {
+        "colorchooser": {"askcolor": lambda *args, **kwargs: (None, None)},
+        "filedialog": {"askopenfilename": lambda *args, **kwargs: "",
+                       "asksaveasfilename": lambda *args, **kwargs: ""},
+        "simpledialog": {"askstring": lambda *args, **kwargs: None},
+    }
+    for name, functions in dialogs.items():
+        module = types.ModuleType(f"tkinter.{name}")
+        module.__dict__.update(functions)
+        setattr(tk, name, module)
+        sys.modules[f"tkinter.{name}"] = module
+    sys.modules["tkinter"] = tk
+    return tk
+
+
+# Operações medidas
+class Event:
+    def __init__(self, x, y, num=1):
+        self.x, self.y, self.num, self.state, self.delta = x, y, num, 0, 0
+
+
+def _gesture(editor, tool, start, end):
+    """Arrasta do centro da célula `start` ao de `end` com a ferramenta dada."""
+    z = editor.zoom
+    (r0, c0), (r1, c1) = start, end
+    editor.set_tool(tool)
+    editor.start_action(Event(c0 * z + z // 2, r0 * z + z // 2))
+    editor.draw_action(Event(c1 * z + z // 2, r1 * z + z // 2))
+    editor.stop_action(Event(c1 * z + z // 2, r1 * z + z // 2))
+
+
+def _operations(editor, size, repeat):
+    a, b = size // 8, size - 1 - size // 8
+    color = "#ff0000" if repeat % 2 else "#0000ff"
+    return {
+        "line": lambda: _gesture(editor, "line", (0, 0), (size - 1, size - 1)),
+        "rectangle": lambda: _gesture(editor, "rectangle", (a, a), (b, b)),
+        "circle": lambda: _gesture(editor, "circle", (a, a), (b, b)),
+        # O canto fica fora das formas: o balde cobre quase o documento inteiro
+        "fill": lambda: (editor.set_color(color), _gesture(editor, "fill", (0, size - 1), (0, size - 1))),
+        "redraw": editor.redraw_canvas,
+        "undo": editor.undo,
+    }
+
+
+def _new_editor(pixelart, size):
+    root = sys.modules["tkinter"].Tk()
+    zoom = max(1, min(MAX_ZOOM, min(WINDOW) // size))
+    editor = pixelart.PixelEditor(root, cols=size, rows=size, zoom=zoom)
+    root.run_pending()
+    return root, editor
+
+
+def bench_size(pixelart, size, repeats=3, memory=True):
+    """Resultados (um dict por operação) para um documento size x size."""
+    root, editor = _new_editor(pixelart, size)
+    times = {op: [] for op in OPERATIONS}
+    created = {}
+    for repeat in range(repeats):
+        for op, run in _operations(editor, size, repeat).items():
+            before = editor.canvas.created
+            start = time.perf_counter()
+            run()
+            root.run_pending()
+            times[op].append(time.perf_counter() - start)
+            created.setdefault(op, editor.canvas.created - before)
+
+    peaks = {}
+    if memory:
+        # Passada separada num editor novo: o tracemalloc deixa tudo mais lento
+        root, editor = _new_editor(pixelart, size)
+        tracemalloc.start()
+        try:
+            for op, run in _operations(editor, size, 0).items():
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                run()
+                root.run_pending()
+                peaks[op] = tracemalloc.get_traced_memory()[1] - base
+        finally:
+            tracemalloc.stop()
+
+    return [{
+        "size": size,
+        "op": op,
+        "seconds": statistics.median(times[op]),
+        "best": min(times[op]),
+        "items_created": created[op],
+        "canvas_items": len(editor.canvas.items),
+        "peak_kb": round(peaks[op] / 1024) if op in peaks else None,
+        "render_mode": editor.render_mode,
+    } for op in OPERATIONS]
+
+
+def _commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=sys.path[0] or None, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def run(sizes=SIZES, repeats=3, memory=True, report=None):
+    """Roda todos os tamanhos e devolve o documento JSON (meta + resultados)."""
+    install_fake_tk()
+    import pixelart
+    from pixelbuffer import numpy
+
+    results = []
+    for size in sizes:
+        rows = bench_size(pixelart, size, repeats, memory)
+        results.extend(rows)
+        if report is not None:
+            report(rows)
+    return {
+        "meta": {
+            "commit": _commit(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": numpy() is not None,
+            "repeats": repeats,
+        },
+        "results": results,
+    }
+
+
+def format_rows(rows):
+    lines = []
+    for row in rows:
+        peak = "" if row["peak_kb"] is None else f"{row['peak_kb']:>10} KB"
+        lines.append(f"{row['size']:>5}² {row['op']:<10} {row['seconds'] * 1000:>10.2f} ms "
+                     f"{row['items_created']:>8} itens {row['canvas_items']:>8} no canvas {peak}")
+    return "\n".join(lines)
+
+
+def compare(old, new, threshold=1.2):
+    """Linhas de comparação e a lista de (tamanho, operação) que pioraram."""
+    before = {(row["size"], row["op"]): row for row in old["results"]}
+    lines, slower = [], []
+    for row in new["results"]:
+        key = (row["size"], row["op"])
+        if key not in before or not before[key]["seconds"]:
+            continue
+        ratio = row["seconds"] / before[key]["seconds"]
+        mark = ""
+        if ratio > threshold:
+            slower.append(key)
+            mark = "  <- mais lento"
+        lines.append(f"{row['size']:>5}² {row['op']:<10} {before[key]['seconds'] * 1000:>10.2f} -> "
+                     f"{row['seconds'] * 1000:>10.2f} ms ({ratio:.2f}x){mark}")
+    return lines, slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks do PixelEditor sem display.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="lados dos documentos")
+    parser.add_argument("-r", "--repeats", type=int, default=3, help="repetições por operação")
+    parser.add_argument("-o", "--output", default="bench.json", help="arquivo JSON de saída")
+    parser.add_argument("--no-memory", action="store_true", help="não mede o pico de memória")
+    parser.add_argument("--compare", metavar="JSON", help="resultado anterior para comparar")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="razão de tempo a partir da qual uma operação conta como mais lenta")
+    args = parser.parse_args(argv)
+
+    old = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            old = json.load(f)
+
+    data = run(args.sizes, max(1, args.repeats), not args.no_memory, lambda rows: print(format_rows(rows)))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1)
+    print(f"resultados em {args.output}")
+
+    if old is not None:
+        lines, slower = compare(old, data, args.threshold)
+        print("\n".join(lines))
+        if slower:
+            print(f"{len(slower)} operação(ões) mais lentas que {args.threshold}x")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+# Conversões de cor compartilhadas (hex, RGB, RGBA e inteiro empacotado)
+#
+# O documento guarda cada pixel como inteiro empacotado r | g<<8 | b<<16 | a<<24
+# (0 = transparente): é ele que o balde, os traços e o histórico comparam.
+# As conversões de e para "#rrggbb" ficam num cache LRU limitado, porque os
+# mesmos poucos valores são convertidos o tempo todo (cada célula repintada,
+# cada clique do lápis). ColorTable dá ids pequenos e densos às cores de uma
+# imagem, para quem precisa indexá-las (paletas, imagens indexadas).
+from functools import lru_cache
+
+TRANSPARENT = 0
+CACHE_SIZE = 4096  # conversões lembradas por função
+
+
+def pack_rgba(r, g, b, a=255):
+    """Empacota RGBA num inteiro de 32 bits com os bytes na ordem R, G, B, A (little-endian)."""
+    return r | (g << 8) | (b << 16) | (a << 24)
+
+
+def unpack_rgba(value):
+    return value & 0xFF, (value >> 8) & 0xFF, (value >> 16) & 0xFF, value >> 24
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def hex_to_rgba(color):
+    """"#rrggbb", "#rrggbbaa" ou "#rgb" → (r, g, b, a)."""
+    digits = color.lstrip("#")
+    if len(digits) == 3:
+        digits = "".join(d * 2 for d in digits)
+    r, g, b = int(digits[0:2], 16), int(digits[2:4], 16), int(digits[4:6], 16)
+    a = int(digits[6:8], 16) if len(digits) == 8 else 255
+    return r, g, b, a
+
+
+def hex_to_rgb(color):
+    return hex_to_rgba(color)[:3]
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def rgb_to_hex(r, g, b):
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def hex_to_packed(color):
+    """"#rrggbb" → inteiro empacotado; None vira transparente."""
+    if not color:
+        return TRANSPARENT
+    return pack_rgba(*hex_to_rgba(color))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def packed_to_hex(value):
+    """Inteiro empacotado → "#rrggbb"; pixels sem alfa viram None."""
+    if not value >> 24:
+        return None
+    return rgb_to_hex(value & 0xFF, (value >> 8) & 0xFF, (value >> 16) & 0xFF)
+
+
+def parse_color(value):
+    """"#rrggbb", "#rrggbbaa" ou None/"transparent" → inteiro empacotado."""
+    if value in (None, "", "transparent"):
+        return TRANSPARENT
+    return pack_rgba(*hex_to_rgba(value))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def adjust(color, factor, lighten=False):
+    """Clareia (mistura com branco por factor - 1) ou escurece (multiplica por factor)."""
+    r, g, b = hex_to_rgb(color)
+    if lighten:
+        r, g, b = (int(v + (255 - v) * (factor - 1)) for v in (r, g, b))
+    else:
+        r, g, b = (int(v * factor) for v in (r, g, b))
+    return rgb_to_hex(*(min(255, max(0, v)) for v in (r, g, b)))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def lighten(color, amount=0.2):
+    """Mistura a cor com o branco (amount = fração de branco)."""
+    return rgb_to_hex(*(min(255, int(v + (255 - v) * amount)) for v in hex_to_rgb(color)))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def darken(color, amount=0.2):
+    """Escurece multiplicando cada canal por 1 - amount."""
+    return rgb_to_hex(*(max(0, int(v * (1 - amount))) for v in hex_to_rgb(color)))
+
+
+class ColorTable:
+    """Ids pequenos (0 = transparente) para as cores empacotadas, na ordem em que aparecem.
+
+    Com `limit` (256 numa imagem indexada), cores que não cabem mais recebem
+    o id da entrada mais parecida. replace() troca a cor de uma entrada; a
+    cor antiga deixa de levar a ela (pintar com a cor antiga cria outra
+    entrada, ou usa uma igual que já exista).
+    """
+
+    def __init__(self, values=(), limit=None):
+        self.limit = limit
+        self.values = [TRANSPARENT]  # id -> cor empacotada
+        self.ids = {TRANSPARENT: 0}  # cor empacotada -> id
+        for value in values:
+            self.intern(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, value):
+        return value in self.ids
+
+    @classmethod
+    def from_values(cls, values, limit=None):
+        """Tabela com exatamente estas entradas, na ordem (repetidas continuam separadas)."""
+        table = cls(limit=limit)
+        table.values = list(values)
+        for index, value in enumerate(table.values):
+            table.ids.setdefault(value, index)
+        return table
+
+    def intern(self, value):
+        """Id da cor, criando um novo se ela ainda não estiver na tabela."""
+        index = self.ids.get(value)
+        if index is None:
+            if not value >> 24:  # qualquer cor com alfa 0 é o transparente
+                return 0
+            if self.limit is not None and len(self.values) >= self.limit:
+                index = self.nearest(value)
+            else:
+                index = len(self.values)
+                self.values.append(value)
+            self.ids[value] = index
+        return index
+
+    def nearest(self, value):
+        """Id da entrada opaca (ou translúcida) mais próxima em RGBA."""
+        r, g, b, a = unpack_rgba(value)
+        best, best_distance = 0, None
+        for index in range(1, len(self.values)):
+            er, eg, eb, ea = unpack_rgba(self.values[index])
+            distance = (r - er) ** 2 + (g - eg) ** 2 + (b - eb) ** 2 + (a - ea) ** 2
+            if best_distance is None or distance < best_distance:
+                best, best_distance = index, distance
+        return best
+
+    def replace(self, index, value):
+        if index == 0:
+            raise ValueError("a entrada 0 é sempre a transparente")
+        old = self.values[index]
+        self.values[index] = value
+        if self.ids.get(old) == index:
+            # A cor antiga passa a levar a outra entrada igual, se houver
+            del self.ids[old]
+            if old in self.values:
+                self.ids[old] = self.values.index(old)
+        self.ids.setdefault(value, index)
+
+    def copy(self):
+        other = ColorTable.from_values(self.values, self.limit)
+        other.ids = dict(self.ids)
+        return other
+
+    def rgba(self, index):
+        return unpack_rgba(self.values[index])
@@ -0,0 +1,199 @@
+# Exportação em segundo plano: vários arquivos de uma só foto do documento
+#
+#   pixel_art.png, pixel_art@2x.png, ...   quadro atual, ampliado sem suavização
+#   pixel_art.gif                          animação com todos os quadros
+#   pixel_art_sheet.png                    folha de sprites (quadros em grade)
+#   pixel_art.rgba                         bytes RGBA crus, quadros empilhados
+#
+# Documentos no modo indexado saem como PNG modo "P" (paleta + um byte por
+# pixel), com a tabela de cores do documento.
+#
+# A foto (`snapshot`) é tirada na thread do Tk com share(): custa quase nada e
+# quem continuar desenhando é que copia os dados. O resto roda num pool de
+# threads (PIL e zlib soltam o GIL ao codificar), e cada arquivo concluído
+# entra na fila `events` da exportação, que a interface lê com `after`.
+import math
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+SCALES = (1, 2, 4, 8)
+FORMATS = ("png", "gif", "sheet", "raw")
+WORKERS = min(4, os.cpu_count() or 1)
+
+_pool = None
+
+
+def pool():
+    """Pool de threads compartilhado pelas exportações (criado no primeiro uso)."""
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="export")
+    return _pool
+
+
+class Snapshot:
+    """Quadros (buffer compartilhado, duração em ms) de um documento num instante.
+
+    `color_table` é uma cópia da tabela do documento indexado (ou None).
+    """
+
+    def __init__(self, cols, rows, frames, current=0, color_table=None):
+        self.cols = cols
+        self.rows = rows
+        self.frames = frames
+        self.current = current
+        self.color_table = color_table
+
+
+def snapshot(doc):
+    """Foto dos quadros compostos do documento (chame depois do flush da tela)."""
+    doc.composite()
+    table = doc.color_table.copy() if doc.color_table is not None else None
+    frames = []
+    for frame in doc.timeline.frames:
+        view = frame.layers.view()
+        if getattr(view, "pending", None):
+            # Blocos ainda no arquivo do projeto são lidos aqui, na thread do Tk:
+            # salvar (ou compactar) durante a exportação fecha o mmap de onde viriam
+            view.load_all()
+        buf = view.share()
+        if table is not None and getattr(buf, "palette", None) is doc.color_table:
+            buf.palette = table  # trocar uma cor da paleta depois não muda a foto
+        frames.append((buf, frame.duration))
+    return Snapshot(doc.cols, doc.rows, frames, doc.timeline.current, table)
+
+
+def _image(cols, rows, rgba):
+    from PIL import Image
+
+    return Image.frombuffer("RGBA", (cols, rows), rgba, "raw", "RGBA", 0, 1)
+
+
+def write_png(path, cols, rows, rgba, scale=1, compress_level=6):
+    img = _image(cols, rows, rgba.result())
+    if scale > 1:
+        img = img.resize((cols * scale, rows * scale), 0)  # 0 = Image.NEAREST
+    img.save(path, format="PNG", compress_level=compress_level)
+
+
+def indexed_image(buf, table):
+    """Imagem PIL modo "P" de um quadro: índices do IndexedBuffer ou cores mapeadas na tabela."""
+    from PIL import Image
+
+    if getattr(buf, "palette", None) is table:
+        indices = buf.indices()
+    else:  # composição de várias camadas: cores misturadas entram na tabela (ou na mais próxima)
+        table = table.copy()
+        indices = bytes(table.intern(value) for r in range(buf.rows) for value in buf.span(r, 0, buf.cols))
+    img = Image.frombytes("P", (buf.cols, buf.rows), indices)
+    rgba = [table.rgba(i) for i in range(len(table))]
+    img.putpalette([channel for r, g, b, _ in rgba for channel in (r, g, b)])
+    img.info["transparency"] = bytes(a for _, _, _, a in rgba)
+    return img
+
+
+def write_indexed_png(path, buf, table, scale=1, compress_level=6):
+    img = indexed_image(buf, table)
+    if scale > 1:
+        img = img.resize((buf.cols * scale, buf.rows * scale), 0)  # 0 = Image.NEAREST
+    img.save(path, format="PNG", compress_level=compress_level, transparency=img.info["transparency"])
+
+
+def write_gif(path, cols, rows, frames, durations):
+    images = [_image(cols, rows, rgba.result()) for rgba in frames]
+    # disposal=2: cada quadro é desenhado sobre fundo limpo (transparência não acumula)
+    images[0].save(path, format="GIF", save_all=True, append_images=images[1:],
+                   duration=durations, loop=0, disposal=2)
+
+
+def write_sheet(path, cols, rows, frames, compress_level=6):
+    """Quadros em grade quase quadrada, da esquerda para a direita."""
+    from PIL import Image
+
+    across = math.ceil(math.sqrt(len(frames)))
+    down = math.ceil(len(frames) / across)
+    sheet = Image.new("RGBA", (cols * across, rows * down))
+    for i, rgba in enumerate(frames):
+        down_i, across_i = divmod(i, across)
+        sheet.paste(_image(cols, rows, rgba.result()), (across_i * cols, down_i * rows))
+    sheet.save(path, format="PNG", compress_level=compress_level)
+
+
+def write_raw(path, frames):
+    with open(path, "wb") as f:
+        for rgba in frames:
+            f.write(rgba.result())
+
+
+def output_paths(base, formats=FORMATS, scales=SCALES):
+    """Arquivos que uma exportação grava, a partir do nome base (sem extensão)."""
+    paths = []
+    if "png" in formats:
+        paths.extend(base + (".png" if scale == 1 else f"@{scale}x.png") for scale in scales)
+    if "gif" in formats:
+        paths.append(base + ".gif")
+    if "sheet" in formats:
+        paths.append(base + "_sheet.png")
+    if "raw" in formats:
+        paths.append(base + ".rgba")
+    return paths
+
+
+class Export:
+    """Uma exportação em andamento.
+
+    Cada quadro vira bytes RGBA uma única vez (tarefa própria no pool); os
+    arquivos esperam pelos quadros de que precisam. Como essas tarefas entram
+    antes na fila, nenhuma espera fica presa atrás de quem ela espera.
+    """
+
+    def __init__(self, snap, base, formats=FORMATS, scales=SCALES, compress_level=6, executor=None):
+        executor = executor or pool()
+        self.events = queue.Queue()  # (caminho, exceção ou None) por arquivo concluído
+        self.done = 0
+        cols, rows = snap.cols, snap.rows
+        frames = [executor.submit(buf.tobytes) for buf, _ in snap.frames]
+        current = frames[snap.current]
+        durations = [duration for _, duration in snap.frames]
+
+        jobs = []
+        if "png" in formats and snap.color_table is not None:
+            buf = snap.frames[snap.current][0]
+            jobs.extend((partial(write_indexed_png, buf=buf, table=snap.color_table, scale=scale,
+                                 compress_level=compress_level)) for scale in scales)
+        elif "png" in formats:
+            jobs.extend((partial(write_png, cols=cols, rows=rows, rgba=current, scale=scale,
+                                 compress_level=compress_level)) for scale in scales)
+        if "gif" in formats:
+            jobs.append(partial(write_gif, cols=cols, rows=rows, frames=frames, durations=durations))
+        if "sheet" in formats:
+            jobs.append(partial(write_sheet, cols=cols, rows=rows, frames=frames,
+                                compress_level=compress_level))
+        if "raw" in formats:
+            jobs.append(partial(write_raw, frames=frames))
+
+        self.paths = output_paths(base, formats, scales)
+        self.total = len(jobs)
+        for path, job in zip(self.paths, jobs):
+            executor.submit(job, path).add_done_callback(partial(self._finished, path))
+
+    def _finished(self, path, future):
+        # Roda na thread do pool: só a fila fala com a interface
+        self.events.put((path, future.exception()))
+
+    @property
+    def finished(self):
+        return self.done == self.total
+
+    def poll(self):
+        """Arquivos concluídos desde a última chamada: lista de (caminho, erro ou None)."""
+        results = []
+        while True:
+            try:
+                results.append(self.events.get_nowait())
+            except queue.Empty:
+                break
+        self.done += len(results)
+        return results
@@ -0,0 +1,255 @@
+# Histórico de desfazer/refazer com deltas compactados
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+
+from pixelbuffer import TYPECODE, color_runs, numpy
+
+
+def rle_encode(values):
+    """Comprime uma sequência de valores em pares (valor, repetições)."""
+    np = numpy() if len(values) > 256 else None
+    if np is not None:
+        # Início de cada sequência: onde o valor difere do anterior
+        data = np.frombuffer(values, dtype=np.uint32)
+        starts = np.flatnonzero(np.concatenate(([True], data[1:] != data[:-1])))
+        pairs = np.empty(2 * len(starts), dtype=np.uint32)
+        pairs[0::2] = data[starts]
+        pairs[1::2] = np.diff(np.append(starts, len(data)))
+        return array(TYPECODE, pairs.tobytes())
+    out = array(TYPECODE)
+    for start, end, value in color_runs(values):
+        out.append(value)
+        out.append(end - start)
+    return out
+
+
+def rle_decode(pairs):
+    out = array(TYPECODE)
+    for i in range(0, len(pairs), 2):
+        out.extend(array(TYPECODE, [pairs[i]]) * pairs[i + 1])
+    return out
+
+
+class Delta:
+    """Uma ação desfazível: trechos alterados e suas cores antes/depois.
+
+    Os trechos são guardados como índices lineares (row * cols + col) e
+    comprimentos; as cores antigas e novas de todos os trechos, em sequência,
+    ficam comprimidas por RLE. Desfazer/refazer custa O(pixels alterados).
+    `target` é o buffer em que a ação aconteceu (com camadas, nem sempre é
+    o da camada ativa na hora de desfazer).
+    """
+
+    __slots__ = ("cols", "starts", "lengths", "old_rle", "new_rle", "target")
+
+    def __init__(self, cols, starts, lengths, old_rle, new_rle, target=None):
+        self.cols = cols
+        self.starts = starts
+        self.lengths = lengths
+        self.old_rle = old_rle
+        self.new_rle = new_rle
+        self.target = target
+
+    @property
+    def nbytes(self):
+        arrays = (self.starts, self.lengths, self.old_rle, self.new_rle)
+        return 64 + sum(len(a) * a.itemsize for a in arrays)
+
+    def revert(self, buf):
+        return self._apply(buf, self.old_rle)
+
+    def reapply(self, buf):
+        return self._apply(buf, self.new_rle)
+
+    def _apply(self, buf, rle):
+        """Escreve os valores no buffer e devolve os retângulos alterados."""
+        values = rle_decode(rle)
+        cols = self.cols
+        rects = []
+        pos = 0
+        for start, length in zip(self.starts, self.lengths):
+            # Trechos podem atravessar linhas; o buffer é escrito linha a linha
+            while length:
+                row, col = divmod(start, cols)
+                n = min(length, cols - col)
+                buf.set_span(row, col, values[pos:pos + n])
+                rects.append((row, col, row + 1, col + n))
+                start += n
+                pos += n
+                length -= n
+        return rects
+
+
+class TableDelta:
+    """Troca da cor de uma entrada da ColorTable (modo indexado): nenhum pixel muda.
+
+    `target` é a tabela; revert/reapply não devolvem retângulos, quem aplica
+    repinta o documento inteiro.
+    """
+
+    __slots__ = ("index", "old", "new", "target")
+
+    nbytes = 64
+
+    def __init__(self, index, old, new, target):
+        self.index = index
+        self.old = old
+        self.new = new
+        self.target = target
+
+    def revert(self, table):
+        table.replace(self.index, self.old)
+        return []
+
+    def reapply(self, table):
+        table.replace(self.index, self.new)
+        return []
+
+
+class DeltaBuilder:
+    """Coleta as alterações de uma ação enquanto ela acontece.
+
+    Chame `record`/`record_span` com o valor antigo antes de escrever no
+    buffer. Se a mesma célula for registrada mais de uma vez, vale o
+    primeiro valor antigo (o estado de antes da ação).
+    """
+
+    def __init__(self, buf):
+        self.buf = buf
+        self.entries = []  # (índice linear, valor antigo ou array de valores antigos)
+
+    def __bool__(self):
+        return bool(self.entries)
+
+    def record(self, row, col, old_value):
+        self.entries.append((row * self.buf.cols + col, old_value))
+
+    def record_span(self, row, col, old_values):
+        if len(old_values):
+            self.entries.append((row * self.buf.cols + col, old_values))
+
+    def build(self):
+        """Monta o Delta (ou None se nada mudou) lendo os valores novos do buffer."""
+        if not self.entries:
+            return None
+
+        # Primeira ocorrência vence: cada entrada só contribui com a parte
+        # ainda não coberta pelas anteriores
+        starts, ends = [], []
+        pieces = []
+        for start, old in self.entries:
+            if isinstance(old, int):
+                old = array(TYPECODE, [old])
+            end = start + len(old)
+            pos = start
+            i = bisect_right(ends, start)
+            while pos < end and i < len(starts) and starts[i] < end:
+                if starts[i] > pos:
+                    pieces.append((pos, old[pos - start:starts[i] - start]))
+                pos = max(pos, ends[i])
+                i += 1
+            if pos < end:
+                pieces.append((pos, old[pos - start:]))
+
+            # Une [start, end) aos intervalos já cobertos
+            lo = bisect_left(ends, start)
+            hi = bisect_right(starts, end)
+            if lo < hi:
+                start, end = min(start, starts[lo]), max(end, ends[hi - 1])
+            starts[lo:hi] = [start]
+            ends[lo:hi] = [end]
+        pieces.sort(key=lambda piece: piece[0])
+
+        # Trechos contíguos viram um só
+        span_starts, span_lengths = array(TYPECODE), array(TYPECODE)
+        old_values = array(TYPECODE)
+        for start, old in pieces:
+            if span_starts and span_starts[-1] + span_lengths[-1] == start:
+                span_lengths[-1] += len(old)
+            else:
+                span_starts.append(start)
+                span_lengths.append(len(old))
+            old_values.extend(old)
+
+        new_values = array(TYPECODE)
+        cols = self.buf.cols
+        for start, length in zip(span_starts, span_lengths):
+            while length:
+                row, col = divmod(start, cols)
+                n = min(length, cols - col)
+                new_values.extend(self.buf.span(row, col, col + n))
+                start += n
+                length -= n
+
+        if old_values == new_values:
+            return None
+        return Delta(cols, span_starts, span_lengths, rle_encode(old_values), rle_encode(new_values),
+                     target=self.buf)
+
+
+class History:
+    """Pilhas de desfazer/refazer limitadas por memória, não por quantidade.
+
+    Quando os deltas guardados passam de `budget` bytes, os mais antigos são
+    descartados primeiro (a última ação sempre fica).
+    """
+
+    def __init__(self, budget=64 * 1024 * 1024):
+        self.budget = budget
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self.undo_stack)
+
+    def push(self, delta):
+        if delta is None:
+            return
+        for old in self.redo_stack:
+            self.nbytes -= old.nbytes
+        self.redo_stack = []
+        self.undo_stack.append(delta)
+        self.nbytes += delta.nbytes
+        self._evict()
+
+    def undo(self, buf=None):
+        """Desfaz a última ação; devolve os retângulos alterados (ou []).
+
+        Sem `buf`, o delta é aplicado ao buffer em que foi gravado.
+        """
+        if not self.undo_stack:
+            return []
+        delta = self.undo_stack.pop()
+        self.redo_stack.append(delta)
+        return delta.revert(delta.target if buf is None else buf)
+
+    def redo(self, buf=None):
+        if not self.redo_stack:
+            return []
+        delta = self.redo_stack.pop()
+        self.undo_stack.append(delta)
+        return delta.reapply(delta.target if buf is None else buf)
+
+    def peek_undo(self):
+        """Delta que o próximo undo vai desfazer (ou None)."""
+        return self.undo_stack[-1] if self.undo_stack else None
+
+    def peek_redo(self):
+        return self.redo_stack[-1] if self.redo_stack else None
+
+    def discard(self, target):
+        """Descarta os deltas gravados em `target` (o buffer de uma camada removida)."""
+        self.undo_stack = deque(delta for delta in self.undo_stack if delta.target is not target)
+        self.redo_stack = [delta for delta in self.redo_stack if delta.target is not target]
+        self.nbytes = sum(delta.nbytes for delta in self.undo_stack) + sum(delta.nbytes for delta in self.redo_stack)
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack = []
+        self.nbytes = 0
+
+    def _evict(self):
+        while self.nbytes > self.budget and len(self.undo_stack) > 1:
+            self.nbytes -= self.undo_stack.popleft().nbytes
@@ -0,0 +1,64 @@
+# Importação de imagens (PNG, GIF animado, ...) como documento
+#
+# Cada quadro é decodificado pelo PIL numa chamada só (`tobytes`) e os bytes
+# viram buffer direto (buffer_from_rgba), sem laço por pixel em Python. As
+# cores da paleta saem do histograma do PIL (`getcolors`).
+from colors import rgb_to_hex
+from pixelbuffer import buffer_from_rgba
+from pixelcore import Document
+
+EXTENSIONS = (".png", ".gif")
+DEFAULT_DURATION = 100  # ms, para quadros sem duração
+HISTOGRAM_COLORS = 1 << 16  # acima disso as cores são contadas numa amostra
+PALETTE_SAMPLE = 256  # lado da amostra (cabe inteira no histograma)
+
+
+def _rgba(image):
+    """Converte para RGBA com os pixels totalmente transparentes zerados.
+
+    No buffer 0 é transparente: um (r, g, b, 0) qualquer viraria uma "cor"
+    invisível que o balde e a troca de cor tratariam como diferente.
+    """
+    from PIL import Image
+
+    image = image.convert("RGBA")
+    alpha = image.getchannel("A")
+    if alpha.getextrema()[0] == 0:
+        mask = alpha.point(lambda a: 255 if a else 0)
+        image = Image.composite(image, Image.new("RGBA", image.size), mask)
+    return image
+
+
+def _count_colors(image, counts):
+    """Soma em `counts` ("#rrggbb" -> pixels) as cores visíveis da imagem."""
+    from PIL import Image
+
+    colors = image.getcolors(HISTOGRAM_COLORS)
+    if colors is None:  # foto ou gradiente: estima pelas cores de uma miniatura
+        size = (min(image.width, PALETTE_SAMPLE), min(image.height, PALETTE_SAMPLE))
+        colors = image.resize(size, Image.NEAREST).getcolors(HISTOGRAM_COLORS)
+    for count, (r, g, b, a) in colors:
+        if a:
+            key = rgb_to_hex(r, g, b)
+            counts[key] = counts.get(key, 0) + count
+
+
+def load_image(path, palette_size=0, **kwargs):
+    """Lê a imagem como Document (um quadro por quadro do arquivo).
+
+    Devolve (documento, paleta) com as `palette_size` cores mais usadas, da
+    mais para a menos frequente. `kwargs` vão para o Document.
+    """
+    from PIL import Image, ImageSequence
+
+    frames = []
+    counts = {}
+    with Image.open(path) as image:
+        for frame in ImageSequence.Iterator(image):
+            duration = frame.info.get("duration") or DEFAULT_DURATION
+            frame = _rgba(frame)
+            frames.append((buffer_from_rgba(frame.width, frame.height, frame.tobytes()), duration))
+            if palette_size:
+                _count_colors(frame, counts)
+    palette = sorted(counts, key=counts.get, reverse=True)[:palette_size]
+    return Document.from_frames(frames, **kwargs), palette
@@ -0,0 +1,331 @@
+# Pilha de camadas com composição em cache
+from array import array
+
+from pixelbuffer import TYPECODE, color_runs, new_buffer, numpy
+
+BLEND_MODES = ("normal", "multiply", "screen", "add", "darken", "lighten")
+
+
+def _mix(mode, cb, cs):
+    """Cor misturada de um canal (0..1): cb = fundo, cs = camada."""
+    if mode == "multiply":
+        return cb * cs
+    if mode == "screen":
+        return cb + cs - cb * cs
+    if mode == "add":
+        return min(1.0, cb + cs)
+    if mode == "darken":
+        return min(cb, cs)
+    if mode == "lighten":
+        return max(cb, cs)
+    return cs
+
+
+def _mix_np(np, mode, cb, cs):
+    if mode == "multiply":
+        return cb * cs
+    if mode == "screen":
+        return cb + cs - cb * cs
+    if mode == "add":
+        return np.minimum(1.0, cb + cs)
+    if mode == "darken":
+        return np.minimum(cb, cs)
+    if mode == "lighten":
+        return np.maximum(cb, cs)
+    return cs
+
+
+def blend_pixel(dst, src, opacity=1.0, mode="normal"):
+    """Compõe um pixel empacotado sobre outro (alfa não pré-multiplicado)."""
+    sa = (src >> 24) / 255 * opacity
+    if sa <= 0:
+        return dst
+    da = (dst >> 24) / 255
+    oa = sa + da * (1 - sa)
+    out = int(oa * 255 + 0.5) << 24
+    for shift in (0, 8, 16):
+        cs = ((src >> shift) & 0xFF) / 255
+        cb = ((dst >> shift) & 0xFF) / 255
+        co = (sa * (1 - da) * cs + sa * da * _mix(mode, cb, cs) + (1 - sa) * da * cb) / oa
+        out |= int(co * 255 + 0.5) << shift
+    return out
+
+
+def blend_span(dst, src, opacity=1.0, mode="normal"):
+    """Compõe o array src sobre dst (mesmo tamanho), alterando dst.
+
+    Sequências transparentes de src são puladas e as opacas em modo normal
+    viram uma atribuição de fatia; só o resto passa por blend_pixel.
+    """
+    if opacity <= 0:
+        return dst
+    np = numpy() if len(dst) > 64 else None
+    if np is not None:
+        dst[:] = array(TYPECODE, _blend_np(np, np.frombuffer(dst, dtype=np.uint32),
+                                           np.frombuffer(src, dtype=np.uint32),
+                                           opacity, mode).tobytes())
+        return dst
+    copy = mode == "normal" and opacity >= 1
+    for start, end, value in color_runs(src):
+        alpha = value >> 24
+        if not alpha:
+            continue
+        if copy and alpha == 255:
+            dst[start:end] = array(TYPECODE, [value]) * (end - start)
+            continue
+        for i in range(start, end):
+            dst[i] = blend_pixel(dst[i], value, opacity, mode)
+    return dst
+
+
+def _blend_np(np, dst, src, opacity, mode):
+    # Mesma conta de blend_pixel, vetorizada (float64 para dar o mesmo arredondamento)
+    sa = (src >> 24).astype(np.float64) / 255 * opacity
+    da = (dst >> 24).astype(np.float64) / 255
+    oa = sa + da * (1 - sa)
+    safe = np.where(oa > 0, oa, 1.0)
+    out = np.floor(oa * 255 + 0.5).astype(np.uint32) << np.uint32(24)
+    for shift in (0, 8, 16):
+        cs = ((src >> np.uint32(shift)) & 0xFF).astype(np.float64) / 255
+        cb = ((dst >> np.uint32(shift)) & 0xFF).astype(np.float64) / 255
+        co = (sa * (1 - da) * cs + sa * da * _mix_np(np, mode, cb, cs) + (1 - sa) * da * cb) / safe
+        out |= np.floor(co * 255 + 0.5).astype(np.uint32) << np.uint32(shift)
+    # Onde a camada é transparente o fundo fica exatamente como estava
+    return np.where(sa > 0, out, dst)
+
+
+def read_region(buf, r0, c0, r1, c1):
+    """Células de [r0, r1) x [c0, c1), linha após linha, num único array."""
+    out = array(TYPECODE)
+    for r in range(r0, r1):
+        out.extend(buf.span(r, c0, c1))
+    return out
+
+
+def write_region(buf, r0, c0, r1, c1, values):
+    width = c1 - c0
+    for i, r in enumerate(range(r0, r1)):
+        buf.set_span(r, c0, values[i * width:(i + 1) * width])
+
+
+class Layer:
+    def __init__(self, name, pixels, visible=True, opacity=1.0, blend="normal"):
+        self.name = name
+        self.pixels = pixels
+        self.visible = visible
+        self.opacity = opacity
+        self.blend = blend
+
+    def __repr__(self):
+        return f"Layer({self.name!r}, visible={self.visible}, opacity={self.opacity}, blend={self.blend!r})"
+
+
+class LayerStack:
+    """Camadas de um documento (a primeira é a de baixo) e a composição delas.
+
+    A composição fica em cache num buffer próprio e é refeita só nos
+    retângulos alterados. Para que pintar na camada ativa não custe mais com
+    muitas camadas, também ficam em cache o que está abaixo dela (`below`) e,
+    quando tudo acima é modo normal, o que está acima (`above`): cada
+    retângulo custa no máximo duas misturas, com 2 ou 20 camadas. Com uma
+    única camada visível, normal e opaca, o buffer dela é usado direto.
+    `factory(cols, rows)` cria os buffers das camadas novas (os caches são
+    sempre de cores empacotadas).
+    """
+
+    def __init__(self, cols, rows, layers=None, factory=new_buffer):
+        self.cols = cols
+        self.rows = rows
+        self.factory = factory
+        self.layers = layers or [Layer("Camada 1", factory(cols, rows))]
+        self.active = 0
+        self.composite = None  # None enquanto a camada única serve de composição
+        self.below = None
+        self.above = None  # None se houver camada acima que não seja normal
+        self.split_valid = False  # below/above correspondem à camada ativa?
+
+    def __len__(self):
+        return len(self.layers)
+
+    @property
+    def active_layer(self):
+        return self.layers[self.active]
+
+    @property
+    def pixels(self):
+        """Buffer da camada ativa."""
+        return self.layers[self.active].pixels
+
+    def duplicate(self):
+        """Outra pilha igual a esta; pixels e caches são compartilhados (copy-on-write)."""
+        layers = [Layer(layer.name, layer.pixels.share(), layer.visible, layer.opacity, layer.blend)
+                  for layer in self.layers]
+        other = LayerStack(self.cols, self.rows, layers, self.factory)
+        other.active = self.active
+        if self.composite is not None:
+            other.composite = self.composite.share()
+            other.below = self.below.share() if self.below is not None else None
+            other.above = self.above.share() if self.above is not None else None
+            other.split_valid = self.split_valid
+        return other
+
+    def index_of(self, pixels):
+        """Índice da camada dona do buffer, ou None."""
+        for i, layer in enumerate(self.layers):
+            if layer.pixels is pixels:
+                return i
+        return None
+
+    # Estrutura
+    def add_layer(self, name=None):
+        """Cria uma camada vazia logo acima da ativa e a torna ativa."""
+        name = name or f"Camada {len(self.layers) + 1}"
+        self.layers.insert(self.active + 1, Layer(name, self.factory(self.cols, self.rows)))
+        self.active += 1
+        self.rebuild()
+        return self.active_layer
+
+    def remove_layer(self, index=None):
+        if len(self.layers) == 1:
+            return None
+        index = self.active if index is None else index
+        layer = self.layers.pop(index)
+        self.active = min(self.active if index > self.active else max(0, self.active - 1),
+                          len(self.layers) - 1)
+        self.rebuild()
+        return layer
+
+    def move_layer(self, index, offset):
+        new = index + offset
+        if not (0 <= index < len(self.layers) and 0 <= new < len(self.layers)):
+            return
+        layers = self.layers
+        layers[index], layers[new] = layers[new], layers[index]
+        if self.active == index:
+            self.active = new
+        elif self.active == new:
+            self.active = index
+        self.rebuild()
+
+    def select(self, index):
+        if index != self.active:
+            self.active = index
+            self.split_valid = False
+            if self.composite is not None:
+                self._build_split()
+
+    # Propriedades por camada
+    def set_visible(self, index, visible):
+        self.layers[index].visible = visible
+        self.rebuild()
+
+    def set_opacity(self, index, opacity):
+        self.layers[index].opacity = max(0.0, min(1.0, opacity))
+        self.rebuild()
+
+    def set_blend(self, index, mode):
+        if mode not in BLEND_MODES:
+            raise ValueError(f"modo de mistura desconhecido: {mode}")
+        self.layers[index].blend = mode
+        self.rebuild()
+
+    # Composição
+    def single_layer(self):
+        """A camada que sozinha é a composição (única visível, normal e opaca), ou None."""
+        visible = [layer for layer in self.layers if layer.visible]
+        if len(visible) == 1 and visible[0].blend == "normal" and visible[0].opacity >= 1:
+            return visible[0]
+        return None
+
+    def view(self):
+        """Buffer com o resultado final, para desenhar e exportar."""
+        if self.composite is None:
+            single = self.single_layer()
+            if single is not None:
+                return single.pixels
+            self.rebuild()
+        return self.composite
+
+    def rebuild(self):
+        """Refaz caches e composição inteiros (após mudar camadas ou propriedades)."""
+        if self.single_layer() is not None:
+            self.composite = self.below = self.above = None
+            self.split_valid = False
+            return
+        self.composite = new_buffer(self.cols, self.rows)
+        self._build_split()
+        for rect in self._populated_rects():
+            self._compose(*rect)
+
+    def refresh(self, rects):
+        """Recompõe os retângulos alterados na camada ativa."""
+        if self.composite is None:
+            return
+        if not self.split_valid:
+            self._build_split()
+        for r0, c0, r1, c1 in rects:
+            self._compose(r0, c0, r1, c1)
+
+    def invalidate(self, rects, index):
+        """Outra camada mudou (p. ex. ao desfazer): atualiza os caches nesses retângulos."""
+        if self.composite is None:
+            return
+        if not self.split_valid:
+            self._build_split()
+        elif index != self.active:
+            for r0, c0, r1, c1 in rects:
+                self._compose_split(r0, c0, r1, c1)
+        for r0, c0, r1, c1 in rects:
+            self._compose(r0, c0, r1, c1)
+
+    def _populated_rects(self):
+        # Retângulos (sem repetição) que alguma camada visível pode ter pintado
+        rects = set()
+        for layer in self.layers:
+            if layer.visible:
+                rects.update(layer.pixels.populated(0, 0, self.rows, self.cols))
+        return sorted(rects)
+
+    def _build_split(self):
+        above = self.layers[self.active + 1:]
+        self.below = new_buffer(self.cols, self.rows)
+        if all(layer.blend == "normal" for layer in above if layer.visible):
+            self.above = new_buffer(self.cols, self.rows)
+        else:
+            self.above = None
+        for rect in self._populated_rects():
+            self._compose_split(*rect)
+        self.split_valid = True
+
+    def _compose_split(self, r0, c0, r1, c1):
+        below = array(TYPECODE, bytes(4 * (r1 - r0) * (c1 - c0)))
+        for layer in self.layers[:self.active]:
+            self._blend_layer(below, layer, r0, c0, r1, c1)
+        write_region(self.below, r0, c0, r1, c1, below)
+        if self.above is not None:
+            above = array(TYPECODE, bytes(4 * (r1 - r0) * (c1 - c0)))
+            for layer in self.layers[self.active + 1:]:
+                self._blend_layer(above, layer, r0, c0, r1, c1)
+            write_region(self.above, r0, c0, r1, c1, above)
+
+    def _compose(self, r0, c0, r1, c1):
+        r0, c0 = max(0, r0), max(0, c0)
+        r1, c1 = min(self.rows, r1), min(self.cols, c1)
+        if r0 >= r1 or c0 >= c1:
+            return
+        region = read_region(self.below, r0, c0, r1, c1)
+        self._blend_layer(region, self.active_layer, r0, c0, r1, c1)
+        if self.above is not None:
+            blend_span(region, read_region(self.above, r0, c0, r1, c1))
+        else:
+            for layer in self.layers[self.active + 1:]:
+                self._blend_layer(region, layer, r0, c0, r1, c1)
+        write_region(self.composite, r0, c0, r1, c1, region)
+
+    @staticmethod
+    def _blend_layer(region, layer, r0, c0, r1, c1):
+        if not layer.visible or layer.opacity <= 0:
+            return
+        if not any(True for _ in layer.pixels.populated(r0, c0, r1, c1)):
+            return
+        blend_span(region, read_region(layer.pixels, r0, c0, r1, c1), layer.opacity, layer.blend)
@@ -0,0 +1,80 @@
+# Instrumentação de desempenho do editor: tempos por evento, HUD e trilha CSV
+#
+# O PerfMonitor embrulha os handlers (wrap) e guarda cada medição numa trilha
+# (tempo, métrica, valor). Desligado, o embrulho só testa `enabled`. Ligado,
+# além do tempo do handler mede quanto o Tk demora para ficar ocioso depois
+# dele (`idle_ms`): as tarefas ociosas que já estavam na fila, como o
+# redesenho da janela, rodam antes da sonda agendada com after_idle.
+import csv
+import time
+from collections import deque
+
+HUD_INTERVAL_MS = 250  # intervalo entre atualizações do HUD
+WINDOW_SECONDS = 1.0  # janela das médias e dos eventos por segundo
+TRACE_LIMIT = 200_000  # medições guardadas (as mais antigas saem primeiro)
+
+
+class PerfMonitor:
+    def __init__(self, master, limit=TRACE_LIMIT):
+        self.master = master
+        self.enabled = False
+        self.trace = deque(maxlen=limit)  # (segundos desde o início, métrica, valor)
+        self.last = {}  # métrica -> último valor
+        self.start = time.perf_counter()
+        self._probe = None
+
+    def wrap(self, name, func):
+        """Versão de `func` que registra `<name>_ms` a cada chamada (se ligado)."""
+        metric = name + "_ms"
+
+        def timed(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                self.record(metric, (end - start) * 1000, end)
+                if self._probe is None:
+                    self._probe = self.master.after_idle(self._idle, end)
+
+        timed.__wrapped__ = func
+        return timed
+
+    def _idle(self, since):
+        self._probe = None
+        if self.enabled:
+            self.record("idle_ms", (time.perf_counter() - since) * 1000)
+
+    def record(self, metric, value, now=None):
+        now = time.perf_counter() if now is None else now
+        self.trace.append((now - self.start, metric, value))
+        self.last[metric] = value
+
+    def stats(self, metric, window=WINDOW_SECONDS):
+        """(quantidade, média, máximo) da métrica nos últimos `window` segundos."""
+        since = time.perf_counter() - self.start - window
+        values = []
+        for t, name, value in reversed(self.trace):
+            if t < since:
+                break
+            if name == metric:
+                values.append(value)
+        if not values:
+            return 0, 0.0, 0.0
+        return len(values), sum(values) / len(values), max(values)
+
+    def clear(self):
+        self.trace.clear()
+        self.last.clear()
+        self.start = time.perf_counter()
+
+    def export_csv(self, path):
+        """Grava a trilha: uma linha por medição (time_s, metric, value)."""
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(("time_s", "metric", "value"))
+            for t, metric, value in self.trace:
+                writer.writerow((f"{t:.6f}", metric, value if isinstance(value, int) else f"{value:.4f}"))
+        return len(self.trace)
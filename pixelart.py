@@ -1,36 +1,41 @@
-import tkinter as tk
-
-from tkinter import colorchooser
-from tkinter.colorchooser import askcolor
+import sys
 
-COR_1 = "#949492"
-COR_2 = "#a3a3a2"
+if __name__ == "__main__" and sys.argv[1:2] == ["batch"]:
+    # Modo em lote, sem janela: python pixelart.py batch script.jsonl entrada/ -o saida/
+    # Decidido antes de importar o Tk, para funcionar em máquinas sem _tkinter
+    from batch import main
+    sys.exit(main(sys.argv[2:]))
 
+import base64
+import os
+import time
+import tkinter as tk
 
-def bresenham_line(x0, y0, x1, y1):
-    points = []
-    dx = abs(x1 - x0)
-    dy = -abs(y1 - y0)
-    sx = 1 if x0 < x1 else -1
-    sy = 1 if y0 < y1 else -1
-    err = dx + dy
+from tkinter import colorchooser, filedialog, simpledialog
+from tkinter.colorchooser import askcolor
 
-    while True:
-        points.append((x0, y0))
-        if x0 == x1 and y0 == y1:
-            break
-        e2 = 2 * err
-        if e2 >= dy:
-            err += dy
-            x0 += sx
-        if e2 <= dx:
-            err += dx
-            y0 += sy
-    return points
+import colors
+from animation import OnionSkin
+from exporter import FORMATS, SCALES, Export, snapshot
+from importer import EXTENSIONS as IMAGE_EXTENSIONS, load_image
+from layers import BLEND_MODES
+from perf import HUD_INTERVAL_MS, WINDOW_SECONDS, PerfMonitor
+from pixelbuffer import INDEXED_COLORS, downsample, hex_to_packed, png_bytes
+from pixelcore import DirtyRegion, Document
+from raster import bresenham_line, ellipse_spans, line_spans, rect_spans
+from project import EXTENSION, Project
+from render import COR_2, RENDER_BUDGET_MS, RENDERERS, PreviewLayer, RenderScheduler, split_rect
+
+STROKE_FRAME_MS = 16  # intervalo entre desenhos de um traço (~60 quadros por segundo)
+PLAYBACK_SIZE = 512  # lado máximo (em pixels de tela) da prévia da animação
+VIEW_MARGIN = 16  # células renderizadas além da área visível, de cada lado
+AUTO_IMAGE_CELLS = 128 * 128  # no modo "auto", documentos maiores usam o modo imagem
+EXPORT_POLL_MS = 50  # intervalo entre verificações do progresso da exportação
 
 
 class PixelEditor:
-    def __init__(self, master, cols=32, rows=32, zoom=16):
+    def __init__(self, master, cols=32, rows=32, zoom=16, render_mode="auto",
+                 history_budget=64 * 1024 * 1024, render_budget_ms=RENDER_BUDGET_MS, immediate_render=False):
         self.current_tool = None
         self.mirror_button = None
         self.color_preview_temp = "#8ba334"
@@ -38,6 +43,9 @@ class PixelEditor:
         self.cols = cols
         self.rows = rows
         self.zoom = zoom  # fator de zoom
+        # "items" (um retângulo por célula), "image" (PhotoImage) ou "auto" (conforme o tamanho)
+        self.auto_render_mode = render_mode == "auto"
+        self.render_mode = self.pick_render_mode() if self.auto_render_mode else render_mode
 
         # self.zoom = pixel_size
         self.current_color = "#000000"
@@ -52,11 +60,25 @@ class PixelEditor:
 
         self.show_grid = False
         self.show_checker = True
-        self.pixels = [[None for _ in range(cols)] for _ in range(rows)]
-        self.undo_stack = []
+        # Documento sem interface (quadros, camadas, histórico); a janela só o mostra
+        self.document = Document(cols, rows, history_budget=history_budget)
+        self.onion = OnionSkin(cols, rows)  # quadros vizinhos por baixo do atual
+        self.show_onion = False
+        self.project = None  # arquivo de projeto (.pxp) aberto ou salvo por último
+        self.old_projects = []  # projetos anteriores de que o documento ainda pode ler blocos
+        self.play_job = None  # prévia da animação em andamento
+        self.play_window = None
+        self.play_images = []
+        self.show_dirty = False  # overlay de depuração das regiões repintadas
+        # Instrumentação (HUD com F2): tempos dos handlers e do flush
+        self.perf = PerfMonitor(self.master)
+        self.flush = self.perf.wrap("flush", self.flush)
+        self.hud_job = None
+        # O canvas é repintado uma vez por quadro de tela (immediate_render: na hora)
+        self.pending_render = DirtyRegion()  # regiões já compostas, à espera do canvas
+        self.scheduler = RenderScheduler(self.master, self.perf.wrap("render", self.render_pass),
+                                         budget_ms=render_budget_ms, immediate=immediate_render)
         self.create_ui()
-        self.mirror_mode = "OFF" # OFF, HORIZONTAL, VERTICAL, BOTH
-
 
         self.mirror = False
 
@@ -65,11 +87,58 @@ class PixelEditor:
         self.circle_start = None  # Ponto inicial do círculo
         self.temp_circle_id = None  # ID do círculo temporário no canvas
 
+        # Traço em andamento (lápis, borracha, botão direito)
+        self.stroke_paint = None  # função que pinta uma célula do traço
+        self.stroke_points = []  # pontos de movimento ainda não desenhados
+        self.stroke_last = None  # última célula desenhada
+        self.stroke_cells = set()  # células já pintadas neste traço
+        self.stroke_job = None
+        self.stroke_events = 0  # eventos de movimento recebidos no traço
+        self.stroke_coalesced = 0  # eventos descartados por cair na mesma célula
+
+        # Preview das formas (linha, retângulo, círculo)
+        self.preview_shapes = {}  # (r0, c0, r1, c1) -> cor do contorno
+        self.preview_end = None  # última célula do arraste ainda não mostrada
+        self.last_shape = None  # (forma e cantos, trechos): o preview e o desenho final usam os mesmos
+        self.preview_job = None
+        self._viewport_job = None
+
         # =============== #
         self.drawing = False
         self.draw_grid()
 
 
+    @property
+    def timeline(self):
+        return self.document.timeline
+
+    @property
+    def layers(self):
+        """Camadas do quadro atual; as ferramentas desenham na ativa."""
+        return self.document.layers
+
+    @property
+    def history(self):
+        return self.document.history
+
+    @property
+    def pixels(self):
+        """Buffer da camada ativa (RGBA empacotado, 0 = transparente)."""
+        return self.document.pixels
+
+    @property
+    def dirty(self):
+        """Regiões alteradas desde o último flush."""
+        return self.document.dirty
+
+    @property
+    def mirror_mode(self):
+        return self.document.mirror_mode  # OFF, HORIZONTAL, VERTICAL, BOTH
+
+    @mirror_mode.setter
+    def mirror_mode(self, mode):
+        self.document.mirror_mode = mode
+
     def create_ui(self):
         self.main_frame = tk.Frame(self.master)
         self.main_frame.pack(fill="both", expand=True)
@@ -91,6 +160,16 @@ class PixelEditor:
             btn.pack(fill="x", pady=2)
             self.tool_buttons[name] = btn
 
+        # Opções do balde: conectividade e tolerância de cor
+        self.fill_frame = tk.Frame(self.controls)
+        self.fill_frame.pack(pady=2, fill='x')
+        self.fill_connectivity = tk.IntVar(value=4)
+        tk.Checkbutton(self.fill_frame, text="Balde 8 vizinhos", variable=self.fill_connectivity,
+                       onvalue=8, offvalue=4).pack(anchor="w")
+        tk.Label(self.fill_frame, text="Tolerância").pack(side="left")
+        self.fill_tolerance = tk.Spinbox(self.fill_frame, from_=0, to=255, width=4)
+        self.fill_tolerance.pack(side="left")
+
         self.zoom_frame = tk.Frame(self.controls)
         self.zoom_frame.pack(pady=2)
 
@@ -99,34 +178,114 @@ class PixelEditor:
 
         tk.Button(self.controls, text="Grade on/off", command=self.toggle_grid).pack(pady=4, fill='x')
         tk.Button(self.controls, text="Fundo xadrez on/off", command=self.toggle_checker).pack(pady=4, fill='x')
+        tk.Button(self.controls, text="Modo imagem on/off", command=self.toggle_render_mode).pack(pady=4, fill='x')
+        tk.Button(self.controls, text="Modo indexado on/off", command=self.toggle_indexed).pack(pady=4, fill='x')
         tk.Button(self.controls, text="Novo", command=self.clear).pack(pady=4, fill='x')
+        tk.Button(self.controls, text="Tamanho...", command=self.new_document_dialog).pack(pady=4, fill='x')
         tk.Button(self.controls, text="Desfazer", command=self.undo).pack(pady=4, fill='x')
-        tk.Button(self.controls, text="Exportar PNG", command=self.export).pack(pady=4, fill='x')
+        tk.Button(self.controls, text="Refazer", command=self.redo).pack(pady=4, fill='x')
+        tk.Button(self.controls, text="Exportar PNG", command=self.export_dialog).pack(pady=4, fill='x')
+        tk.Button(self.controls, text="Abrir imagem...", command=self.open_image).pack(pady=4, fill='x')
+        tk.Button(self.controls, text="Abrir projeto...", command=self.open_project).pack(pady=4, fill='x')
+        tk.Button(self.controls, text="Salvar projeto", command=self.save_project).pack(pady=4, fill='x')
+
+        # Opções de exportação: escalas do PNG, outros formatos e compressão
+        self.export_frame = tk.Frame(self.controls)
+        self.export_frame.pack(pady=2)
+        tk.Label(self.export_frame, text="PNG").grid(row=0, column=0, sticky="w")
+        self.export_scales = {}
+        for i, scale in enumerate(SCALES):
+            self.export_scales[scale] = tk.IntVar(value=int(scale == 1))
+            tk.Checkbutton(self.export_frame, text=f"{scale}x",
+                           variable=self.export_scales[scale]).grid(row=0, column=i + 1)
+        self.export_formats = {}
+        for i, (fmt, text) in enumerate([("gif", "GIF"), ("sheet", "Folha"), ("raw", "RGBA")]):
+            self.export_formats[fmt] = tk.IntVar(value=0)
+            tk.Checkbutton(self.export_frame, text=text,
+                           variable=self.export_formats[fmt]).grid(row=1, column=i + 1)
+        tk.Label(self.export_frame, text="Compressão").grid(row=2, column=0, sticky="w")
+        self.export_compression = tk.Spinbox(self.export_frame, from_=0, to=9, width=4)
+        self.export_compression.grid(row=2, column=1, columnspan=2)
+        self.export_compression.delete(0, "end")
+        self.export_compression.insert(0, "6")
+        self.export_label = tk.Label(self.export_frame, text="")
+        self.export_label.grid(row=3, column=0, columnspan=5)
+        self.exports = []  # exportações em andamento (exporter.Export)
+        self.export_job = None
+
+        # Quadros da animação
+        self.frames_frame = tk.Frame(self.controls)
+        self.frames_frame.pack(pady=2, fill="x")
+        self.frame_label = tk.Label(self.frames_frame, text="Quadro 1/1")
+        self.frame_label.pack()
+        frame_buttons = tk.Frame(self.frames_frame)
+        frame_buttons.pack()
+        for text, command in [("◀", lambda: self.select_frame(self.timeline.current - 1)),
+                              ("▶", lambda: self.select_frame(self.timeline.current + 1)),
+                              ("+", self.add_frame), ("−", self.remove_frame)]:
+            tk.Button(frame_buttons, text=text, width=3, command=command).pack(side="left")
+        tk.Button(self.frames_frame, text="Papel cebola on/off", command=self.toggle_onion).pack(fill="x")
+        play_frame = tk.Frame(self.frames_frame)
+        play_frame.pack(fill="x")
+        tk.Button(play_frame, text="▶ Tocar", command=self.toggle_playback).pack(side="left")
+        tk.Label(play_frame, text="fps").pack(side="left")
+        self.play_fps = tk.Spinbox(play_frame, from_=1, to=60, width=4)
+        self.play_fps.pack(side="left")
+        self.play_fps.delete(0, "end")
+        self.play_fps.insert(0, "12")
+
+        # Contador de itens do canvas (deve ficar constante durante os traços)
+        self.item_counter_label = tk.Label(self.controls, text="Itens no canvas: 0")
+        self.item_counter_label.pack(pady=4)
+        self._item_counter_job = None
 
         # BINDINGS-atalhos
         self.master.bind("g", lambda e: self.toggle_grid())
         self.master.bind("c", lambda e: self.toggle_checker())
         self.master.bind("<Control-z>", lambda e: self.undo())  # Ctrl+Z
+        self.master.bind("<Control-y>", lambda e: self.redo())  # Ctrl+Y
+        self.master.bind("<Control-Shift-Z>", lambda e: self.redo())
         self.master.bind("<Control-m>", lambda e: self.set_mirror("OFF"))
         self.master.bind("<Control-plus>", lambda e: self.zoom_in())
         self.master.bind("<Control-minus>", lambda e: self.zoom_out())
         self.master.bind("<Control-Shift-A>", lambda e: self.add_current_color_to_palette())
-
-        # Canvas (centro)
-        self.canvas = tk.Canvas(self.main_frame, width=self.cols * self.zoom,
-                                height=self.rows * self.zoom, bg=self.bg_color)
-        self.canvas.pack(side="left", padx=4, pady=4, expand=True)
+        self.master.bind("<F2>", lambda e: self.toggle_perf_hud())
+        self.master.bind("<Shift-F2>", lambda e: self.export_perf_trace())
+        self.master.bind("<F3>", lambda e: self.toggle_dirty_overlay())
+        self.master.bind("<Control-s>", lambda e: self.save_project())
+        self.master.bind("<Control-Shift-S>", lambda e: self.save_project_as())
+        self.master.bind("<Control-o>", lambda e: self.open_project())
+        self.master.bind("<Control-Shift-O>", lambda e: self.open_image())
+        self.master.bind("<comma>", lambda e: self.select_frame(self.timeline.current - 1))
+        self.master.bind("<period>", lambda e: self.select_frame(self.timeline.current + 1))
+
+        # Canvas (centro) com barras de rolagem; só a parte visível é renderizada
+        self.canvas_frame = tk.Frame(self.main_frame)
+        self.canvas_frame.pack(side="left", padx=4, pady=4, fill="both", expand=True)
+        self.canvas = tk.Canvas(self.canvas_frame, width=min(self.cols * self.zoom, 800),
+                                height=min(self.rows * self.zoom, 600), bg=self.bg_color,
+                                scrollregion=(0, 0, self.cols * self.zoom, self.rows * self.zoom),
+                                xscrollcommand=self.on_xscroll, yscrollcommand=self.on_yscroll)
+        self.h_scroll = tk.Scrollbar(self.canvas_frame, orient="horizontal", command=self.canvas.xview)
+        self.v_scroll = tk.Scrollbar(self.canvas_frame, orient="vertical", command=self.canvas.yview)
+        self.canvas.grid(row=0, column=0, sticky="nsew")
+        self.v_scroll.grid(row=0, column=1, sticky="ns")
+        self.h_scroll.grid(row=1, column=0, sticky="ew")
+        self.canvas_frame.rowconfigure(0, weight=1)
+        self.canvas_frame.columnconfigure(0, weight=1)
+        self.renderer = RENDERERS[self.render_mode](self.canvas)
+        self.preview = PreviewLayer(self.canvas, self.color_preview_temp)
 
         self.canvas.bind("<Alt-Button-1>", self.alt_picker)
 
-        self.canvas.bind("<Button-1>", self.start_action)
-        self.canvas.bind("<B1-Motion>", self.draw_action)
-        self.canvas.bind("<ButtonRelease-1>", self.stop_action)
+        self.canvas.bind("<Button-1>", self.perf.wrap("start_action", self.start_action))
+        self.canvas.bind("<B1-Motion>", self.perf.wrap("draw_action", self.draw_action))
+        self.canvas.bind("<ButtonRelease-1>", self.perf.wrap("stop_action", self.stop_action))
 
-        self.canvas.bind("<Button-3>", self.right_click)
-        self.canvas.bind("<B3-Motion>", self.right_drag)
+        self.canvas.bind("<Button-3>", self.perf.wrap("right_click", self.right_click))
+        self.canvas.bind("<B3-Motion>", self.perf.wrap("right_drag", self.right_drag))
 
-        self.canvas.bind("<ButtonRelease-3>", self.stop_action)
+        self.canvas.bind("<ButtonRelease-3>", self.perf.wrap("stop_action", self.stop_action))
 
         # Frame direito para paleta e futuros controles
         self.right_frame = tk.Frame(self.main_frame)
@@ -167,31 +326,152 @@ class PixelEditor:
                                             command=lambda: self.set_mirror("BOTH"))
         self.mirror_both_button.pack(side="left", pady=2,)
 
+        # Camadas (a de cima da lista é a de cima do desenho)
+        tk.Label(self.right_frame, text="Camadas").pack(pady=(8, 2))
+        self.layer_list = tk.Listbox(self.right_frame, height=6, exportselection=False)
+        self.layer_list.pack(fill="x")
+        self.layer_list.bind("<<ListboxSelect>>", self.on_layer_select)
+        self.layer_buttons = tk.Frame(self.right_frame)
+        self.layer_buttons.pack(pady=2)
+        for text, command in [("+", self.add_layer), ("−", self.remove_layer),
+                              ("↑", lambda: self.move_layer(1)), ("↓", lambda: self.move_layer(-1)),
+                              ("👁", self.toggle_layer_visible)]:
+            tk.Button(self.layer_buttons, text=text, width=3, command=command).pack(side="left")
+        self.layer_opacity = tk.Scale(self.right_frame, from_=0, to=100, orient="horizontal",
+                                      label="Opacidade", command=self.on_layer_opacity)
+        self.layer_opacity.pack(fill="x")
+        self.layer_blend = tk.StringVar(value="normal")
+        tk.OptionMenu(self.right_frame, self.layer_blend, *BLEND_MODES,
+                      command=self.on_layer_blend).pack(fill="x")
+        self.update_layer_panel()
+
+    def event_cell(self, event):
+        """Célula (row, col) sob o mouse, já descontando a rolagem do canvas."""
+        return int(self.canvas.canvasy(event.y)) // self.zoom, int(self.canvas.canvasx(event.x)) // self.zoom
+
     # Alt+click = picker
     def alt_picker(self, event):
-        row, col = event.y // self.zoom, event.x // self.zoom
+        row, col = self.event_cell(event)
         if 0 <= row < self.rows and 0 <= col < self.cols:
-            color = self.pixels[row][col]
+            color = self.pixels.get_hex(row, col)
             if color:  # só altera se houver uma cor
                 self.set_color(color)
 
-    # ZOOM
-    # Ajuste na função draw_pixel
-    def draw_pixel(self, row, col, color):
-        """Desenha um único pixel na tela, considerando zoom e fundo quadriculado."""
-        if not (0 <= row < self.rows and 0 <= col < self.cols):
-            return
+    # REGIÕES ALTERADAS
+    def flush(self):
+        """Recompõe os retângulos alterados e pede a repintura deles ao scheduler.
 
-        x0, y0 = col * self.zoom, row * self.zoom
-        x1, y1 = x0 + self.zoom, y0 + self.zoom
-
-        if color is None:
-            # Pixel transparente → desenha o fundo quadriculado
-            fill_color = COR_1 if (row + col) % 2 == 0 else COR_2
+        O modelo (camadas e papel cebola) fica em dia na hora; o canvas só é
+        tocado no próximo quadro, numa única passada para todos os eventos.
+        """
+        if not self.dirty:
+            return
+        rects = self.dirty.take()
+        # Recompõe as camadas (e o papel cebola) só nesses retângulos
+        self.layers.refresh(rects)
+        if self.show_onion:
+            self.onion.refresh(rects, self.layers.view())
+        for rect in rects:
+            self.pending_render.add_rect(*rect)
+        self.scheduler.request()
+
+    def render_pass(self, deadline=None):
+        """Repinta as regiões pendentes até `deadline`; True se alguma ficou para depois."""
+        if not self.pending_render:
+            return False
+        rects = [part for rect in self.pending_render.take() for part in split_rect(rect)]
+        view = self.display_buffer()
+        done = 0
+        for r0, c0, r1, c1 in rects:
+            if deadline is not None and done and time.perf_counter() >= deadline:
+                break
+            self.renderer.update_region(view, r0, c0, r1, c1)
+            done += 1
+        for rect in rects[done:]:
+            self.pending_render.add_rect(*rect)
+        if self.show_dirty:
+            self.draw_dirty_overlay(rects[:done])
+        self.schedule_item_counter()
+        return done < len(rects)
+
+    def toggle_dirty_overlay(self):
+        self.show_dirty = not self.show_dirty
+        if not self.show_dirty:
+            self.canvas.delete("dirty_debug")
+
+    def draw_dirty_overlay(self, rects):
+        """Contorna por alguns instantes as regiões repintadas (depuração)."""
+        z = self.zoom
+        ids = [self.canvas.create_rectangle(c0 * z, r0 * z, c1 * z, r1 * z, outline="magenta",
+                                            width=2, tags="dirty_debug")
+               for r0, c0, r1, c1 in rects]
+        self.master.after(300, lambda: self.canvas.delete(*ids))
+
+    # DESEMPENHO
+    def toggle_perf_hud(self):
+        """Liga/desliga o HUD de desempenho (e a coleta das medições)."""
+        self.perf.enabled = not self.perf.enabled
+        if self.perf.enabled:
+            self.perf.clear()
+            self.update_perf_hud()
         else:
-            fill_color = color
+            if self.hud_job is not None:
+                self.master.after_cancel(self.hud_job)
+                self.hud_job = None
+            self.canvas.delete("perf_hud")
+
+    def update_perf_hud(self):
+        self.hud_job = None
+        perf = self.perf
+        self.canvas.delete("perf_hud")  # o próprio HUD não entra na contagem de itens
+        history_bytes = sum(frame.history.nbytes for frame in self.timeline.frames)
+        perf.record("canvas_items", self.renderer.item_count())
+        perf.record("history_bytes", history_bytes)
+        perf.record("stroke_events", self.stroke_events)
+        perf.record("stroke_coalesced", self.stroke_coalesced)
+
+        lines = []
+        for name in ("start_action", "draw_action", "stop_action", "flush", "render", "idle"):
+            count, mean, peak = perf.stats(name + "_ms")
+            last = perf.last.get(name + "_ms", 0.0)
+            rate = f" {count / WINDOW_SECONDS:>5.0f} ev/s" if name == "draw_action" else ""
+            lines.append(f"{name:<13}{last:7.2f} ms  média {mean:6.2f}  máx {peak:6.2f}{rate}")
+        lines.append(f"coalescidos   {self.stroke_coalesced}/{self.stroke_events} eventos do traço")
+        lines.append(f"quadros       {self.scheduler.frames} ({self.scheduler.deferred} além do orçamento)")
+        lines.append(f"itens         {perf.last['canvas_items']}")
+        lines.append(f"histórico     {history_bytes / 1024:.1f} KB ({len(self.history)} ações no quadro)")
+
+        # Fica no canto visível da janela, acima do desenho
+        x, y = self.canvas.canvasx(8), self.canvas.canvasy(8)
+        text = self.canvas.create_text(x, y, text="\n".join(lines), anchor="nw", fill="#00ff66",
+                                       font=("Courier", 9), tags="perf_hud")
+        box = self.canvas.bbox(text)
+        if box:
+            back = self.canvas.create_rectangle(box[0] - 4, box[1] - 4, box[2] + 4, box[3] + 4,
+                                                fill="black", outline="", tags="perf_hud")
+            self.canvas.tag_lower(back, text)
+        self.hud_job = self.master.after(HUD_INTERVAL_MS, self.update_perf_hud)
+
+    def export_perf_trace(self):
+        """Grava as medições coletadas desde que o HUD foi ligado (CSV)."""
+        path = filedialog.asksaveasfilename(defaultextension=".csv", initialfile="perf_trace.csv",
+                                            filetypes=[("CSV", "*.csv")])
+        if not path:
+            return
+        try:
+            count = self.perf.export_csv(path)
+        except OSError as e:
+            print(f"Não foi possível gravar {path}: {e}")
+            return
+        print(f"{count} medições gravadas em {path}")
+
+    def schedule_item_counter(self):
+        if self._item_counter_job is None:
+            self._item_counter_job = self.master.after_idle(self.update_item_counter)
 
-        self.canvas.create_rectangle(x0, y0, x1, y1, fill=fill_color, width=0)
+    def update_item_counter(self):
+        self._item_counter_job = None
+        self.item_counter_label.config(text=f"Itens no canvas: {self.renderer.item_count()}")
 
     def zoom_in(self):
         self.zoom = min(64, self.zoom + 1)  # incremento menor
@@ -202,13 +482,279 @@ class PixelEditor:
         self.redraw_canvas()
 
     def redraw_canvas(self):
-        self.canvas.config(width=self.cols * self.zoom, height=self.rows * self.zoom)
-        self.canvas.delete("all")
+        self.canvas.config(scrollregion=(0, 0, self.cols * self.zoom, self.rows * self.zoom))
+        self.draw_grid()
+
+    # VIEWPORT
+    def visible_cells(self):
+        """Células [r0, r1) x [c0, c1) que aparecem na janela do canvas."""
+        z = self.zoom
+        x0, y0 = int(self.canvas.canvasx(0)), int(self.canvas.canvasy(0))
+        x1, y1 = x0 + self.canvas.winfo_width(), y0 + self.canvas.winfo_height()
+        r0, c0 = min(self.rows, max(0, y0 // z)), min(self.cols, max(0, x0 // z))
+        return r0, c0, max(r0, min(self.rows, -(-y1 // z))), max(c0, min(self.cols, -(-x1 // z)))
+
+    def render_viewport(self):
+        """Área visível mais uma margem, para rolagens curtas não recarregarem nada."""
+        r0, c0, r1, c1 = self.visible_cells()
+        m = VIEW_MARGIN
+        return max(0, r0 - m), max(0, c0 - m), min(self.rows, r1 + m), min(self.cols, c1 + m)
+
+    def on_xscroll(self, first, last):
+        self.h_scroll.set(first, last)
+        self.schedule_viewport()
+
+    def on_yscroll(self, first, last):
+        self.v_scroll.set(first, last)
+        self.schedule_viewport()
+
+    def schedule_viewport(self):
+        if self._viewport_job is None:
+            self._viewport_job = self.master.after_idle(self.update_viewport)
+
+    def update_viewport(self):
+        """Acompanha a rolagem: renderiza as células que entraram na janela."""
+        self._viewport_job = None
+        r0, c0, r1, c1 = self.visible_cells()
+        v0, u0, v1, u1 = self.renderer.view or (0, 0, 0, 0)
+        if v0 <= r0 and u0 <= c0 and r1 <= v1 and c1 <= u1:
+            return
+        self.renderer.set_viewport(self.display_buffer(), *self.render_viewport())
+        self.schedule_item_counter()
+
+    # CAMADAS
+    def update_layer_panel(self):
+        self.layer_list.delete(0, "end")
+        for i in reversed(range(len(self.layers))):
+            layer = self.layers.layers[i]
+            eye = "👁" if layer.visible else "  "
+            self.layer_list.insert("end", f"{eye} {layer.name} ({round(layer.opacity * 100)}%, {layer.blend})")
+        self.layer_list.selection_set(len(self.layers) - 1 - self.layers.active)
+        layer = self.layers.active_layer
+        self.layer_opacity.set(round(layer.opacity * 100))
+        self.layer_blend.set(layer.blend)
+
+    def layers_changed(self):
+        """Depois de mudar a estrutura ou as propriedades das camadas."""
+        self.end_stroke()
+        self.update_layer_panel()
+        self.update_onion()
+        self.draw_grid()
+
+    # QUADROS
+    def display_buffer(self):
+        """O que o canvas mostra: o quadro atual, com o papel cebola por baixo se ligado."""
+        if self.show_onion and self.onion.display is not None:
+            return self.onion.display
+        return self.layers.view()
+
+    def update_onion(self):
+        if self.show_onion:
+            self.onion.build(self.timeline.neighbours(), self.layers.view())
+        else:
+            self.onion.clear()
+
+    def toggle_onion(self):
+        self.show_onion = not self.show_onion
+        self.update_onion()
         self.draw_grid()
-        for r in range(self.rows):
-            for c in range(self.cols):
-                if self.pixels[r][c]:
-                    self.draw_pixel(r, c, self.pixels[r][c])
+
+    def frames_changed(self):
+        """Depois de trocar de quadro ou mudar a lista de quadros."""
+        self.frame_label.config(text=f"Quadro {self.timeline.current + 1}/{len(self.timeline)}")
+        self.layers_changed()
+
+    def select_frame(self, index):
+        self.end_stroke()
+        self.cancel_preview()
+        self.timeline.select(index)
+        self.frames_changed()
+
+    def add_frame(self):
+        """Novo quadro igual ao atual; os pixels só são copiados onde forem alterados."""
+        self.end_stroke()
+        self.timeline.add_frame(duplicate=True)
+        self.frames_changed()
+
+    def remove_frame(self):
+        self.end_stroke()
+        if self.timeline.remove_frame() is not None:
+            self.frames_changed()
+
+    def toggle_playback(self):
+        if self.play_job is not None:
+            self.stop_playback()
+            return
+        try:
+            fps = max(1, min(60, int(self.play_fps.get())))
+        except ValueError:
+            fps = 12
+        self.end_stroke()
+
+        # Cada quadro vira uma PhotoImage uma única vez; tocar é só trocar a imagem.
+        # Documentos pequenos são ampliados; maiores que PLAYBACK_SIZE, reduzidos
+        # antes de codificar (o PNG e a imagem já saem do tamanho da janela)
+        side = max(self.cols, self.rows)
+        scale = max(1, PLAYBACK_SIZE // side)
+        step = -(-side // PLAYBACK_SIZE)
+        self.play_images = []
+        for frame in self.timeline.frames:
+            view = downsample(frame.layers.view(), step)
+            image = tk.PhotoImage(master=self.master, data=base64.b64encode(png_bytes(view, 1)))
+            if scale > 1:
+                image = image.zoom(scale)
+            self.play_images.append(image)
+
+        self.play_window = tk.Toplevel(self.master)
+        self.play_window.title("Animação")
+        self.play_window.protocol("WM_DELETE_WINDOW", self.stop_playback)
+        self.play_label = tk.Label(self.play_window, image=self.play_images[0], bg=COR_2)
+        self.play_label.pack()
+        self.play_interval = 1 / fps
+        self.play_index = 0
+        self.play_next = time.perf_counter() + self.play_interval
+        self.play_job = self.master.after(int(self.play_interval * 1000), self.play_step)
+
+    def play_step(self):
+        self.play_index = (self.play_index + 1) % len(self.play_images)
+        self.play_label.config(image=self.play_images[self.play_index])
+        # Agenda pelo relógio, não pelo atraso acumulado, para manter o fps
+        self.play_next += self.play_interval
+        delay = max(1, int((self.play_next - time.perf_counter()) * 1000))
+        self.play_job = self.master.after(delay, self.play_step)
+
+    def stop_playback(self):
+        if self.play_job is not None:
+            self.master.after_cancel(self.play_job)
+            self.play_job = None
+        if self.play_window is not None:
+            self.play_window.destroy()
+            self.play_window = None
+        self.play_images = []
+
+    def on_layer_select(self, event=None):
+        selection = self.layer_list.curselection()
+        if not selection:
+            return
+        index = len(self.layers) - 1 - selection[0]
+        if index != self.layers.active:
+            self.end_stroke()
+            self.layers.select(index)
+            self.update_layer_panel()
+
+    def add_layer(self):
+        self.layers.add_layer()
+        self.layers_changed()
+
+    def remove_layer(self):
+        self.end_stroke()
+        if self.document.remove_layer() is not None:
+            self.layers_changed()
+
+    def move_layer(self, offset):
+        self.layers.move_layer(self.layers.active, offset)
+        self.layers_changed()
+
+    def toggle_layer_visible(self):
+        index = self.layers.active
+        self.layers.set_visible(index, not self.layers.layers[index].visible)
+        self.layers_changed()
+
+    def on_layer_opacity(self, value):
+        index = self.layers.active
+        opacity = int(float(value)) / 100
+        if abs(self.layers.layers[index].opacity - opacity) < 1e-9:
+            return
+        self.layers.set_opacity(index, opacity)
+        self.layers_changed()
+
+    def on_layer_blend(self, mode):
+        index = self.layers.active
+        if self.layers.layers[index].blend != mode:
+            self.layers.set_blend(index, mode)
+            self.layers_changed()
+
+    # DOCUMENTO
+    def pick_render_mode(self):
+        return "image" if self.rows * self.cols > AUTO_IMAGE_CELLS else "items"
+
+    def new_document(self, cols, rows):
+        """Troca o documento por um vazio de cols x rows (o histórico é zerado)."""
+        self.set_document(Document(cols, rows, history_budget=self.document.history_budget,
+                                   mirror_mode=self.mirror_mode))
+
+    def set_document(self, document):
+        """Passa a mostrar `document` no lugar do atual."""
+        self.end_stroke()
+        self.cancel_preview()
+        self.stop_playback()
+        # Ninguém mais lê dos projetos do documento anterior (a exportação em
+        # andamento já tem os blocos na memória)
+        for project in self.old_projects + [self.project]:
+            if project is not None:
+                project.close()
+        self.old_projects = []
+        self.project = None
+        self.cols, self.rows = document.cols, document.rows
+        self.document = document
+        self.onion = OnionSkin(self.cols, self.rows)
+        self.canvas.xview_moveto(0)
+        self.canvas.yview_moveto(0)
+        if self.auto_render_mode:
+            self.set_render_mode(self.pick_render_mode(), redraw=False)
+        self.frame_label.config(text=f"Quadro {self.timeline.current + 1}/{len(self.timeline)}")
+        self.update_mirror_buttons()
+        self.update_layer_panel()
+        self.update_onion()
+        self.redraw_canvas()
+
+    def new_document_dialog(self):
+        size = simpledialog.askstring("Novo documento", "Tamanho (largura x altura):",
+                                      initialvalue=f"{self.cols}x{self.rows}", parent=self.master)
+        if not size:
+            return
+        try:
+            cols, rows = (int(v) for v in size.lower().replace(" ", "").split("x"))
+        except ValueError:
+            cols = rows = 0
+        if cols < 1 or rows < 1:
+            print("Tamanho inválido (use, por exemplo, 2048x2048).")
+            return
+        self.new_document(cols, rows)
+
+    # RENDERIZAÇÃO
+    def set_render_mode(self, mode, redraw=True):
+        """Troca o backend de desenho do canvas ("items" ou "image")."""
+        if mode == self.render_mode:
+            return
+        self.renderer.clear()
+        self.render_mode = mode
+        self.renderer = RENDERERS[mode](self.canvas)
+        if redraw:
+            self.draw_grid()
+
+    def toggle_render_mode(self):
+        self.auto_render_mode = False
+        self.set_render_mode("image" if self.render_mode == "items" else "items")
+
+    # MODO INDEXADO
+    def toggle_indexed(self):
+        """Liga/desliga o modo indexado (pixels como índices numa tabela de até 256 cores).
+
+        Converter esvazia o histórico de todos os quadros.
+        """
+        self.end_stroke()
+        self.cancel_preview()
+        if self.document.indexed:
+            self.document.set_indexed(None)
+            print("Modo indexado desligado")
+        else:
+            # As cores da paleta entram primeiro; as da imagem vêm depois
+            table = colors.ColorTable(map(hex_to_packed, self.palette), limit=INDEXED_COLORS)
+            self.document.set_indexed(table)
+            print(f"Modo indexado: {len(table) - 1} cores na tabela")
+        self.update_onion()
+        self.redraw_canvas()
 
     # ESPELHO
     def set_mirror(self, mode):
@@ -218,6 +764,9 @@ class PixelEditor:
         else:
             self.mirror_mode = mode
 
+        self.update_mirror_buttons()
+
+    def update_mirror_buttons(self):
         # Atualiza a cor dos botões para indicar o ativo
         self.mirror_h_button.config(bg="#a0c0ff" if self.mirror_mode == "HORIZONTAL" else "SystemButtonFace")
         self.mirror_v_button.config(bg="#a0c0ff" if self.mirror_mode == "VERTICAL" else "SystemButtonFace")
@@ -226,6 +775,7 @@ class PixelEditor:
     def draw_palette(self):
         for w in self.palette_frame.winfo_children():
             w.destroy()
+        self.palette_buttons = []
 
         cols = 5
         for i in range(self.max_colors):
@@ -239,38 +789,78 @@ class PixelEditor:
                     width=3,
                     height=1,
                     relief="solid",
-                    command=lambda col=color: self.select_color(col)
+                    command=lambda idx=i: self.select_color(self.palette[idx])
                 )
+                # Selecionar ou editar não recria os botões (o segundo clique
+                # do duplo clique precisa achar o mesmo botão): a cor é lida
+                # pelo índice na hora do clique.
                 # clique com botão direito para remover
                 btn.bind("<Button-3>", lambda e, idx=i: self.remove_color(idx))
-                btn.bind("<Shift-Button-1>", lambda e, color=color: (self.select_secondary_color(color), "break")[1])
+                btn.bind("<Shift-Button-1>", lambda e, idx=i: (self.select_secondary_color(self.palette[idx]), "break")[1])
+                # Ctrl+clique troca essa cor pela atual em toda a camada ativa
+                btn.bind("<Control-Button-1>", lambda e, idx=i: (self.replace_palette_color(self.palette[idx]), "break")[1])
+                # duplo clique edita a cor (no modo indexado, recolore a imagem)
+                btn.bind("<Double-Button-1>", lambda e, idx=i: self.edit_palette_color(idx))
 
-
-                if color == getattr(self, "selected_color", None):
-                    btn.config(highlightthickness=8, highlightbackground="black", bd=2)
-                else:
-                    btn.config(highlightthickness=1, highlightbackground="gray", bd=1)
                 btn.grid(row=row_idx, column=col_idx, padx=3, pady=3)
+                self.palette_buttons.append(btn)
             else:
                 # slot vazio
                 lbl = tk.Label(self.palette_frame, bg="#e0e0e0", width=3, height=1, relief="ridge", bd=1)
                 lbl.grid(row=row_idx, column=col_idx, padx=3, pady=3)
+        self.update_palette_indicator()
+
+    def edit_palette_color(self, index):
+        """Troca a cor de uma entrada da paleta.
+
+        No modo indexado, os pixels com essa cor guardam o índice dela na
+        tabela do documento: muda só a entrada da tabela e a tela é repintada
+        uma vez, sem escrever nenhum pixel (desfazer volta a cor da entrada).
+        """
+        if index >= len(self.palette):
+            return
+        old = self.palette[index]
+        color = askcolor(color=old, title="Editar Cor")[1]
+        if not color or color == old:
+            return
+        self.palette[index] = color
+        if self.document.indexed:
+            self.end_stroke()
+            entry = self.document.color_table.ids.get(hex_to_packed(old))
+            if entry and self.document.recolor(entry, hex_to_packed(color)):
+                self.flush()
+                self.update_onion()
+        if self.current_color == old:
+            self.current_color = color
+        if self.selected_color == old:
+            self.selected_color = color
+        self.palette_buttons[index].config(bg=color)
+        self.update_palette_indicator()
+
+    def replace_palette_color(self, color):
+        """Troca todas as células com `color` pela cor atual na camada ativa (um só desfazer)."""
+        if not self.current_color or color == self.current_color:
+            return
+        self.end_stroke()
+        self.cancel_preview()
+        if self.document.replace_color(hex_to_packed(color), hex_to_packed(self.current_color)):
+            self.flush()
 
     def select_color(self, color):
         self.current_color = color
         self.selected_color = color
-        self.draw_palette()
+        self.update_palette_indicator()
 
     def select_secondary_color(self, color):
         self.secondary_color = color
         print(f"Cor secundária definida: {color}")
 
     def update_palette_indicator(self):
-        for btn in self.palette_buttons:
-            if btn["bg"] == self.selected_color:
-                btn.config(highlightthickness=8, highlightbackground="black")
+        for color, btn in zip(self.palette, self.palette_buttons):
+            if color == self.selected_color:
+                btn.config(highlightthickness=8, highlightbackground="black", bd=2)
             else:
-                btn.config(highlightthickness=1, highlightbackground="gray")
+                btn.config(highlightthickness=1, highlightbackground="gray", bd=1)
 
 
     def add_color(self):
@@ -281,7 +871,8 @@ class PixelEditor:
         color = askcolor(title="Escolher Cor")[1]  # retorna cor no formato #RRGGBB
         if color:
             self.palette.append(color)
-            self.select_color(color)
+            self.selected_color = self.current_color = color
+            self.draw_palette()
 
     def remove_color(self, index):
         if index < len(self.palette):
@@ -309,41 +900,31 @@ class PixelEditor:
         self.update_tool_buttons()
 
     def draw_grid(self):
-        self.canvas.delete("all")
         ps = self.zoom
 
-        # Fundo e checker
-        if self.show_checker:
-            for r in range(self.rows):
-                for c in range(self.cols):
-                    if (r + c) % 2 == 0:
-                        x0, y0 = c * ps, r * ps
-                        x1, y1 = x0 + ps, y0 + ps
-                        self.canvas.create_rectangle(x0, y0, x1, y1, fill=COR_1, outline="")
-
-        # Desenha pixels
-        for r in range(self.rows):
-            for c in range(self.cols):
-                color = self.pixels[r][c]
-                if color:
-                    x0, y0 = c * ps, r * ps
-                    x1, y1 = x0 + ps, y0 + ps
-                    self.canvas.create_rectangle(x0, y0, x1, y1, fill=color,
-                                                 outline="" if not self.show_grid else "#c0c0c0")
+        # Fundo, checker e pixels: reaproveita o pool de itens do renderer
+        self.dirty.clear()
+        self.pending_render.clear()
+        self.renderer.sync(self.display_buffer(), self.rows, self.cols, ps,
+                           show_checker=self.show_checker, show_grid=self.show_grid,
+                           viewport=self.render_viewport())
+        self.canvas.delete("mirror_line")
+
         # Linha do mirror
         if getattr(self, "mirror", False):
             self.canvas.create_line(self.cols * ps // 2, 0, self.cols * ps // 2, self.rows * ps,
-                                    fill="red", width=2)
+                                    fill="red", width=2, tags="mirror_line")
 
         # Linha(s) do mirror
         if self.mirror_mode in ("HORIZONTAL", "BOTH"):
             self.canvas.create_line(self.cols * self.zoom // 2, 0,
                                     self.cols * self.zoom // 2, self.rows * self.zoom,
-                                    fill="red", width=2)
+                                    fill="red", width=2, tags="mirror_line")
         if self.mirror_mode in ("VERTICAL", "BOTH"):
             self.canvas.create_line(0, self.rows * self.zoom // 2,
                                     self.cols * self.zoom, self.rows * self.zoom // 2,
-                                    fill="red", width=2)
+                                    fill="red", width=2, tags="mirror_line")
+        self.schedule_item_counter()
 
     # -----------------------------
     # Right Click Handlers corrigidos
@@ -352,56 +933,18 @@ class PixelEditor:
     def right_click(self, event):
         """Botão direito usa cor secundária."""
         self.drawing = True
-        row, col = event.y // self.zoom, event.x // self.zoom
-        self.current_stroke = []
-        self.paint_pixel_with_color(row, col, self.secondary_color)
+        row, col = self.event_cell(event)
+        self.document.begin_action()
+        self.begin_stroke(lambda r, c: self.paint_pixel_with_color(r, c, self.secondary_color), row, col)
 
     def right_drag(self, event):
         """Arrastar com o botão direito também pinta com a cor secundária."""
         if not self.drawing:
             return
-        row, col = event.y // self.zoom, event.x // self.zoom
-        self.paint_pixel_with_color(row, col, self.secondary_color)
-
+        row, col = self.event_cell(event)
+        self.queue_stroke_point(row, col)
 
 
-    # -----------------------------
-    # Mirror Helper
-    # -----------------------------
-    # ---------------------------------
-    # Ajuste em apply_mirror para stroke contínuo
-    # ---------------------------------
-    def apply_mirror(self, row, col, stroke_list=None):
-        # Mirror horizontal
-        if self.mirror_mode in ("HORIZONTAL", "BOTH"):
-            mc = self.cols - 1 - col
-            if mc != col:
-                old_color = self.pixels[row][mc]
-                self.pixels[row][mc] = self.current_color if self.tool != "eraser" else None
-                self.draw_pixel(row, mc, self.pixels[row][mc])
-                if stroke_list is not None:
-                    stroke_list.append((row, mc, old_color))
-
-        # Mirror vertical
-        if self.mirror_mode in ("VERTICAL", "BOTH"):
-            mr = self.rows - 1 - row
-            if mr != row:
-                old_color = self.pixels[mr][col]
-                self.pixels[mr][col] = self.current_color if self.tool != "eraser" else None
-                self.draw_pixel(mr, col, self.pixels[mr][col])
-                if stroke_list is not None:
-                    stroke_list.append((mr, col, old_color))
-
-        # Mirror ambos
-        if self.mirror_mode == "BOTH":
-            mr = self.rows - 1 - row
-            mc = self.cols - 1 - col
-            if mr != row or mc != col:
-                old_color = self.pixels[mr][mc]
-                self.pixels[mr][mc] = self.current_color if self.tool != "eraser" else None
-                self.draw_pixel(mr, mc, self.pixels[mr][mc])
-                if stroke_list is not None:
-                    stroke_list.append((mr, mc, old_color))
 
     def toggle_grid(self):
         self.show_grid = not self.show_grid
@@ -412,7 +955,8 @@ class PixelEditor:
         self.draw_grid()
 
     def clear(self):
-        self.pixels = [[None for _ in range(self.cols)] for _ in range(self.rows)]
+        # "Novo" também pode ser desfeito
+        self.document.clear()
         self.draw_grid()
 
     def choose_color(self):
@@ -420,46 +964,152 @@ class PixelEditor:
         if color:
             self.current_color = color
 
-    def save_state(self):
-        # Faz uma cópia profunda da matriz de pixeis
-        self.undo_stack.append([row[:] for row in self.pixels])
-        # Limitar o tamanho do stack se quiser
-        if len(self.undo_stack) > 20:
-            self.undo_stack.pop(0)
+    # DESFAZER / REFAZER
+    def commit_action(self):
+        """Fecha a ação em andamento: vira um delta compactado no histórico."""
+        self.document.commit_action()
 
     def undo(self):
-        if not self.undo_stack:
-            return  # nada a desfazer
-
-        last_action = self.undo_stack.pop()
-
-        for r, c, old_color in last_action:
-            # Restaura a matriz de pixels
-            self.pixels[r][c] = old_color
-            # Atualiza o canvas
-            self.draw_pixel(r, c, old_color)
-
-        # Limpa preview se houver
-        self.canvas.delete("temp_shape")
-
-    def export(self):
-        from PIL import Image
-        img = Image.new("RGBA", (self.cols, self.rows), (0, 0, 0, 0))  # fundo transparente
-        for r in range(self.rows):
-            for c in range(self.cols):
-                color = self.pixels[r][c]
-                if color:
-                    r_c = int(color[1:3], 16)
-                    g_c = int(color[3:5], 16)
-                    b_c = int(color[5:7], 16)
-                    img.putpixel((c, r), (r_c, g_c, b_c, 255))  # pixel opaco
-        img.save("pixel_art.png")
-        print("Exportado como pixel_art.png (com fundo transparente)")
+        self.after_history(self.document.undo())
+
+    def redo(self):
+        self.after_history(self.document.redo())
+
+    def after_history(self, rects):
+        # Repinta tudo o que mudou num único flush e limpa o preview se houver
+        if rects:
+            self.preview.clear()
+            self.flush()
+
+    def export_dialog(self):
+        path = filedialog.asksaveasfilename(defaultextension=".png", initialfile="pixel_art.png",
+                                            filetypes=[("PNG", "*.png")])
+        if not path:
+            return
+        try:
+            compress_level = min(9, max(0, int(self.export_compression.get())))
+        except ValueError:
+            print("Compressão inválida.")
+            return
+        scales = [scale for scale, var in self.export_scales.items() if var.get()]
+        formats = [fmt for fmt, var in self.export_formats.items() if var.get()]
+        if scales:
+            formats.append("png")
+        if not formats:
+            print("Nada para exportar: escolha uma escala ou um formato.")
+            return
+        self.export_all(os.path.splitext(path)[0], formats, scales, compress_level)
+
+    def export_all(self, base, formats=FORMATS, scales=SCALES, compress_level=6):
+        """Grava os formatos pedidos em segundo plano a partir de uma foto do documento.
+
+        Os arquivos são `exporter.output_paths(base, ...)`; o progresso aparece
+        no painel enquanto se continua desenhando.
+        """
+        self.end_stroke()
+        self.flush()
+        self.exports.append(Export(snapshot(self.document), base, formats, scales, compress_level))
+        if self.export_job is None:
+            self.poll_exports()
+
+    def poll_exports(self):
+        self.export_job = None
+        for task in self.exports:
+            for path, error in task.poll():
+                if error is None:
+                    print(f"Exportado como {path}")
+                else:
+                    print(f"Não foi possível exportar {path}: {error}")
+        done = sum(task.done for task in self.exports)
+        total = sum(task.total for task in self.exports)
+        self.exports = [task for task in self.exports if not task.finished]
+        if self.exports:
+            self.export_label.config(text=f"Exportando {done}/{total}")
+            self.export_job = self.master.after(EXPORT_POLL_MS, self.poll_exports)
+        else:
+            self.export_label.config(text=f"Exportados {done} arquivo(s)")
+
+    # PROJETO
+    def save_project(self, path=None):
+        """Salva o projeto; regravando o mesmo arquivo, só o que mudou é escrito."""
+        if path is None and self.project is None:
+            return self.save_project_as()
+        self.end_stroke()
+        if path is not None and (self.project is None or
+                                 os.path.abspath(path) != os.path.abspath(self.project.path)):
+            # O projeto anterior só é fechado ao trocar de documento: blocos ainda
+            # não lidos apontam para ele
+            if self.project is not None:
+                self.old_projects.append(self.project)
+            # Voltando a um arquivo que ainda está aberto: acrescenta a ele em
+            # vez de reescrevê-lo, senão os blocos ainda não lidos do documento
+            # passariam a apontar para outro conteúdo
+            same = [project for project in self.old_projects
+                    if os.path.abspath(project.path) == os.path.abspath(path)]
+            if same:
+                self.project = same[0]
+                self.old_projects.remove(same[0])
+            else:
+                self.project = Project(path)
+        try:
+            self.project.save(self.document, self.palette)
+        except (OSError, ValueError) as e:
+            print(f"Não foi possível salvar {self.project.path}: {e}")
+            return
+        print(f"Projeto salvo em {self.project.path}")
+
+    def save_project_as(self):
+        path = filedialog.asksaveasfilename(defaultextension=EXTENSION, initialfile="pixel_art" + EXTENSION,
+                                            filetypes=[("Projeto", "*" + EXTENSION)])
+        if path:
+            self.save_project(path)
+
+    def open_project(self, path=None):
+        """Abre um projeto; os blocos de documentos grandes só são lidos quando usados."""
+        if path is None:
+            path = filedialog.askopenfilename(filetypes=[("Projeto", "*" + EXTENSION)])
+            if not path:
+                return
+        project = None
+        try:
+            project = Project.open(path)
+            document, palette = project.load(history_budget=self.document.history_budget)
+        except (OSError, ValueError) as e:
+            if project is not None:
+                project.close()
+            print(f"Não foi possível abrir {path}: {e}")
+            return
+        self.set_document(document)
+        self.project = project
+        self.set_palette(palette)
+
+    def open_image(self, path=None):
+        """Abre um PNG/GIF como documento novo, com a paleta tirada das cores da imagem."""
+        if path is None:
+            path = filedialog.askopenfilename(
+                filetypes=[("Imagens", " ".join("*" + ext for ext in IMAGE_EXTENSIONS)), ("Todos", "*")])
+            if not path:
+                return
+        try:
+            document, palette = load_image(path, palette_size=self.max_colors,
+                                           history_budget=self.document.history_budget,
+                                           mirror_mode=self.mirror_mode)
+        except (OSError, ValueError) as e:  # PIL levanta OSError/ValueError para arquivos ruins
+            print(f"Não foi possível abrir {path}: {e}")
+            return
+        self.set_document(document)
+        self.set_palette(palette)
+
+    def set_palette(self, palette):
+        """Troca a paleta (se vier vazia, fica a atual) e seleciona a primeira cor."""
+        if not palette:
+            return
+        self.palette = list(palette)[:self.max_colors]
+        self.selected_color = self.current_color = self.palette[0]
+        self.draw_palette()
 
     def hex_to_rgba(self, hex_color):
-        hex_color = hex_color.lstrip('#')
-        lv = len(hex_color)
-        return tuple(int(hex_color[i:i+lv//3], 16) for i in range(0, lv, lv//3)) + (255,)
+        return colors.hex_to_rgba(hex_color)
 
     # -----------------------------
     # Mouse Handlers
@@ -467,133 +1117,130 @@ class PixelEditor:
 
     def start_action(self, event):
         self.drawing = True
-        row, col = event.y // self.zoom, event.x // self.zoom
+        row, col = self.event_cell(event)
         self.start_row, self.start_col = row, col
 
         if self.tool == "pencil":
-            self.current_stroke = []
-            self.paint_pixel(row, col)
+            self.document.begin_action()
+            self.begin_stroke(self.paint_pixel, row, col)
         elif self.tool == "eraser":
-            self.current_stroke = []
-            self.erase_pixel(row, col)
+            self.document.begin_action()
+            self.begin_stroke(self.erase_pixel, row, col)
         elif self.tool in ("rectangle", "circle", "line"):
             # preview será tratado no draw_action
             pass
         elif self.tool == "fill":
-            self.current_stroke = []
             self.fill_pixel(row, col)
         elif self.tool == "picker":
             if 0 <= row < self.rows and 0 <= col < self.cols:
-                color = self.pixels[row][col]
+                color = self.pixels.get_hex(row, col)
                 if color:
                     self.set_color(color)  # seleciona a cor no editor
+        self.flush()
 
     def fill_pixel(self, row, col):
-        target_color = self.pixels[row][col]
-        if target_color == self.current_color:
-            return
-
-        pixels_to_fill = [(row, col)]
-        filled = []
-
-        while pixels_to_fill:
-            r, c = pixels_to_fill.pop()
-            if 0 <= r < self.rows and 0 <= c < self.cols:
-                if self.pixels[r][c] == target_color:
-                    old_color = self.pixels[r][c]
-                    self.pixels[r][c] = self.current_color
-                    self.draw_pixel(r, c, self.current_color)
-                    filled.append((r, c, old_color))
-
-                    # Mirror
-                    self.apply_mirror(r, c)
-
-                    # Adiciona vizinhos
-                    pixels_to_fill.extend([
-                        (r + 1, c), (r - 1, c), (r, c + 1), (r, c - 1)
-                    ])
-
-        if filled:
-            self.undo_stack.append(filled)
+        self.fill_bucket_generic(row, col)
 
     # ---------------------------------
-    # paint_pixel e erase_pixel atualizados
+    # Lápis, borracha e botão direito: o documento pinta (com espelho) e grava
     # ---------------------------------
     def paint_pixel(self, row, col):
-        if 0 <= row < self.rows and 0 <= col < self.cols:
-            old_color = self.pixels[row][col]
-            if old_color != self.current_color:
-                self.pixels[row][col] = self.current_color
-                self.draw_pixel(row, col, self.current_color)
-                self.current_stroke.append((row, col, old_color))
-
-                # Aplicar mirror
-                self.apply_mirror(row, col, stroke_list=self.current_stroke)
+        self.document.paint(row, col, hex_to_packed(self.current_color))
 
     def paint_pixel_with_color(self, row, col, color):
         """Desenha pixel com cor específica (para botão direito)."""
-        if 0 <= row < self.rows and 0 <= col < self.cols:
-            old_color = self.pixels[row][col]
-            if old_color != color:
-                self.pixels[row][col] = color
-                self.draw_pixel(row, col, color)
-                self.current_stroke.append((row, col, old_color))
-
-                # Aplicar espelhamento
-                if self.mirror_mode in ("HORIZONTAL", "BOTH"):
-                    mc = self.cols - 1 - col
-                    if mc != col:
-                        old_color_m = self.pixels[row][mc]
-                        self.pixels[row][mc] = color
-                        self.draw_pixel(row, mc, color)
-                        self.current_stroke.append((row, mc, old_color_m))
-
-                if self.mirror_mode in ("VERTICAL", "BOTH"):
-                    mr = self.rows - 1 - row
-                    if mr != row:
-                        old_color_m = self.pixels[mr][col]
-                        self.pixels[mr][col] = color
-                        self.draw_pixel(mr, col, color)
-                        self.current_stroke.append((mr, col, old_color_m))
-
-                if self.mirror_mode == "BOTH":
-                    mr = self.rows - 1 - row
-                    mc = self.cols - 1 - col
-                    if mr != row or mc != col:
-                        old_color_m = self.pixels[mr][mc]
-                        self.pixels[mr][mc] = color
-                        self.draw_pixel(mr, mc, color)
-                        self.current_stroke.append((mr, mc, old_color_m))
+        self.document.paint(row, col, hex_to_packed(color))
 
     def erase_pixel(self, row, col):
-        if 0 <= row < self.rows and 0 <= col < self.cols:
-            old_color = self.pixels[row][col]
-            if old_color is not None:
-                self.pixels[row][col] = None
-                self.draw_pixel(row, col, None)
-                self.current_stroke.append((row, col, old_color))
-
-                # Aplicar mirror
-                self.apply_mirror(row, col, stroke_list=self.current_stroke)
+        self.document.erase(row, col)
 
     def draw_action(self, event):
         if not self.drawing:
             return
-        row, col = event.y // self.zoom, event.x // self.zoom
+        row, col = self.event_cell(event)
 
-        if self.tool == "pencil":
-            self.paint_pixel(row, col)
-        elif self.tool == "eraser":
-            self.erase_pixel(row, col)
-        elif self.tool == "line":
-            self.canvas.delete("temp_shape")
+        if self.tool in ("pencil", "eraser"):
+            self.queue_stroke_point(row, col)
+            return
+        elif self.tool in ("line", "rectangle", "circle"):
+            # O preview acompanha o último ponto, no máximo uma vez por quadro
+            self.preview_end = (row, col)
+            if self.preview_job is None:
+                self.preview_job = self.master.after(STROKE_FRAME_MS, self.update_preview)
+            return
+        self.flush()
+        self.schedule_item_counter()
+
+    def update_preview(self):
+        """Recalcula o contorno da forma e atualiza só as células que mudaram."""
+        self.preview_job = None
+        if not self.drawing or self.start_row is None or self.preview_end is None:
+            return
+        row, col = self.preview_end
+        self.preview_shapes = {}
+        if self.tool == "line":
             self.draw_line_generic(self.start_row, self.start_col, row, col, preview=True)
         elif self.tool == "rectangle":
-            self.canvas.delete("temp_shape")
             self.draw_rectangle_generic(self.start_row, self.start_col, row, col, fill=False, preview=True)
         elif self.tool == "circle":
-            self.canvas.delete("temp_shape")
             self.draw_circle_generic(self.start_row, self.start_col, row, col, fill=False, preview=True)
+        self.preview.show(self.preview_shapes, self.zoom)
+        self.schedule_item_counter()
+
+    def cancel_preview(self):
+        if self.preview_job is not None:
+            self.master.after_cancel(self.preview_job)
+            self.preview_job = None
+        self.preview_end = None
+        self.preview.clear()
+
+    # -----------------------------
+    # Traços: os eventos de movimento só enfileiram pontos; uma vez por
+    # quadro os pontos são ligados com bresenham_line e desenhados juntos
+    # -----------------------------
+    def begin_stroke(self, paint, row, col):
+        self.end_stroke()
+        self.stroke_paint = paint
+        self.stroke_points = []
+        self.stroke_cells = {(row, col)}
+        self.stroke_last = (row, col)
+        self.stroke_events = self.stroke_coalesced = 0
+        paint(row, col)
+        self.flush()
+
+    def queue_stroke_point(self, row, col):
+        if self.stroke_paint is None:
+            return
+        self.stroke_events += 1
+        last = self.stroke_points[-1] if self.stroke_points else self.stroke_last
+        if (row, col) == last:
+            self.stroke_coalesced += 1
+            return
+        self.stroke_points.append((row, col))
+        if self.stroke_job is None:
+            self.stroke_job = self.master.after(STROKE_FRAME_MS, self.flush_stroke)
+
+    def flush_stroke(self):
+        """Desenha os pontos pendentes, sem buracos entre eventos rápidos."""
+        self.stroke_job = None
+        points, self.stroke_points = self.stroke_points, []
+        paint, painted = self.stroke_paint, self.stroke_cells
+        for row, col in points:
+            last_row, last_col = self.stroke_last
+            for c, r in bresenham_line(last_col, last_row, col, row):
+                if (r, c) not in painted:
+                    painted.add((r, c))
+                    paint(r, c)
+            self.stroke_last = (row, col)
+        self.flush()
+
+    def end_stroke(self):
+        if self.stroke_job is not None:
+            self.master.after_cancel(self.stroke_job)
+        if self.stroke_paint is not None:
+            self.flush_stroke()
+        self.stroke_paint = None
+        self.stroke_cells = set()
 
     # ---------------------------------
     # stop_action atualizado
@@ -602,15 +1249,14 @@ class PixelEditor:
         if not self.drawing:
             return
         self.drawing = False
-        row, col = event.y // self.zoom, event.x // self.zoom
+        row, col = self.event_cell(event)
 
         # Apaga o preview ao finalizar
-        self.canvas.delete("temp_shape")
+        self.cancel_preview()
+        self.end_stroke()
 
         if self.tool in ("pencil", "eraser", "fill") or event.num == 3:  # botão direito também
-            if hasattr(self, "current_stroke") and self.current_stroke:
-                self.undo_stack.append(self.current_stroke)
-                self.current_stroke = []
+            self.commit_action()
 
         elif self.tool == "rectangle":
             self.draw_rectangle_generic(self.start_row, self.start_col, row, col, fill=False, preview=False)
@@ -620,168 +1266,44 @@ class PixelEditor:
             self.draw_line_generic(self.start_row, self.start_col, row, col, preview=False)
 
         self.start_row, self.start_col = None, None
+        self.flush()
 
     def draw_rectangle_generic(self, start_row, start_col, end_row, end_col, fill=True, preview=False):
-        r0, r1 = min(start_row, end_row), max(start_row, end_row)
-        c0, c1 = min(start_col, end_col), max(start_col, end_col)
-
-        action_pixels = []
-        pixels_set = set()
-
-        def draw_pixel_safe(r, c):
-            if 0 <= r < self.rows and 0 <= c < self.cols:
-                key = (r, c)
-                if key not in pixels_set:
-                    old_color = self.pixels[r][c]
-                    self.pixels[r][c] = self.current_color
-                    action_pixels.append((r, c, old_color))
-                    self.draw_pixel(r, c, self.current_color)
-                    pixels_set.add(key)
-
-        for r in range(r0, r1 + 1):
-            for c in range(c0, c1 + 1):
-                if fill or r in (r0, r1) or c in (c0, c1):
-                    if preview:
-                        x0, y0 = c * self.zoom, r * self.zoom
-                        x1, y1 = x0 + self.zoom, y0 + self.zoom
-                        self._draw_preview_pixel(r, c)
-                    else:
-                        draw_pixel_safe(r, c)
-
-                        # Mirrors
-                        if self.mirror_mode in ("HORIZONTAL", "BOTH"):
-                            draw_pixel_safe(r, self.cols - 1 - c)
-                        if self.mirror_mode in ("VERTICAL", "BOTH"):
-                            draw_pixel_safe(self.rows - 1 - r, c)
-                        if self.mirror_mode == "BOTH":
-                            draw_pixel_safe(self.rows - 1 - r, self.cols - 1 - c)
-
-        if not preview and action_pixels:
-            self.undo_stack.append(action_pixels)
-
-    # ----------------------------
-    # draw_temp_circle (preview)
-    # ----------------------------
+        self.draw_shape(rect_spans, (start_row, start_col, end_row, end_col, fill), preview)
+
     def draw_circle_generic(self, start_row, start_col, end_row, end_col, fill=True, preview=False):
         """
         Desenha ou faz preview de um círculo/ellipse.
 
-        preview=True -> desenha no canvas como preview (tag 'temp_shape')
+        preview=True -> acumula os trechos em self.preview_shapes
         preview=False -> desenha de fato e atualiza pixels/undo
         """
+        self.draw_shape(ellipse_spans, (start_row, start_col, end_row, end_col, fill), preview)
 
-        if preview:
-            self.canvas.delete("temp_shape")
-
-        # Determina o retângulo que envolve o círculo
-        r0, r1 = min(start_row, end_row), max(start_row, end_row)
-        c0, c1 = min(start_col, end_col), max(start_col, end_col)
-
-        rx = max(1, (c1 - c0) // 2)
-        ry = max(1, (r1 - r0) // 2)
-
-        cx = c0 + rx
-        cy = r0 + ry
-
-        action_pixels = []  # só usado se preview=False
-        pixels_set = set()  # para evitar duplicatas
-
-        # Função auxiliar para desenhar um pixel e registrar no undo
-        def draw_pixel_safe(r, c):
-            if 0 <= r < self.rows and 0 <= c < self.cols:
-                key = (r, c)
-                if key not in pixels_set:
-                    old_color = self.pixels[r][c]
-                    self.pixels[r][c] = self.current_color
-                    action_pixels.append((r, c, old_color))
-                    self.draw_pixel(r, c, self.current_color)
-                    pixels_set.add(key)
-
-        # Bresenham adaptado para elipse
-        x = 0
-        y = ry
-        rx_sq = rx * rx
-        ry_sq = ry * ry
-        dx = 2 * ry_sq * x
-        dy = 2 * rx_sq * y
-
-        # Região 1
-        d1 = ry_sq - (rx_sq * ry) + (0.25 * rx_sq)
-        while dx < dy:
-            points = [
-                (cy + y, cx + x),
-                (cy + y, cx - x),
-                (cy - y, cx + x),
-                (cy - y, cx - x)
-            ]
-            for r, c in points:
-                if preview:
-                    x0, y0 = c * self.zoom, r * self.zoom
-                    x1, y1 = x0 + self.zoom, y0 + self.zoom
-                    self._draw_preview_pixel(r, c)
-                else:
-                    draw_pixel_safe(r, c)
-
-                    # Mirrors
-                    if self.mirror_mode in ("HORIZONTAL", "BOTH"):
-                        draw_pixel_safe(r, self.cols - 1 - c)
-                    if self.mirror_mode in ("VERTICAL", "BOTH"):
-                        draw_pixel_safe(self.rows - 1 - r, c)
-                    if self.mirror_mode == "BOTH":
-                        draw_pixel_safe(self.rows - 1 - r, self.cols - 1 - c)
-
-            if d1 < 0:
-                x += 1
-                dx += 2 * ry_sq
-                d1 += dx + ry_sq
-            else:
-                x += 1
-                y -= 1
-                dx += 2 * ry_sq
-                dy -= 2 * rx_sq
-                d1 += dx - dy + ry_sq
-
-        # Região 2
-        d2 = (ry_sq) * ((x + 0.5) ** 2) + (rx_sq) * ((y - 1) ** 2) - (rx_sq * ry_sq)
-        while y >= 0:
-            points = [
-                (cy + y, cx + x),
-                (cy + y, cx - x),
-                (cy - y, cx + x),
-                (cy - y, cx - x)
-            ]
-            for r, c in points:
-                if preview:
-                    x0, y0 = c * self.zoom, r * self.zoom
-                    x1, y1 = x0 + self.zoom, y0 + self.zoom
-                    self._draw_preview_pixel(r, c)
-                else:
-                    draw_pixel_safe(r, c)
-
-                    # Mirrors
-                    if self.mirror_mode in ("HORIZONTAL", "BOTH"):
-                        draw_pixel_safe(r, self.cols - 1 - c)
-                    if self.mirror_mode in ("VERTICAL", "BOTH"):
-                        draw_pixel_safe(self.rows - 1 - r, c)
-                    if self.mirror_mode == "BOTH":
-                        draw_pixel_safe(self.rows - 1 - r, self.cols - 1 - c)
-
-            if d2 > 0:
-                y -= 1
-                dy -= 2 * rx_sq
-                d2 += rx_sq - dy
-            else:
-                y -= 1
-                x += 1
-                dx += 2 * ry_sq
-                dy -= 2 * rx_sq
-                d2 += dx - dy + rx_sq
+    def draw_shape(self, rasterize, args, preview=False):
+        """Trechos de uma forma: viram preview ou uma ação no documento.
 
-        if not preview and action_pixels:
-            self.undo_stack.append(action_pixels)
+        A forma é rasterizada uma vez por posição: soltar o botão onde o
+        último preview foi mostrado reaproveita os trechos dele.
+        """
+        key = (rasterize, args)
+        if self.last_shape is None or self.last_shape[0] != key:
+            self.last_shape = (key, rasterize(*args))
+        spans = self.last_shape[1]
+        if preview:
+            own, mirrored = self.document.shape_spans(spans)
+            shapes = self.preview_shapes
+            for r, c0, c1 in own:
+                shapes[r, c0, r + 1, c1] = self.current_color
+            for r, c0, c1 in mirrored:
+                shapes.setdefault((r, c0, r + 1, c1), "black")
+            return
+        self.last_shape = None
+        if self.document.draw_spans(spans, hex_to_packed(self.current_color)):
+            self.flush()
 
     def drag_action(self, event):
-        row, col = event.y // self.zoom, event.x // self.zoom
+        row, col = self.event_cell(event)
 
         if self.current_tool == "LINE":
             self.draw_temp_line(event)
@@ -800,64 +1322,23 @@ class PixelEditor:
 
     def adjust_color(self, hex_color, factor, lighten=False):
         """ Clareia ou escurece a cor """
-        hex_color = hex_color.lstrip("#")
-        r, g, b = tuple(int(hex_color[i:i + 2], 16) for i in (0, 2, 4))
-
-        if lighten:
-            # mistura a cor com o branco
-            r = int(r + (255 - r) * (factor - 1))
-            g = int(g + (255 - g) * (factor - 1))
-            b = int(b + (255 - b) * (factor - 1))
-        else:
-            # escurece multiplicando
-            r = int(r * factor)
-            g = int(g * factor)
-            b = int(b * factor)
-
-        r = min(255, max(0, r))
-        g = min(255, max(0, g))
-        b = min(255, max(0, b))
-        return f"#{r:02x}{g:02x}{b:02x}"
+        return colors.adjust(hex_color, factor, lighten)
 
     def lighten_color(self):
         if not self.selected_color:
             return
-        color = self.selected_color
-        r = int(color[1:3], 16)
-        g = int(color[3:5], 16)
-        b = int(color[5:7], 16)
-
-        # Clarear 20%
-        r = min(255, int(r + (255 - r) * 0.2))
-        g = min(255, int(g + (255 - g) * 0.2))
-        b = min(255, int(b + (255 - b) * 0.2))
-
-        new_color = f"#{r:02x}{g:02x}{b:02x}"
-
-        # NÃO altera a paleta
-        self.current_color = new_color
+        # Clarear 20%; NÃO altera a paleta
+        self.current_color = colors.lighten(self.selected_color, 0.2)
         # Mantém a cor selecionada destacada
-        self.draw_palette()
+        self.update_palette_indicator()
 
     def darken_color(self):
         if not self.selected_color:
             return
-        color = self.selected_color
-        r = int(color[1:3], 16)
-        g = int(color[3:5], 16)
-        b = int(color[5:7], 16)
-
-        # Escurecer 20%
-        r = max(0, int(r * 0.8))
-        g = max(0, int(g * 0.8))
-        b = max(0, int(b * 0.8))
-
-        new_color = f"#{r:02x}{g:02x}{b:02x}"
-
-        # NÃO altera a paleta
-        self.current_color = new_color
+        # Escurecer 20%; NÃO altera a paleta
+        self.current_color = colors.darken(self.selected_color, 0.2)
         # Mantém a cor selecionada destacada
-        self.draw_palette()
+        self.update_palette_indicator()
 
     #Adicionar a nova cor à paleta
     def add_current_color_to_palette(self):
@@ -876,179 +1357,33 @@ class PixelEditor:
 
     # BUCKET
     def fill_bucket_generic(self, start_row, start_col, preview=False):
-        target_color = self.pixels[start_row][start_col]
-        if target_color == self.current_color:
-            return
-
-        action_pixels = []
-        pixels_set = set()
-        stack = [(start_row, start_col)]
-
-        def draw_pixel_safe(r, c):
-            if 0 <= r < self.rows and 0 <= c < self.cols:
-                key = (r, c)
-                if key not in pixels_set:
-                    old_color = self.pixels[r][c]
-                    self.pixels[r][c] = self.current_color
-                    action_pixels.append((r, c, old_color))
-                    self.draw_pixel(r, c, self.current_color)
-                    pixels_set.add(key)
-
-        while stack:
-            r, c = stack.pop()
-            if self.pixels[r][c] != target_color:
-                continue
-
-            if preview:
-                x0, y0 = c * self.zoom, r * self.zoom
-                x1, y1 = x0 + self.zoom, y0 + self.zoom
-                self.canvas.create_rectangle(
-                    x0, y0, x1, y1,
-                    fill=self.color_preview_temp,
-                    outline=self.current_color,
-                    width=1,
-                    tags="temp_shape"
-                )
-            else:
-                draw_pixel_safe(r, c)
-                if self.mirror_mode in ("HORIZONTAL", "BOTH"):
-                    draw_pixel_safe(r, self.cols - 1 - c)
-                if self.mirror_mode in ("VERTICAL", "BOTH"):
-                    draw_pixel_safe(self.rows - 1 - r, c)
-                if self.mirror_mode == "BOTH":
-                    draw_pixel_safe(self.rows - 1 - r, self.cols - 1 - c)
-
-            # Adiciona vizinhos
-            for nr, nc in [(r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1)]:
-                if 0 <= nr < self.rows and 0 <= nc < self.cols and self.pixels[nr][nc] == target_color:
-                    stack.append((nr, nc))
-
-        if not preview and action_pixels:
-            self.undo_stack.append(action_pixels)
+        """Balde por varredura de linhas: preenche trechos inteiros de uma vez.
 
-    # Desenha linha
-    def draw_line_generic(self, start_row, start_col, end_row, end_col, preview=False):
-        action_pixels = []
-        pixels_set = set()
-
-        def draw_pixel_safe(r, c):
-            if 0 <= r < self.rows and 0 <= c < self.cols:
-                key = (r, c)
-                if key not in pixels_set:
-                    old_color = self.pixels[r][c]
-                    self.pixels[r][c] = self.current_color
-                    action_pixels.append((r, c, old_color))
-                    self.draw_pixel(r, c, self.current_color)
-                    pixels_set.add(key)
-
-        r0, c0, r1, c1 = start_row, start_col, end_row, end_col
-        dr = abs(r1 - r0)
-        dc = abs(c1 - c0)
-        sr = 1 if r0 < r1 else -1
-        sc = 1 if c0 < c1 else -1
-        err = dr - dc
-
-        while True:
-            if preview:
-                # Usar função de preview que já trata mirror
-                self._draw_preview_pixel(r0, c0)
-            else:
-                draw_pixel_safe(r0, c0)
-                # Mirror real
-                if self.mirror_mode in ("HORIZONTAL", "BOTH"):
-                    draw_pixel_safe(r0, self.cols - 1 - c0)
-                if self.mirror_mode in ("VERTICAL", "BOTH"):
-                    draw_pixel_safe(self.rows - 1 - r0, c0)
-                if self.mirror_mode == "BOTH":
-                    draw_pixel_safe(self.rows - 1 - r0, self.cols - 1 - c0)
-
-            if r0 == r1 and c0 == c1:
-                break
-            e2 = 2 * err
-            if e2 > -dc:
-                err -= dc
-                r0 += sr
-            if e2 < dr:
-                err += dr
-                c0 += sc
+        O espelho é aplicado aos trechos (não célula a célula) e todo o
+        resultado vai para a tela num único flush.
+        """
+        color = hex_to_packed(self.current_color)
+        connectivity = self.fill_connectivity.get()
+        tolerance = self.fill_tolerance_value()
 
-        if not preview and action_pixels:
-            self.undo_stack.append(action_pixels)
+        if preview:
+            # Calcula a região numa cópia e mostra um retângulo por trecho
+            runs = self.document.fill_runs(start_row, start_col, color, connectivity, tolerance)
+            self.preview.show({(r, c0, r + 1, c1): self.current_color for r, c0, c1 in runs}, self.zoom)
+            return
 
+        if self.document.fill(start_row, start_col, color, connectivity, tolerance):
+            self.flush()
 
-    def _draw_mirror_pixels(self, r, c, action_pixels):
-        # Mirror horizontal
-        if self.mirror_mode in ("HORIZONTAL", "BOTH"):
-            mirror_c = self.cols - 1 - c
-            old_color_m = self.pixels[r][mirror_c]
-            self.pixels[r][mirror_c] = self.current_color
-            action_pixels.append((r, mirror_c, old_color_m))
-            self.draw_pixel(r, mirror_c, self.current_color)
+    def fill_tolerance_value(self):
+        try:
+            return max(0, min(255, int(self.fill_tolerance.get())))
+        except ValueError:
+            return 0
 
-        # Mirror vertical
-        if self.mirror_mode in ("VERTICAL", "BOTH"):
-            mirror_r = self.rows - 1 - r
-            old_color_m = self.pixels[mirror_r][c]
-            self.pixels[mirror_r][c] = self.current_color
-            action_pixels.append((mirror_r, c, old_color_m))
-            self.draw_pixel(mirror_r, c, self.current_color)
-
-        # Mirror ambos
-        if self.mirror_mode == "BOTH":
-            mirror_r = self.rows - 1 - r
-            mirror_c = self.cols - 1 - c
-            old_color_m = self.pixels[mirror_r][mirror_c]
-            self.pixels[mirror_r][mirror_c] = self.current_color
-            action_pixels.append((mirror_r, mirror_c, old_color_m))
-            self.draw_pixel(mirror_r, mirror_c, self.current_color)
-
-    def _draw_preview_pixel(self, row, col):
-        """Desenha um pixel de preview considerando mirror."""
-        x0, y0 = col * self.zoom, row * self.zoom
-        x1, y1 = x0 + self.zoom, y0 + self.zoom
-        self.canvas.create_rectangle(
-            x0, y0, x1, y1,
-            fill=self.color_preview_temp,
-            outline=self.current_color,
-            width=1,
-            tags="temp_shape"
-        )
-
-        # Mirror horizontal
-        if self.mirror_mode in ("HORIZONTAL", "BOTH"):
-            mc = self.cols - 1 - col
-            if mc != col:
-                x0, y0 = mc * self.zoom, row * self.zoom
-                x1, y1 = x0 + self.zoom, y0 + self.zoom
-                self.canvas.create_rectangle(x0, y0, x1, y1,
-                                             fill=self.color_preview_temp,
-                                             outline="black",
-                                             width=1,
-                                             tags="temp_shape")
-
-        # Mirror vertical
-        if self.mirror_mode in ("VERTICAL", "BOTH"):
-            mr = self.rows - 1 - row
-            if mr != row:
-                x0, y0 = col * self.zoom, mr * self.zoom
-                x1, y1 = x0 + self.zoom, y0 + self.zoom
-                self.canvas.create_rectangle(x0, y0, x1, y1,
-                                             fill=self.color_preview_temp,
-                                             outline="black",
-                                             width=1,
-                                             tags="temp_shape")
-
-        # Mirror ambos
-        if self.mirror_mode == "BOTH":
-            mr, mc = self.rows - 1 - row, self.cols - 1 - col
-            if (mr != row or mc != col):
-                x0, y0 = mc * self.zoom, mr * self.zoom
-                x1, y1 = x0 + self.zoom, y0 + self.zoom
-                self.canvas.create_rectangle(x0, y0, x1, y1,
-                                             fill=self.color_preview_temp,
-                                             outline="black",
-                                             width=1,
-                                             tags="temp_shape")
+    # Desenha linha
+    def draw_line_generic(self, start_row, start_col, end_row, end_col, preview=False):
+        self.draw_shape(line_spans, (start_row, start_col, end_row, end_col), preview)
 
 
 if __name__ == "__main__":
@@ -1079,14 +1414,19 @@ if __name__ == "__main__":
     root.bind("<Control-equal>", lambda e: editor.zoom_in())  # algumas teclas + usam "="
     root.bind("<Control-minus>", lambda e: editor.zoom_out())
 
-    # --- Scroll para zoom ---
+    # --- Scroll para zoom (com Ctrl) ou rolagem do canvas ---
     def on_mouse_wheel(event):
+        up = event.delta > 0 or event.num == 4  # roda para cima
         if event.state & 0x0004:  # Ctrl pressionado
-            if event.delta > 0 or event.num == 4:  # roda para cima
+            if up:
                 editor.zoom = min(64, editor.zoom + 1)  # incremento de 1px
             else:  # roda para baixo
                 editor.zoom = max(1, editor.zoom - 1)
             editor.redraw_canvas()
+        elif event.state & 0x0001:  # Shift: rolagem horizontal
+            editor.canvas.xview_scroll(-3 if up else 3, "units")
+        else:
+            editor.canvas.yview_scroll(-3 if up else 3, "units")
 
 
     # Bind Windows / Mac / Linux
@@ -0,0 +1,830 @@
+# Armazenamento compacto dos pixels do documento
+import sys
+from array import array
+
+# As conversões de cor moram em colors; continuam importáveis daqui
+from colors import TRANSPARENT, hex_to_packed, packed_to_hex, unpack_rgba
+
+# Código de tipo com 4 bytes por item (em algumas plataformas "I" tem 2 bytes)
+TYPECODE = "I" if array("I").itemsize == 4 else "L"
+
+CHUNK = 64  # lado dos blocos do ChunkedBuffer, em células
+CHUNKED_CELLS = 1024 * 1024  # documentos maiores que isso usam ChunkedBuffer
+INDEXED_COLORS = 256  # entradas da paleta de um IndexedBuffer (índices de 1 byte)
+
+_numpy = False  # False = ainda não tentou importar
+
+
+def numpy():
+    """O módulo NumPy, ou None se não estiver instalado.
+
+    NumPy é opcional (sem ele tudo funciona com array('I')) e só é importado
+    no primeiro uso: importar este módulo continua barato para scripts.
+    """
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+        _numpy = np
+    return _numpy
+
+
+class PixelBuffer:
+    """Matriz rows x cols de cores RGBA empacotadas num único array contíguo.
+
+    Cada célula ocupa 4 bytes (0 = transparente), então um documento 1024x1024
+    usa 4 MB. Os dados ficam em `self.data` (array, linha por linha) e
+    `memoryview()` os expõe sem cópia; com NumPy disponível, `as_numpy()`
+    devolve uma visão 2D sem cópia. `share()` cria outro buffer sobre os
+    mesmos dados, copiados só na primeira escrita (copy-on-write).
+    """
+
+    def __init__(self, cols, rows, data=None):
+        self.cols = cols
+        self.rows = rows
+        if data is None:
+            data = array(TYPECODE, bytes(4 * cols * rows))
+        elif len(data) != cols * rows:
+            raise ValueError(f"esperados {cols * rows} pixels, recebidos {len(data)}")
+        self.data = data
+        self._share = [1]  # quantos buffers usam `data` (a lista é a mesma em todos eles)
+
+    def __repr__(self):
+        return f"PixelBuffer({self.cols}x{self.rows})"
+
+    # Acesso por célula
+    def in_bounds(self, row, col):
+        return 0 <= row < self.rows and 0 <= col < self.cols
+
+    def index(self, row, col):
+        return row * self.cols + col
+
+    def get(self, row, col):
+        return self.data[row * self.cols + col]
+
+    def set(self, row, col, value):
+        if self._share[0] > 1:
+            self._own()
+        self.data[row * self.cols + col] = value
+
+    def __getitem__(self, pos):
+        row, col = pos
+        return self.data[row * self.cols + col]
+
+    def __setitem__(self, pos, value):
+        if self._share[0] > 1:
+            self._own()
+        row, col = pos
+        self.data[row * self.cols + col] = value
+
+    def get_hex(self, row, col):
+        return packed_to_hex(self.data[row * self.cols + col])
+
+    def set_hex(self, row, col, color):
+        self.set(row, col, hex_to_packed(color))
+
+    # Acesso por linha / coluna / trecho
+    def row(self, row):
+        """Visão (memoryview, sem cópia) de uma linha inteira."""
+        start = row * self.cols
+        return self.memoryview()[start:start + self.cols]
+
+    def col(self, col):
+        """Cópia de uma coluna inteira."""
+        return self.data[col::self.cols]
+
+    def span(self, row, c0, c1):
+        """Cópia das células [c0, c1) de uma linha."""
+        start = row * self.cols
+        return self.data[start + c0:start + c1]
+
+    def set_span(self, row, c0, values):
+        if self._share[0] > 1:
+            self._own()
+        start = row * self.cols + c0
+        self.data[start:start + len(values)] = values
+
+    def fill_span(self, row, c0, c1, value):
+        if self._share[0] > 1:
+            self._own()
+        start = row * self.cols
+        self.data[start + c0:start + c1] = array(TYPECODE, [value]) * (c1 - c0)
+
+    # Compartilhamento (copy-on-write)
+    def share(self):
+        """Outro buffer com os mesmos dados; quem escrever enquanto houver outro faz a cópia."""
+        other = PixelBuffer(self.cols, self.rows, self.data)
+        self._share[0] += 1
+        other._share = self._share
+        return other
+
+    def _own(self):
+        self._share[0] -= 1
+        self._share = [1]
+        self.data = self.data[:]
+
+    # Buffer inteiro
+    def clear(self):
+        self._share[0] -= 1
+        self._share = [1]
+        self.data = array(TYPECODE, bytes(4 * self.cols * self.rows))
+
+    def populated(self, r0, c0, r1, c1):
+        """Partes de [r0, r1) x [c0, c1) que podem ter cor; aqui, a região inteira."""
+        r0, c0 = max(0, r0), max(0, c0)
+        r1, c1 = min(self.rows, r1), min(self.cols, c1)
+        if r0 < r1 and c0 < c1:
+            yield r0, c0, r1, c1
+
+    def prune(self):
+        """Nada a liberar: o buffer é denso (veja ChunkedBuffer.prune)."""
+
+    def copy(self):
+        return PixelBuffer(self.cols, self.rows, self.data[:])
+
+    def memoryview(self):
+        """Os dados (uint32 por célula) pelo protocolo de buffer, sem cópia."""
+        return memoryview(self.data)
+
+    def tobytes(self):
+        """Bytes RGBA linha por linha, prontos para Image.frombuffer("RGBA", ...)."""
+        if sys.byteorder == "little":
+            return self.data.tobytes()
+        swapped = self.data[:]
+        swapped.byteswap()
+        return swapped.tobytes()
+
+    def rgba_view(self):
+        """Buffer RGBA para o PIL: visão sem cópia quando a máquina é little-endian."""
+        if sys.byteorder == "little":
+            return self.memoryview().cast("B")
+        return self.tobytes()
+
+    def as_numpy(self):
+        """Visão 2D (rows, cols) uint32 dos mesmos dados, ou None sem NumPy.
+
+        Se os dados estiverem compartilhados, a cópia é feita antes, para que
+        escrever pela visão não altere outro buffer.
+        """
+        np = numpy()
+        if np is None:
+            return None
+        if self._share[0] > 1:
+            self._own()
+        return np.frombuffer(self.memoryview(), dtype=np.uint32).reshape(self.rows, self.cols)
+
+    @property
+    def nbytes(self):
+        return len(self.data) * self.data.itemsize
+
+
+class ChunkedBuffer:
+    """Documento esparso: blocos de CHUNK x CHUNK células alocados na primeira escrita.
+
+    Blocos nunca escritos não ocupam memória e são lidos como transparentes,
+    então um 16384x16384 com poucos sprites custa só os blocos usados. Cada
+    escrita marca o bloco em `dirty_chunks`; `prune` libera os marcados que
+    voltaram a ficar vazios. A interface por célula e por trecho é a mesma do
+    PixelBuffer, e `populated` diz quais partes de uma região têm blocos.
+    Com `share()`, dois buffers usam os mesmos blocos até um deles escrever
+    num bloco; só esse bloco é copiado. Blocos em `pending` ainda estão no
+    arquivo do projeto e só são lidos no primeiro acesso.
+    """
+
+    def __init__(self, cols, rows, chunk=CHUNK):
+        self.cols = cols
+        self.rows = rows
+        self.chunk = chunk
+        self.chunks = {}  # (linha do bloco, coluna do bloco) -> array chunk*chunk
+        self.dirty_chunks = set()  # blocos escritos desde o último prune
+        self.shared = {}  # bloco compartilhado -> [quantos buffers o usam]
+        self.pending = {}  # bloco ainda não lido -> função que devolve o array (project.py)
+
+    def __repr__(self):
+        return f"ChunkedBuffer({self.cols}x{self.rows}, {len(self.chunks)} blocos)"
+
+    def _new_block(self, key):
+        block = self.chunks[key] = array(TYPECODE, bytes(4 * self.chunk * self.chunk))
+        return block
+
+    def _load(self, key):
+        block = self.chunks[key] = self.pending.pop(key)()
+        return block
+
+    def _own(self, key):
+        refs = self.shared.pop(key)
+        refs[0] -= 1
+        if refs[0] == 0:  # os outros já copiaram: o bloco é só nosso
+            return self.chunks[key]
+        block = self.chunks[key] = self.chunks[key][:]
+        return block
+
+    # Acesso por célula
+    def in_bounds(self, row, col):
+        return 0 <= row < self.rows and 0 <= col < self.cols
+
+    def index(self, row, col):
+        return row * self.cols + col
+
+    def get(self, row, col):
+        n = self.chunk
+        key = (row // n, col // n)
+        block = self.chunks.get(key)
+        if block is None:
+            if key not in self.pending:
+                return TRANSPARENT
+            block = self._load(key)
+        return block[(row % n) * n + col % n]
+
+    def set(self, row, col, value):
+        n = self.chunk
+        key = (row // n, col // n)
+        block = self.chunks.get(key)
+        if block is None and key in self.pending:
+            block = self._load(key)
+        if block is None:
+            if value == TRANSPARENT:
+                return
+            block = self._new_block(key)
+        elif key in self.shared:
+            block = self._own(key)
+        block[(row % n) * n + col % n] = value
+        self.dirty_chunks.add(key)
+
+    def __getitem__(self, pos):
+        return self.get(*pos)
+
+    def __setitem__(self, pos, value):
+        self.set(pos[0], pos[1], value)
+
+    def get_hex(self, row, col):
+        return packed_to_hex(self.get(row, col))
+
+    def set_hex(self, row, col, color):
+        self.set(row, col, hex_to_packed(color))
+
+    # Acesso por linha / coluna / trecho
+    def _pieces(self, row, c0, c1):
+        # Divide [c0, c1) de uma linha pelos blocos: (chave, início no bloco, c, fim)
+        n = self.chunk
+        cr, offset = divmod(row, n)
+        offset *= n
+        c = c0
+        while c < c1:
+            cc, x = divmod(c, n)
+            end = min(c1, (cc + 1) * n)
+            yield (cr, cc), offset + x, c, end
+            c = end
+
+    def row(self, row):
+        """Cópia de uma linha inteira (não há memória contígua para uma visão)."""
+        return self.span(row, 0, self.cols)
+
+    def col(self, col):
+        return array(TYPECODE, (self.get(row, col) for row in range(self.rows)))
+
+    def span(self, row, c0, c1):
+        """Cópia das células [c0, c1) de uma linha."""
+        out = array(TYPECODE)
+        for key, start, c, end in self._pieces(row, c0, c1):
+            block = self.chunks.get(key)
+            if block is None and key in self.pending:
+                block = self._load(key)
+            if block is None:
+                out.frombytes(bytes(4 * (end - c)))
+            else:
+                out.extend(block[start:start + end - c])
+        return out
+
+    def set_span(self, row, c0, values):
+        for key, start, c, end in self._pieces(row, c0, c0 + len(values)):
+            part = values[c - c0:end - c0]
+            block = self.chunks.get(key)
+            if block is None and key in self.pending:
+                block = self._load(key)
+            if block is None:
+                if not any(part):
+                    continue
+                block = self._new_block(key)
+            elif key in self.shared:
+                block = self._own(key)
+            block[start:start + end - c] = part
+            self.dirty_chunks.add(key)
+
+    def fill_span(self, row, c0, c1, value):
+        for key, start, c, end in self._pieces(row, c0, c1):
+            block = self.chunks.get(key)
+            if block is None and key in self.pending:
+                block = self._load(key)
+            if block is None:
+                if value == TRANSPARENT:
+                    continue
+                block = self._new_block(key)
+            elif key in self.shared:
+                block = self._own(key)
+            block[start:start + end - c] = array(TYPECODE, [value]) * (end - c)
+            self.dirty_chunks.add(key)
+
+    # Compartilhamento (copy-on-write por bloco)
+    def share(self):
+        """Outro buffer com os mesmos blocos; cada bloco é copiado na primeira escrita."""
+        other = ChunkedBuffer(self.cols, self.rows, self.chunk)
+        other.chunks = dict(self.chunks)
+        other.pending = dict(self.pending)
+        for key in self.chunks:
+            refs = self.shared.get(key)
+            if refs is None:
+                refs = self.shared[key] = [1]
+            refs[0] += 1
+            other.shared[key] = refs
+        return other
+
+    # Buffer inteiro
+    def clear(self):
+        for refs in self.shared.values():
+            refs[0] -= 1
+        self.chunks = {}
+        self.dirty_chunks = set()
+        self.shared = {}
+        self.pending = {}
+
+    def populated(self, r0, c0, r1, c1):
+        """Partes de [r0, r1) x [c0, c1) cobertas por blocos alocados."""
+        n = self.chunk
+        r0, c0 = max(0, r0), max(0, c0)
+        r1, c1 = min(self.rows, r1), min(self.cols, c1)
+        keys = self.chunks.keys() | self.pending.keys() if self.pending else self.chunks
+        for cr, cc in sorted(keys):
+            y0, x0 = max(r0, cr * n), max(c0, cc * n)
+            y1, x1 = min(r1, (cr + 1) * n), min(c1, (cc + 1) * n)
+            if y0 < y1 and x0 < x1:
+                yield y0, x0, y1, x1
+
+    def prune(self):
+        """Libera os blocos escritos desde o último prune que ficaram vazios."""
+        for key in self.dirty_chunks:
+            block = self.chunks.get(key)
+            if block is not None and not any(block):
+                del self.chunks[key]
+                refs = self.shared.pop(key, None)
+                if refs is not None:
+                    refs[0] -= 1
+        self.dirty_chunks = set()
+
+    def copy(self):
+        other = ChunkedBuffer(self.cols, self.rows, self.chunk)
+        other.chunks = {key: block[:] for key, block in self.chunks.items()}
+        other.pending = dict(self.pending)
+        return other
+
+    def load_all(self):
+        """Lê do arquivo os blocos que ainda faltam."""
+        for key in list(self.pending):
+            self._load(key)
+
+    def flatten(self):
+        """Array denso linha por linha (como PixelBuffer.data), montado só a partir dos blocos."""
+        self.load_all()
+        data = array(TYPECODE, bytes(4 * self.cols * self.rows))
+        n, cols = self.chunk, self.cols
+        for (cr, cc), block in self.chunks.items():
+            x0 = cc * n
+            width = min(n, cols - x0)
+            for y in range(min(n, self.rows - cr * n)):
+                start = (cr * n + y) * cols + x0
+                data[start:start + width] = block[y * n:y * n + width]
+        return data
+
+    def memoryview(self):
+        return memoryview(self.flatten())
+
+    def tobytes(self):
+        data = self.flatten()
+        if sys.byteorder != "little":
+            data.byteswap()
+        return data.tobytes()
+
+    def rgba_view(self):
+        if sys.byteorder == "little":
+            return memoryview(self.flatten()).cast("B")
+        return self.tobytes()
+
+    def as_numpy(self):
+        """Sem visão contígua para o NumPy: quem precisar usa flatten()."""
+        return None
+
+    @property
+    def nbytes(self):
+        return 4 * self.chunk * self.chunk * len(self.chunks)
+
+
+class IndexedBuffer:
+    """Imagem indexada: um byte por célula, índice na tabela de cores `palette`.
+
+    Por fora se comporta como o PixelBuffer (get, span e set_span recebem e
+    devolvem cores empacotadas), então ferramentas, camadas e histórico não
+    mudam. A tabela (ColorTable) é compartilhada por todas as camadas do
+    documento: trocar a cor de uma entrada muda todas as células com aquele
+    índice sem escrever nenhuma. Cores novas ganham entrada; com a tabela
+    cheia, viram a entrada mais parecida.
+    """
+
+    def __init__(self, cols, rows, palette, data=None):
+        self.cols = cols
+        self.rows = rows
+        self.palette = palette
+        if data is None:
+            data = bytearray(cols * rows)
+        elif len(data) != cols * rows:
+            raise ValueError(f"esperados {cols * rows} pixels, recebidos {len(data)}")
+        self.data = data
+        self._share = [1]
+
+    def __repr__(self):
+        return f"IndexedBuffer({self.cols}x{self.rows}, {len(self.palette)} cores)"
+
+    @classmethod
+    def from_buffer(cls, buf, palette):
+        """Converte qualquer buffer de cores empacotadas para índices em `palette`."""
+        intern = palette.intern
+        data = bytearray(buf.cols * buf.rows)
+        for r in range(buf.rows):
+            start = r * buf.cols
+            for c0, c1, value in color_runs(buf.span(r, 0, buf.cols)):
+                if value:
+                    data[start + c0:start + c1] = bytes((intern(value),)) * (c1 - c0)
+        return cls(buf.cols, buf.rows, palette, data)
+
+    # Acesso por célula
+    def in_bounds(self, row, col):
+        return 0 <= row < self.rows and 0 <= col < self.cols
+
+    def index(self, row, col):
+        return row * self.cols + col
+
+    def get(self, row, col):
+        return self.palette.values[self.data[row * self.cols + col]]
+
+    def set(self, row, col, value):
+        if self._share[0] > 1:
+            self._own()
+        self.data[row * self.cols + col] = self.palette.intern(value)
+
+    def __getitem__(self, pos):
+        row, col = pos
+        return self.get(row, col)
+
+    def __setitem__(self, pos, value):
+        row, col = pos
+        self.set(row, col, value)
+
+    def get_hex(self, row, col):
+        return packed_to_hex(self.get(row, col))
+
+    def set_hex(self, row, col, color):
+        self.set(row, col, hex_to_packed(color))
+
+    # Acesso por linha / coluna / trecho (sempre cópias, já em cores empacotadas)
+    def row(self, row):
+        return self.span(row, 0, self.cols)
+
+    def col(self, col):
+        return array(TYPECODE, map(self.palette.values.__getitem__, self.data[col::self.cols]))
+
+    def span(self, row, c0, c1):
+        start = row * self.cols
+        return array(TYPECODE, map(self.palette.values.__getitem__, self.data[start + c0:start + c1]))
+
+    def set_span(self, row, c0, values):
+        if self._share[0] > 1:
+            self._own()
+        start = row * self.cols + c0
+        intern = self.palette.intern
+        for s0, s1, value in color_runs(values):
+            self.data[start + s0:start + s1] = bytes((intern(value),)) * (s1 - s0)
+
+    def fill_span(self, row, c0, c1, value):
+        if self._share[0] > 1:
+            self._own()
+        start = row * self.cols
+        self.data[start + c0:start + c1] = bytes((self.palette.intern(value),)) * (c1 - c0)
+
+    # Compartilhamento (copy-on-write)
+    def share(self):
+        other = IndexedBuffer(self.cols, self.rows, self.palette, self.data)
+        self._share[0] += 1
+        other._share = self._share
+        return other
+
+    def _own(self):
+        self._share[0] -= 1
+        self._share = [1]
+        self.data = bytearray(self.data)
+
+    # Buffer inteiro
+    def clear(self):
+        self._share[0] -= 1
+        self._share = [1]
+        self.data = bytearray(self.cols * self.rows)
+
+    def populated(self, r0, c0, r1, c1):
+        r0, c0 = max(0, r0), max(0, c0)
+        r1, c1 = min(self.rows, r1), min(self.cols, c1)
+        if r0 < r1 and c0 < c1:
+            yield r0, c0, r1, c1
+
+    def prune(self):
+        """Nada a liberar: o buffer é denso."""
+
+    def copy(self):
+        return IndexedBuffer(self.cols, self.rows, self.palette, bytearray(self.data))
+
+    def indices(self):
+        """Os índices, um byte por célula, linha por linha (para PNG modo "P")."""
+        return bytes(self.data)
+
+    def flatten(self):
+        """Array denso de cores empacotadas, como PixelBuffer.data."""
+        return array(TYPECODE, map(self.palette.values.__getitem__, self.data))
+
+    def memoryview(self):
+        return memoryview(self.flatten())
+
+    def tobytes(self):
+        data = self.flatten()
+        if sys.byteorder != "little":
+            data.byteswap()
+        return data.tobytes()
+
+    def rgba_view(self):
+        return self.tobytes()
+
+    def as_numpy(self):
+        """Sem visão de cores empacotadas para o NumPy: quem precisar usa flatten()."""
+        return None
+
+    @property
+    def nbytes(self):
+        return len(self.data)
+
+
+def indexed_factory(palette):
+    """Função (cols, rows) -> IndexedBuffer vazio sobre a paleta dada (para camadas novas)."""
+    return lambda cols, rows: IndexedBuffer(cols, rows, palette)
+
+
+def png_bytes(buf, compress_level=6):
+    """Codifica o buffer como PNG RGBA (só com zlib, sem PIL)."""
+    import struct
+    import zlib
+
+    def chunk(kind, payload):
+        return (struct.pack(">I", len(payload)) + kind + payload
+                + struct.pack(">I", zlib.crc32(kind + payload) & 0xFFFFFFFF))
+
+    raw = bytearray()
+    for r in range(buf.rows):
+        line = buf.span(r, 0, buf.cols)
+        if sys.byteorder != "little":
+            line.byteswap()
+        raw += b"\x00"  # filtro "None" em cada linha
+        raw += line.tobytes()
+    header = struct.pack(">IIBBBBB", buf.cols, buf.rows, 8, 6, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(bytes(raw), compress_level)) + chunk(b"IEND", b""))
+
+
+def downsample(buf, step):
+    """Uma célula a cada `step` em cada direção (vizinho mais próximo), num PixelBuffer novo."""
+    if step <= 1:
+        return buf
+    cols, rows = -(-buf.cols // step), -(-buf.rows // step)
+    data = array(TYPECODE)
+    for r in range(0, buf.rows, step):
+        data.extend(buf.span(r, 0, buf.cols)[::step])
+    return PixelBuffer(cols, rows, data)
+
+
+def new_buffer(cols, rows):
+    """Buffer adequado ao tamanho: denso até CHUNKED_CELLS células, esparso acima disso."""
+    if cols * rows > CHUNKED_CELLS:
+        return ChunkedBuffer(cols, rows)
+    return PixelBuffer(cols, rows)
+
+
+def buffer_from_rgba(cols, rows, data):
+    """Buffer (denso ou em blocos, conforme o tamanho) a partir de bytes RGBA.
+
+    É o inverso de tobytes(): serve para o que vem do PIL (`Image.tobytes()`).
+    """
+    values = array(TYPECODE)
+    values.frombytes(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    if len(values) != cols * rows:
+        raise ValueError(f"esperados {cols * rows} pixels, recebidos {len(values)}")
+    if cols * rows <= CHUNKED_CELLS:
+        return PixelBuffer(cols, rows, values)
+    buf = ChunkedBuffer(cols, rows)
+    for r in range(rows):
+        start = r * cols
+        line = values[start:start + cols]
+        if line.count(TRANSPARENT) != cols:  # linhas vazias não criam blocos
+            buf.set_span(r, 0, line)
+    buf.prune()
+    return buf
+
+
+# Preenchimento por varredura de linhas (balde)
+_BLOCK = 64  # células comparadas de uma vez ao estender um trecho
+
+
+def _run_end(data, i, stop, target, block):
+    """Primeiro índice em [i, stop) cujo valor difere de target."""
+    n = len(block)
+    while i + n <= stop and data[i:i + n] == block:
+        i += n
+    while i < stop and data[i] == target:
+        i += 1
+    return i
+
+
+def _run_start(data, i, start, target, block):
+    """Início do trecho de valores iguais a target que termina em i (exclusivo)."""
+    n = len(block)
+    while i - n >= start and data[i - n:i] == block:
+        i -= n
+    while i > start and data[i - 1] == target:
+        i -= 1
+    return i
+
+
+def color_runs(values):
+    """Percorre um trecho como sequências de valores iguais: (início, fim, valor)."""
+    block = None
+    i, n = 0, len(values)
+    while i < n:
+        value = values[i]
+        if block is None or block[0] != value:
+            block = array(TYPECODE, [value]) * _BLOCK
+        end = _run_end(values, i + 1, n, value, block)
+        yield i, end, value
+        i = end
+
+
+def remap_colors(values, mapping):
+    """Aplica {cor antiga: cor nova} a um array de cores numa passada só.
+
+    As trocas são simultâneas ({A: B, B: A} troca as duas). Devolve o array
+    novo, ou None se nenhuma cor de `mapping` aparece em `values`.
+    """
+    np = numpy() if len(values) > 64 else None
+    if np is None:
+        if mapping.keys().isdisjoint(values):
+            return None
+        get = mapping.get
+        return array(TYPECODE, [get(v, v) for v in values])
+    src = np.frombuffer(values, dtype=np.uint32)
+    if len(mapping) == 1:
+        (old, new), = mapping.items()
+        mask = src == old
+        if not mask.any():
+            return None
+        out = src.copy()
+        out[mask] = new
+    else:
+        # Chaves ordenadas: searchsorted acha a posição de cada pixel entre elas
+        keys = np.fromiter(mapping, dtype=np.uint32, count=len(mapping))
+        order = np.argsort(keys)
+        keys = keys[order]
+        news = np.fromiter(mapping.values(), dtype=np.uint32, count=len(mapping))[order]
+        pos = np.minimum(np.searchsorted(keys, src), len(keys) - 1)
+        mask = keys[pos] == src
+        if not mask.any():
+            return None
+        out = np.where(mask, news[pos], src)
+    return array(TYPECODE, out.tobytes())
+
+
+def _tolerance_matcher(target, tolerance):
+    tr, tg, tb, ta = unpack_rgba(target)
+
+    def match(value):
+        return (abs((value & 0xFF) - tr) <= tolerance
+                and abs(((value >> 8) & 0xFF) - tg) <= tolerance
+                and abs(((value >> 16) & 0xFF) - tb) <= tolerance
+                and abs((value >> 24) - ta) <= tolerance)
+    return match
+
+
+def scanline_fill(buf, row, col, value, connectivity=4, tolerance=0, old_values=None):
+    """Preenche a região conectada a (row, col) com `value`, trecho a trecho.
+
+    Cada linha tocada é lida uma vez para uma cópia de trabalho; cada trecho
+    horizontal é estendido de uma vez e escrito no buffer com um único
+    fill_span, então funciona igual com PixelBuffer e ChunkedBuffer.
+    `connectivity` é 4 ou 8; com `tolerance` > 0 entram células cujos canais
+    RGBA diferem no máximo esse valor da cor de origem. Devolve a lista de
+    trechos (row, c0, c1), com c1 exclusivo. Se `old_values` for uma lista,
+    recebe uma cópia dos valores antigos de cada trecho, na mesma ordem.
+    """
+    if not buf.in_bounds(row, col):
+        return []
+    cols, rows = buf.cols, buf.rows
+    target = buf.get(row, col)
+    if tolerance <= 0 and target == value:
+        return []
+
+    lines = {}  # linha -> cópia de trabalho
+
+    def line(r):
+        data = lines.get(r)
+        if data is None:
+            data = lines[r] = buf.span(r, 0, cols)
+        return data
+
+    fill_block = array(TYPECODE, [value])
+    if tolerance <= 0:
+        block = array(TYPECODE, [target]) * _BLOCK
+        visited = None
+    else:
+        match = _tolerance_matcher(target, tolerance)
+        visited = {}  # linha -> bytearray das células já visitadas
+
+    def seen(r):
+        marks = visited.get(r)
+        if marks is None:
+            marks = visited[r] = bytearray(cols)
+        return marks
+
+    grow = 1 if connectivity == 8 else 0
+
+    runs = []
+    stack = [(row, col)]
+    while stack:
+        r, c = stack.pop()
+        data = line(r)
+
+        # Estende o trecho para os dois lados
+        if visited is None:
+            if data[c] != target:
+                continue
+            x0 = _run_start(data, c, 0, target, block)
+            x1 = _run_end(data, c, cols, target, block)
+        else:
+            marks = seen(r)
+            if marks[c] or not match(data[c]):
+                continue
+            x0 = c
+            while x0 > 0 and not marks[x0 - 1] and match(data[x0 - 1]):
+                x0 -= 1
+            x1 = c + 1
+            while x1 < cols and not marks[x1] and match(data[x1]):
+                x1 += 1
+            marks[x0:x1] = b"\x01" * (x1 - x0)
+
+        if old_values is not None:
+            old_values.append(data[x0:x1])
+        data[x0:x1] = fill_block * (x1 - x0)
+        buf.fill_span(r, x0, x1, value)
+        runs.append((r, x0, x1))
+
+        # Uma semente por trecho compatível nas linhas vizinhas
+        lo, hi = max(0, x0 - grow), min(cols, x1 + grow)
+        for nr in (r - 1, r + 1):
+            if not 0 <= nr < rows:
+                continue
+            ndata = line(nr)
+            if visited is None:
+                i = lo
+                while i < hi:
+                    try:
+                        i = ndata.index(target, i, hi)
+                    except ValueError:
+                        break
+                    stack.append((nr, i))
+                    i = _run_end(ndata, i, hi, target, block)
+            else:
+                marks = seen(nr)
+                inside = False
+                for x in range(lo, hi):
+                    ok = not marks[x] and match(ndata[x])
+                    if ok and not inside:
+                        stack.append((nr, x))
+                    inside = ok
+    return runs
+
+
+def mirror_runs(runs, rows, cols, mode):
+    """Trechos espelhados conforme o modo (HORIZONTAL, VERTICAL, BOTH)."""
+    mirrored = []
+    for r, c0, c1 in runs:
+        if mode in ("HORIZONTAL", "BOTH"):
+            mirrored.append((r, cols - c1, cols - c0))
+        if mode in ("VERTICAL", "BOTH"):
+            mirrored.append((rows - 1 - r, c0, c1))
+        if mode == "BOTH":
+            mirrored.append((rows - 1 - r, cols - c1, cols - c0))
+    return mirrored
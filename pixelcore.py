@@ -0,0 +1,484 @@
+# Núcleo do editor: documento e ferramentas, sem Tk nem PIL
+#
+# Pode ser importado por scripts e servidores (sem display). O PixelEditor
+# é só uma visão sobre o Document daqui: lê `dirty` e repinta o canvas.
+# As formas são calculadas em raster.py.
+from array import array
+
+from animation import Timeline
+from history import DeltaBuilder, TableDelta
+from layers import read_region
+from pixelbuffer import (CHUNK, TRANSPARENT, TYPECODE, ChunkedBuffer, IndexedBuffer, buffer_from_rgba,
+                         indexed_factory, mirror_runs, new_buffer, remap_colors, scanline_fill)
+from raster import clip_spans, ellipse_spans, line_spans, rect_spans
+
+MIRROR_MODES = ("OFF", "HORIZONTAL", "VERTICAL", "BOTH")
+
+
+class DirtyRegion:
+    """Acumula os retângulos alterados (em células) até o próximo flush.
+
+    Retângulos são meio-abertos: [r0, r1) x [c0, c1). Quando passam de
+    `max_rects`, os dois que menos crescem ao serem unidos viram um só.
+    """
+
+    def __init__(self, max_rects=16):
+        self.max_rects = max_rects
+        self.rects = []
+
+    def __bool__(self):
+        return bool(self.rects)
+
+    def add(self, row, col):
+        self.add_rect(row, col, row + 1, col + 1)
+
+    def add_rect(self, r0, c0, r1, c1):
+        if r0 >= r1 or c0 >= c1:
+            return
+        for i, (a0, b0, a1, b1) in enumerate(self.rects):
+            # Já coberto por um retângulo existente
+            if a0 <= r0 and b0 <= c0 and r1 <= a1 and c1 <= b1:
+                return
+            # Encostado ou sobreposto: une se a união não desperdiçar área
+            if r0 <= a1 and a0 <= r1 and c0 <= b1 and b0 <= c1:
+                union = (min(a0, r0), min(b0, c0), max(a1, r1), max(b1, c1))
+                if self._area(union) <= self._area(self.rects[i]) + self._area((r0, c0, r1, c1)) + 1:
+                    del self.rects[i]
+                    self.add_rect(*union)
+                    return
+        self.rects.append((r0, c0, r1, c1))
+        if len(self.rects) > self.max_rects:
+            self._merge_closest()
+
+    def add_spans(self, spans):
+        """Marca muitos trechos (row, c0, c1) de uma vez, em faixas de linhas.
+
+        Um add_rect por trecho passaria de max_rects a cada poucos trechos, e
+        cada união procura o melhor par entre todos; aqui os trechos, em
+        ordem, viram no máximo max_rects retângulos antes de entrar.
+        """
+        spans = sorted(spans)
+        size = max(1, -(-len(spans) // self.max_rects))
+        for i in range(0, len(spans), size):
+            band = spans[i:i + size]
+            self.add_rect(band[0][0], min(span[1] for span in band),
+                          band[-1][0] + 1, max(span[2] for span in band))
+
+    def take(self):
+        """Devolve os retângulos pendentes e esvazia o rastreador."""
+        rects, self.rects = self.rects, []
+        return rects
+
+    def clear(self):
+        self.rects = []
+
+    def _merge_closest(self):
+        best = None
+        for i in range(len(self.rects)):
+            for j in range(i + 1, len(self.rects)):
+                a, b = self.rects[i], self.rects[j]
+                union = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                growth = self._area(union) - self._area(a) - self._area(b)
+                if best is None or growth < best[0]:
+                    best = (growth, i, j, union)
+        _, i, j, union = best
+        del self.rects[j], self.rects[i]
+        self.rects.append(union)
+
+    @staticmethod
+    def _area(rect):
+        return (rect[2] - rect[0]) * (rect[3] - rect[1])
+
+
+def mirror_cells(row, col, rows, cols, mode):
+    """Cópias espelhadas de uma célula (sem repetir a própria) conforme o modo."""
+    mirrored = []
+    if mode in ("HORIZONTAL", "BOTH"):
+        mirrored.append((row, cols - 1 - col))
+    if mode in ("VERTICAL", "BOTH"):
+        mirrored.append((rows - 1 - row, col))
+    if mode == "BOTH":
+        mirrored.append((rows - 1 - row, cols - 1 - col))
+    return [cell for cell in mirrored if cell != (row, col)]
+
+
+class Document:
+    """Documento sem interface: quadros, camadas, histórico e ferramentas.
+
+    As ferramentas escrevem na camada ativa do quadro atual, gravam a ação
+    no histórico e marcam em `dirty` o que mudou. Cores são inteiros RGBA
+    empacotados ("#rrggbb" vira inteiro com hex_to_packed).
+    """
+
+    def __init__(self, cols=32, rows=32, history_budget=64 * 1024 * 1024, mirror_mode="OFF",
+                 keep_history=True):
+        self.cols = cols
+        self.rows = rows
+        self.history_budget = history_budget
+        self.keep_history = keep_history  # False em scripts: as ações não viram deltas
+        # Quadros da animação; cada um tem camadas e histórico (limitado em bytes) próprios
+        self.timeline = Timeline(cols, rows, history_budget=history_budget)
+        self.mirror_mode = mirror_mode  # OFF, HORIZONTAL, VERTICAL, BOTH
+        self.dirty = DirtyRegion()  # regiões alteradas desde o último flush
+        self.action = None  # DeltaBuilder da ação em andamento (traço)
+        self.color_table = None  # ColorTable das camadas no modo indexado; None = RGBA
+
+    @classmethod
+    def from_pixels(cls, pixels, **kwargs):
+        """Documento de uma camada só, usando o buffer dado (p. ex. uma imagem lida)."""
+        doc = cls(pixels.cols, pixels.rows, **kwargs)
+        doc.layers.active_layer.pixels = pixels
+        return doc
+
+    @classmethod
+    def from_frames(cls, frames, **kwargs):
+        """Documento com um quadro por (buffer, duração em ms), p. ex. de um GIF."""
+        (pixels, duration), rest = frames[0], frames[1:]
+        doc = cls.from_pixels(pixels, **kwargs)
+        doc.timeline.frame.duration = duration
+        for pixels, duration in rest:
+            frame = doc.timeline.add_frame(duplicate=False)
+            frame.layers.active_layer.pixels = pixels
+            frame.duration = duration
+        doc.timeline.select(0)
+        return doc
+
+    @property
+    def layers(self):
+        """Camadas do quadro atual; as ferramentas desenham na ativa."""
+        return self.timeline.frame.layers
+
+    @property
+    def history(self):
+        return self.timeline.frame.history
+
+    @property
+    def pixels(self):
+        """Buffer da camada ativa (RGBA empacotado, 0 = transparente)."""
+        return self.layers.pixels
+
+    @property
+    def indexed(self):
+        return self.color_table is not None
+
+    def in_bounds(self, row, col):
+        return 0 <= row < self.rows and 0 <= col < self.cols
+
+    # Modo indexado
+    def set_indexed(self, table):
+        """Passa todas as camadas para índices em `table` (ColorTable) ou, com None, de volta a RGBA.
+
+        Cores que não couberem na tabela viram a entrada mais parecida. Os
+        deltas guardados apontam para os buffers antigos, então o histórico
+        de todos os quadros é esvaziado.
+        """
+        if table is None:
+            convert = lambda buf: buffer_from_rgba(buf.cols, buf.rows, buf.tobytes())
+            factory = new_buffer
+        else:
+            convert = lambda buf: IndexedBuffer.from_buffer(buf, table)
+            factory = indexed_factory(table)
+        self.commit_action()
+        converted = {}  # buffers compartilhados entre quadros continuam compartilhados
+        for frame in self.timeline.frames:
+            for layer in frame.layers.layers:
+                key = id(getattr(layer.pixels, "data", layer.pixels))
+                if key not in converted:
+                    converted[key] = (layer.pixels, convert(layer.pixels))
+                    layer.pixels = converted[key][1]
+                else:
+                    layer.pixels = converted[key][1].share()
+            frame.layers.factory = factory
+            frame.layers.rebuild()
+            frame.history.clear()
+        self.timeline.factory = factory
+        self.color_table = table
+        self.dirty.add_rect(0, 0, self.rows, self.cols)
+
+    def recolor(self, index, value):
+        """Troca a cor da entrada `index` da tabela: nenhum pixel é escrito.
+
+        Só as composições em cache (várias camadas, opacidade, modos de
+        mistura) são refeitas; a do quadro atual no próximo composite(),
+        junto com o resto de `dirty`. Entra no histórico do quadro atual.
+        """
+        if self.color_table is None:
+            raise ValueError("o documento não está no modo indexado")
+        old = self.color_table.values[index]
+        if old == value:
+            return False
+        self.commit_action()
+        self.color_table.replace(index, value)
+        if self.keep_history:
+            self.history.push(TableDelta(index, old, value, self.color_table))
+        self._table_changed()
+        return True
+
+    def _table_changed(self):
+        for frame in self.timeline.frames:
+            if frame.layers.composite is None:
+                continue
+            if frame is self.timeline.frame:
+                frame.layers.split_valid = False
+            else:
+                frame.layers.rebuild()
+        self.dirty.add_rect(0, 0, self.rows, self.cols)
+
+    # Ações
+    def begin_action(self):
+        """Abre (ou continua) a ação em andamento na camada ativa."""
+        if self.action is None:
+            self.action = DeltaBuilder(self.pixels)
+        return self.action
+
+    def commit_action(self):
+        """Fecha a ação: vira um delta compactado no histórico (ou None se nada mudou)."""
+        action, self.action = self.action, None
+        if action is None:
+            return None
+        if not self.keep_history:
+            action.buf.prune()
+            return None
+        delta = action.build()
+        self.history.push(delta)
+        action.buf.prune()
+        return delta
+
+    def paint(self, row, col, color):
+        """Pinta uma célula e seus espelhos na ação em andamento (lápis, borracha).
+
+        Devolve False se a célula está fora do documento ou já tem a cor.
+        """
+        if not self.in_bounds(row, col):
+            return False
+        pixels = self.pixels
+        if pixels[row, col] == color:
+            return False
+        action = self.begin_action()
+        for r, c in [(row, col)] + mirror_cells(row, col, self.rows, self.cols, self.mirror_mode):
+            action.record(r, c, pixels[r, c])
+            pixels[r, c] = color
+            self.dirty.add(r, c)
+        return True
+
+    def erase(self, row, col):
+        return self.paint(row, col, TRANSPARENT)
+
+    def shape_spans(self, spans):
+        """(trechos cortados no documento, cópias espelhadas deles) de uma forma.
+
+        É o que draw_spans escreve; o preview mostra o mesmo resultado. As
+        cópias podem cobrir trechos da própria forma (a mesma cor duas vezes).
+        """
+        spans = clip_spans(spans, self.rows, self.cols)
+        if self.mirror_mode == "OFF":
+            return spans, []
+        return spans, mirror_runs(spans, self.rows, self.cols, self.mirror_mode)
+
+    def draw_spans(self, spans, color):
+        """Pinta trechos (row, c0, c1) de uma forma e seus espelhos como uma ação só; devolve o delta."""
+        spans, mirrored = self.shape_spans(spans)
+        if not spans:
+            return None
+        pixels = self.pixels
+        action = self.begin_action()
+        for r, c0, c1 in spans + mirrored:
+            action.record_span(r, c0, pixels.span(r, c0, c1))
+            pixels.fill_span(r, c0, c1, color)
+        self.dirty.add_spans(spans + mirrored)
+        return self.commit_action()
+
+    def draw_line(self, start_row, start_col, end_row, end_col, color):
+        return self.draw_spans(line_spans(start_row, start_col, end_row, end_col), color)
+
+    def draw_rectangle(self, start_row, start_col, end_row, end_col, color, fill=False):
+        return self.draw_spans(rect_spans(start_row, start_col, end_row, end_col, fill), color)
+
+    def draw_ellipse(self, start_row, start_col, end_row, end_col, color, fill=False):
+        return self.draw_spans(ellipse_spans(start_row, start_col, end_row, end_col, fill), color)
+
+    def fill_runs(self, row, col, color, connectivity=4, tolerance=0):
+        """Trechos (row, c0, c1) que o balde pintaria, sem alterar o documento."""
+        if not self.in_bounds(row, col):
+            return []
+        return scanline_fill(self.pixels.copy(), row, col, color,
+                             connectivity=connectivity, tolerance=tolerance)
+
+    def fill(self, row, col, color, connectivity=4, tolerance=0):
+        """Balde por varredura de linhas; o espelho é aplicado aos trechos inteiros."""
+        if not self.in_bounds(row, col):
+            return None
+        pixels = self.pixels
+        old_values = []
+        runs = scanline_fill(pixels, row, col, color, connectivity=connectivity,
+                             tolerance=tolerance, old_values=old_values)
+        if not runs:
+            return None
+        action = self.begin_action()
+        for (r, c0, _), old in zip(runs, old_values):
+            action.record_span(r, c0, old)
+        if self.mirror_mode != "OFF":
+            for r, c0, c1 in mirror_runs(runs, self.rows, self.cols, self.mirror_mode):
+                action.record_span(r, c0, pixels.span(r, c0, c1))
+                pixels.fill_span(r, c0, c1, color)
+                self.dirty.add_rect(r, c0, r + 1, c1)
+        for r, c0, c1 in runs:
+            self.dirty.add_rect(r, c0, r + 1, c1)
+        return self.commit_action()
+
+    def replace_color(self, old, new):
+        """Troca todas as células de uma cor por outra na camada ativa; devolve o delta."""
+        return self.replace_colors({old: new})
+
+    def replace_colors(self, mapping):
+        """Troca várias cores ({antiga: nova}) na camada ativa numa passada só; devolve o delta.
+
+        Cada região com dados é lida uma vez e trocada de uma vez (com NumPy,
+        vetorizado); só as linhas que mudaram entram no delta, que é um só
+        para todas as trocas. Trocando o transparente, o documento é percorrido
+        bloco a bloco e os blocos vazios recebem a cor nova sem serem lidos.
+        """
+        mapping = {old: new for old, new in mapping.items() if old != new}
+        if not mapping:
+            return None
+        pixels = self.pixels
+        rows, cols = self.rows, self.cols
+        empty = []  # blocos sem dados (só com o transparente trocado)
+        if TRANSPARENT in mapping:
+            n = pixels.chunk if isinstance(pixels, ChunkedBuffer) else CHUNK
+            rects = [(r, c, min(r + n, rows), min(c + n, cols))
+                     for r in range(0, rows, n) for c in range(0, cols, n)]
+            if isinstance(pixels, ChunkedBuffer):
+                filled = set(pixels.populated(0, 0, rows, cols))
+                empty = [rect for rect in rects if rect not in filled]
+                rects = [rect for rect in rects if rect in filled]
+        else:  # só os blocos com dados podem ter as cores
+            rects = list(pixels.populated(0, 0, rows, cols))
+        action = self.begin_action()
+        bounds = None  # um retângulo só para a repintura, em vez de um por bloco
+        if empty:
+            # Blocos vazios vizinhos na mesma faixa de linhas viram um trecho só
+            runs = []
+            for r0, c0, r1, c1 in empty:
+                if runs and runs[-1][0] == r0 and runs[-1][3] == c0:
+                    runs[-1][3] = c1
+                else:
+                    runs.append([r0, c0, r1, c1])
+            value = mapping[TRANSPARENT]
+            for r0, c0, r1, c1 in runs:
+                old = array(TYPECODE, bytes(4 * (c1 - c0)))  # o mesmo para todas as linhas do trecho
+                for r in range(r0, r1):
+                    action.record_span(r, c0, old)
+                    pixels.fill_span(r, c0, c1, value)
+            bounds = (min(run[0] for run in runs), min(run[1] for run in runs),
+                      max(run[2] for run in runs), max(run[3] for run in runs))
+        for r0, c0, r1, c1 in rects:
+            region = read_region(pixels, r0, c0, r1, c1)
+            replaced = remap_colors(region, mapping)
+            if replaced is None:
+                continue
+            width = c1 - c0
+            changed = []
+            for i, r in enumerate(range(r0, r1)):
+                old, new = region[i * width:(i + 1) * width], replaced[i * width:(i + 1) * width]
+                if old != new:
+                    action.record_span(r, c0, old)
+                    pixels.set_span(r, c0, new)
+                    changed.append(r)
+            rect = (changed[0], c0, changed[-1] + 1, c1)
+            if bounds is None:
+                bounds = rect
+            else:
+                bounds = (min(bounds[0], rect[0]), min(bounds[1], rect[1]),
+                          max(bounds[2], rect[2]), max(bounds[3], rect[3]))
+        if bounds is not None:
+            self.dirty.add_rect(*bounds)
+        return self.commit_action()
+
+    def flip(self, mode):
+        """Espelha a camada ativa inteira (HORIZONTAL, VERTICAL ou BOTH); devolve o delta."""
+        if mode not in MIRROR_MODES:
+            raise ValueError(f"modo de espelho desconhecido: {mode}")
+        horizontal = mode in ("HORIZONTAL", "BOTH")
+        vertical = mode in ("VERTICAL", "BOTH")
+        if not (horizontal or vertical):
+            return None
+        pixels, rows, cols = self.pixels, self.rows, self.cols
+        action = self.begin_action()
+        # Linha a linha (ou par a par), para não copiar a imagem inteira de uma vez
+        for r in range((rows + 1) // 2 if vertical else rows):
+            mr = rows - 1 - r if vertical else r
+            top, bottom = pixels.span(r, 0, cols), pixels.span(mr, 0, cols)
+            if top.count(TRANSPARENT) == cols and bottom.count(TRANSPARENT) == cols:
+                continue
+            new_top, new_bottom = bottom[:], top[:]
+            if horizontal:
+                new_top.reverse()
+                new_bottom.reverse()
+            action.record_span(r, 0, top)
+            pixels.set_span(r, 0, new_top)
+            self.dirty.add_rect(r, 0, r + 1, cols)
+            if mr != r:
+                action.record_span(mr, 0, bottom)
+                pixels.set_span(mr, 0, new_bottom)
+                self.dirty.add_rect(mr, 0, mr + 1, cols)
+        return self.commit_action()
+
+    def clear(self):
+        """Apaga a camada ativa; também pode ser desfeito (só as partes com blocos viram delta)."""
+        pixels = self.pixels
+        action = self.begin_action()
+        for r0, c0, r1, c1 in pixels.populated(0, 0, self.rows, self.cols):
+            for r in range(r0, r1):
+                action.record_span(r, c0, pixels.span(r, c0, c1))
+            self.dirty.add_rect(r0, c0, r1, c1)
+        pixels.clear()
+        return self.commit_action()
+
+    # Camadas
+    def remove_layer(self, index=None):
+        """Remove uma camada do quadro atual (a ativa, sem `index`); devolve a Layer ou None.
+
+        Os passos do histórico gravados nela são descartados: desfazer passa
+        direto para o passo anterior que muda o documento, e o buffer da camada
+        não fica preso no histórico.
+        """
+        self.commit_action()
+        layer = self.layers.remove_layer(index)
+        if layer is not None:
+            self.history.discard(layer.pixels)
+        return layer
+
+    # Desfazer / refazer
+    def undo(self):
+        """Desfaz a última ação do quadro atual; devolve os retângulos alterados."""
+        delta = self.history.peek_undo()
+        if delta is None:
+            return []
+        return self._apply_history(self.history.undo(), delta.target)
+
+    def redo(self):
+        delta = self.history.peek_redo()
+        if delta is None:
+            return []
+        return self._apply_history(self.history.redo(), delta.target)
+
+    def _apply_history(self, rects, target):
+        if target is self.color_table:  # troca de cor da tabela: repinta tudo
+            self._table_changed()
+            return [(0, 0, self.rows, self.cols)]
+        # O delta volta para a camada em que foi gravado, que pode não ser a ativa
+        target.prune()
+        index = self.layers.index_of(target)
+        if index is None:  # camada removida direto no LayerStack, sem Document.remove_layer
+            return []
+        if index != self.layers.active:
+            self.layers.invalidate(rects, index)
+        for r0, c0, r1, c1 in rects:
+            self.dirty.add_rect(r0, c0, r1, c1)
+        return rects
+
+    def composite(self):
+        """Resultado final do quadro atual, recomposto só onde mudou desde a última vez."""
+        self.layers.refresh(self.dirty.take())
+        return self.layers.view()
@@ -0,0 +1,528 @@
+# Formato nativo de projeto: contêiner binário em blocos, lido sob demanda com mmap
+#
+# Layout do arquivo (inteiros little-endian):
+#
+#   cabeçalho   MAGIC (8 bytes)
+#   blobs       conteúdos, cada um comprimido ou não (blocos de pixels, históricos)
+#   índice      metadados JSON + tabela de blobs + tabela de blocos de cada plano
+#   trailer     posição e tamanho do índice + END_MAGIC
+#
+# Os blobs são endereçados pelo conteúdo (blake2b): um bloco igual em dois
+# quadros ou duas camadas é gravado uma vez só, e salvar de novo acrescenta ao
+# fim do arquivo só os blobs que ainda não estão nele, seguidos de um índice e
+# um trailer novos. Quando os blobs sem uso passam da metade do arquivo, ele é
+# reescrito só com os usados.
+#
+# Ao abrir, só o índice é lido. Em documentos grandes (ChunkedBuffer) cada
+# bloco fica em `pending` e é descomprimido no primeiro acesso, então abrir
+# um projeto de centenas de MB não depende do tamanho dele.
+#
+# Documentos no modo indexado gravam a tabela de cores em `color_table` nos
+# metadados e, nos blocos dos planos, os índices (1 byte por célula) em vez
+# de RGBA: ao abrir, os bytes voltam direto para o IndexedBuffer, sem
+# converter cor nenhuma. O IndexedBuffer é denso (1 byte por célula), então
+# esses planos são lidos inteiros ao abrir, não sob demanda. No formato 1 os
+# planos indexados eram gravados em RGBA e são convertidos ao abrir.
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+from animation import Frame
+from colors import ColorTable
+from history import Delta, History
+from layers import Layer, LayerStack
+from pixelbuffer import (CHUNK, CHUNKED_CELLS, INDEXED_COLORS, TRANSPARENT, TYPECODE, ChunkedBuffer,
+                         IndexedBuffer, PixelBuffer, indexed_factory)
+from pixelcore import Document
+
+EXTENSION = ".pxp"
+FORMAT_VERSION = 2
+INDEXED_PLANES_VERSION = 2  # a partir deste formato, planos indexados guardam índices
+MAGIC = b"PXPROJ\x00\x01"
+END_MAGIC = b"PXPEND\x00\x01"
+
+TRAILER = struct.Struct("<QQ8s")  # posição do índice, tamanho do índice, END_MAGIC
+BLOB_ENTRY = struct.Struct("<16sQIIB")  # digest, posição, tamanho, tamanho descomprimido, codec
+CHUNK_ENTRY = struct.Struct("<III")  # linha do bloco, coluna do bloco, índice do blob
+COUNT = struct.Struct("<I")
+DELTA_HEADER = struct.Struct("<iIII")  # camada, trechos, len(old_rle), len(new_rle)
+
+CODECS = {"none": 0, "zlib": 1, "zstd": 2}
+COMPACT_MIN_BYTES = 1024 * 1024  # arquivos menores que isso nunca são reescritos
+
+_zstd_codec = False  # False = ainda não tentou importar
+
+
+def _zstd():
+    """(comprime, descomprime) do zstd, se o pacote `zstandard` estiver instalado, ou None."""
+    global _zstd_codec
+    if _zstd_codec is False:
+        try:
+            import zstandard
+        except ImportError:
+            _zstd_codec = None
+        else:
+            _zstd_codec = (zstandard.ZstdCompressor(level=3).compress,
+                           zstandard.ZstdDecompressor().decompress)
+    return _zstd_codec
+
+
+def _encode(raw, codec):
+    # Conteúdo que não diminui com a compressão é gravado como está
+    if codec == 1:
+        data = zlib.compress(raw, 6)
+    elif codec == 2:
+        data = _zstd()[0](raw)
+    else:
+        return raw, 0
+    if len(data) >= len(raw):
+        return raw, 0
+    return data, codec
+
+
+def _decode(data, codec):
+    if codec == 1:
+        return zlib.decompress(data)
+    if codec == 2:
+        zstd = _zstd()
+        if zstd is None:
+            raise ValueError("o projeto usa zstd: instale o pacote zstandard")
+        return zstd[1](data)
+    return bytes(data)
+
+
+def _to_bytes(values):
+    """Array de inteiros → bytes little-endian (a ordem do arquivo)."""
+    if sys.byteorder != "little":
+        values = values[:]
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(data):
+    values = array(TYPECODE)
+    values.frombytes(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def _digest(raw):
+    return hashlib.blake2b(raw, digest_size=16).digest()
+
+
+class Blob:
+    """Um conteúdo gravado no arquivo do projeto.
+
+    Chamar o blob devolve o bloco de pixels decodificado: é o carregador que
+    fica em ChunkedBuffer.pending.
+    """
+
+    __slots__ = ("project", "digest", "offset", "length", "raw_length", "codec")
+
+    def __init__(self, project, digest, offset, length, raw_length, codec):
+        self.project = project
+        self.digest = digest
+        self.offset = offset
+        self.length = length
+        self.raw_length = raw_length
+        self.codec = codec
+
+    def read(self):
+        if self.project is None:
+            raise ValueError("blob descartado do arquivo do projeto")
+        return self.project.read(self)
+
+    def __call__(self):
+        return _from_bytes(self.read())
+
+
+def _tiles(buf, n):
+    """Blocos n x n (chave, array) com conteúdo de um PixelBuffer denso."""
+    cols, rows, data = buf.cols, buf.rows, buf.data
+    for cr in range((rows + n - 1) // n):
+        for cc in range((cols + n - 1) // n):
+            x0 = cc * n
+            width = min(n, cols - x0)
+            block = array(TYPECODE, bytes(4 * n * n))
+            for y in range(min(n, rows - cr * n)):
+                start = (cr * n + y) * cols + x0
+                block[y * n:y * n + width] = data[start:start + width]
+            if block.count(TRANSPARENT) != len(block):
+                yield (cr, cc), block
+
+
+def _index_tiles(buf, n):
+    """Blocos n x n (chave, bytes) com conteúdo dos índices de um IndexedBuffer."""
+    cols, rows, data = buf.cols, buf.rows, buf.data
+    for cr in range((rows + n - 1) // n):
+        for cc in range((cols + n - 1) // n):
+            x0 = cc * n
+            width = min(n, cols - x0)
+            block = bytearray(n * n)
+            for y in range(min(n, rows - cr * n)):
+                start = (cr * n + y) * cols + x0
+                block[y * n:y * n + width] = data[start:start + width]
+            if block.count(0) != len(block):
+                yield (cr, cc), bytes(block)
+
+
+def _history_bytes(history, layers):
+    """Serializa as pilhas de desfazer/refazer de um quadro (ou None se vazias)."""
+    parts = []
+    counts = []
+    for stack in (history.undo_stack, history.redo_stack):
+        count = 0
+        for delta in stack:
+            if not isinstance(delta, Delta):  # trocas de cor da tabela não são gravadas
+                continue
+            index = layers.index_of(delta.target)
+            if index is None:  # camada já removida: desfazer já ignoraria
+                continue
+            parts.append(DELTA_HEADER.pack(index, len(delta.starts), len(delta.old_rle), len(delta.new_rle)))
+            for values in (delta.starts, delta.lengths, delta.old_rle, delta.new_rle):
+                parts.append(_to_bytes(values))
+            count += 1
+        counts.append(count)
+    if not any(counts):
+        return None
+    return struct.pack("<II", *counts) + b"".join(parts)
+
+
+def _read_history(data, cols, layers, budget):
+    history = History(budget=budget)
+    undo_count, redo_count = struct.unpack_from("<II", data)
+    pos = 8
+    stacks = ([], [])
+    for i in range(undo_count + redo_count):
+        index, spans, old_len, new_len = DELTA_HEADER.unpack_from(data, pos)
+        pos += DELTA_HEADER.size
+        arrays = []
+        for length in (spans, spans, old_len, new_len):
+            arrays.append(_from_bytes(data[pos:pos + 4 * length]))
+            pos += 4 * length
+        delta = Delta(cols, *arrays, target=layers.layers[index].pixels)
+        stacks[i >= undo_count].append(delta)
+    history.undo_stack.extend(stacks[0])
+    history.redo_stack = stacks[1]
+    history.nbytes = sum(delta.nbytes for delta in stacks[0] + stacks[1])
+    return history
+
+
+class Project:
+    """Arquivo de projeto (.pxp): abre com mmap, lê blocos sob demanda e salva incrementalmente.
+
+        project = Project.open("arte.pxp")
+        doc, palette = project.load()
+        ...
+        project.save(doc, palette)  # só acrescenta o que mudou
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.mm = None
+        self.size = 0  # fim do trailer atual (o que vier depois é resto de um save interrompido)
+        self.index_size = 0  # índice + trailer atuais
+        self.blobs = {}  # digest -> Blob, todos os que estão no arquivo
+        self.meta = None
+        self.table = []  # blobs usados pelo índice atual, na ordem da tabela
+        self.planes = []  # por plano: [(linha do bloco, coluna do bloco, Blob)]
+
+    def __repr__(self):
+        return f"Project({self.path!r}, {len(self.blobs)} blobs)"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @classmethod
+    def open(cls, path):
+        project = cls(path)
+        project._map()
+        try:
+            project._read_index(project._find_trailer())
+        except Exception:
+            project.close()
+            raise
+        return project
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.file.close()
+        self.mm = self.file = None
+
+    def _map(self):
+        self.file = open(self.path, "rb")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, blob):
+        """Conteúdo descomprimido de um blob deste arquivo."""
+        return _decode(self.mm[blob.offset:blob.offset + blob.length], blob.codec)
+
+    # Leitura
+    def _find_trailer(self):
+        # O trailer válido mais ao fim: se um save foi interrompido, vale o anterior
+        mm = self.mm
+        if mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{self.path}: não é um projeto pixel art")
+        end = len(mm)
+        while True:
+            pos = mm.rfind(END_MAGIC, len(MAGIC), end)
+            if pos < 0:
+                raise ValueError(f"{self.path}: projeto sem índice (arquivo truncado?)")
+            start = pos + len(END_MAGIC) - TRAILER.size
+            if start >= len(MAGIC):
+                offset, length, _ = TRAILER.unpack_from(mm, start)
+                if offset + length == start:
+                    self.size = pos + len(END_MAGIC)
+                    self.index_size = self.size - offset
+                    return offset
+            end = pos
+
+    def _read_index(self, pos):
+        mm = self.mm
+        (length,) = COUNT.unpack_from(mm, pos)
+        pos += COUNT.size
+        meta = json.loads(mm[pos:pos + length])
+        pos += length
+        if meta.get("version", 0) > FORMAT_VERSION:
+            raise ValueError(f"{self.path}: projeto de uma versão mais nova (formato {meta['version']})")
+
+        (count,) = COUNT.unpack_from(mm, pos)
+        pos += COUNT.size
+        self.table = []
+        for entry in BLOB_ENTRY.iter_unpack(mm[pos:pos + count * BLOB_ENTRY.size]):
+            blob = self.blobs[entry[0]] = Blob(self, *entry)
+            self.table.append(blob)
+        pos += count * BLOB_ENTRY.size
+
+        (count,) = COUNT.unpack_from(mm, pos)
+        pos += COUNT.size
+        self.planes = []
+        for _ in range(count):
+            (chunks,) = COUNT.unpack_from(mm, pos)
+            pos += COUNT.size
+            entries = CHUNK_ENTRY.iter_unpack(mm[pos:pos + chunks * CHUNK_ENTRY.size])
+            self.planes.append([(cr, cc, self.table[i]) for cr, cc, i in entries])
+            pos += chunks * CHUNK_ENTRY.size
+        self.meta = meta
+
+    def _plane_buffer(self, plane, cols, rows, n, table=None):
+        if table is not None:
+            # Plano indexado: os blocos já são os índices da tabela
+            buf = IndexedBuffer(cols, rows, table)
+            for cr, cc, blob in self.planes[plane]:
+                block = blob.read()
+                x0 = cc * n
+                width = min(n, cols - x0)
+                for y in range(min(n, rows - cr * n)):
+                    start = (cr * n + y) * cols + x0
+                    buf.data[start:start + width] = block[y * n:y * n + width]
+            return buf
+        if cols * rows > CHUNKED_CELLS:
+            # Documento grande: nenhum bloco é lido agora
+            buf = ChunkedBuffer(cols, rows, n)
+            buf.pending = {(cr, cc): blob for cr, cc, blob in self.planes[plane]}
+            return buf
+        buf = PixelBuffer(cols, rows)
+        for cr, cc, blob in self.planes[plane]:
+            block = blob()
+            x0 = cc * n
+            width = min(n, cols - x0)
+            for y in range(min(n, rows - cr * n)):
+                start = (cr * n + y) * cols + x0
+                buf.data[start:start + width] = block[y * n:y * n + width]
+        return buf
+
+    def load(self, history_budget=64 * 1024 * 1024):
+        """Monta o Document salvo; devolve (documento, paleta)."""
+        meta = self.meta
+        cols, rows, n = meta["cols"], meta["rows"], meta["chunk"]
+        doc = Document(cols, rows, history_budget=history_budget, mirror_mode=meta["mirror_mode"])
+        table = factory = None
+        if meta.get("color_table") is not None:
+            table = ColorTable.from_values(meta["color_table"], INDEXED_COLORS)
+            factory = indexed_factory(table)
+        if table is not None and meta.get("version", 0) < INDEXED_PLANES_VERSION:
+            buffers = [IndexedBuffer.from_buffer(self._plane_buffer(plane, cols, rows, n), table)
+                       for plane in range(len(self.planes))]
+        else:
+            buffers = [self._plane_buffer(plane, cols, rows, n, table) for plane in range(len(self.planes))]
+        frames = []
+        for info in meta["frames"]:
+            layers = LayerStack(cols, rows, [
+                Layer(layer["name"], buffers[layer["plane"]], layer["visible"], layer["opacity"], layer["blend"])
+                for layer in info["layers"]])
+            if factory is not None:
+                layers.factory = factory
+            layers.active = info["active"]
+            if info["history"] is None:
+                history = History(budget=history_budget)
+            else:
+                history = _read_history(self.table[info["history"]].read(), cols, layers, history_budget)
+            frames.append(Frame(layers, history, info["duration"]))
+        doc.timeline.frames = frames
+        doc.timeline.current = meta["current"]
+        if table is not None:
+            doc.color_table = table
+            doc.timeline.factory = factory
+        return doc, list(meta["palette"])
+
+    # Gravação
+    def save(self, doc, palette=(), compression="zlib"):
+        """Grava o documento: acrescenta ao fim do arquivo só os blobs novos e um índice.
+
+        `compression` é "none", "zlib" ou "zstd" (este precisa do pacote zstandard).
+        """
+        codec = CODECS[compression]
+        if codec == 2 and _zstd() is None:
+            raise ValueError("compressão zstd indisponível: instale o pacote zstandard")
+
+        append = self.mm is not None  # senão o arquivo é (re)escrito do zero
+        if not append:
+            self.blobs = {}
+        used = {}  # digest -> posição na tabela do índice novo
+        new = {}  # digest -> conteúdo que ainda não está no arquivo
+
+        def store(digest, raw=None):
+            if digest not in used:
+                used[digest] = len(used)
+                if digest not in self.blobs:
+                    new[digest] = raw
+            return digest
+
+        planes = []
+        plane_of = {}  # id(buffer) -> índice do plano
+        digests = {}  # id(bloco) -> digest: blocos compartilhados entre quadros são lidos uma vez
+        frames = []
+        for frame in doc.timeline.frames:
+            layers = []
+            for layer in frame.layers.layers:
+                plane = plane_of.get(id(layer.pixels))
+                if plane is None:
+                    plane = plane_of[id(layer.pixels)] = len(planes)
+                    planes.append(self._plane_entries(layer.pixels, store, digests))
+                layers.append({"name": layer.name, "visible": layer.visible, "opacity": layer.opacity,
+                               "blend": layer.blend, "plane": plane})
+            data = _history_bytes(frame.history, frame.layers)
+            history = None if data is None else used[store(_digest(data), data)]
+            frames.append({"duration": frame.duration, "active": frame.layers.active,
+                           "history": history, "layers": layers})
+        meta = {"version": FORMAT_VERSION, "cols": doc.cols, "rows": doc.rows, "chunk": CHUNK,
+                "mirror_mode": doc.mirror_mode, "palette": list(palette),
+                "current": doc.timeline.current, "frames": frames}
+        if doc.color_table is not None:
+            meta["color_table"] = list(doc.color_table.values)
+
+        # Fecha o mapeamento antes de escrever (no Windows não dá para truncar
+        # um arquivo mapeado); os blobs leem de self.mm, que é refeito no fim
+        self.close()
+        with open(self.path, "r+b" if append else "wb") as f:
+            if append:
+                f.seek(self.size)
+            else:
+                f.write(MAGIC)
+            for digest, raw in new.items():
+                data, blob_codec = _encode(raw, codec)
+                self.blobs[digest] = Blob(self, digest, f.tell(), len(data), len(raw), blob_codec)
+                f.write(data)
+            self.meta = meta
+            self.table = [self.blobs[digest] for digest in used]
+            self.planes = [[(cr, cc, self.blobs[digest]) for cr, cc, digest in entries] for entries in planes]
+            self._finish(f, [(blob, blob.offset) for blob in self.table])
+        self._map()
+
+        # Muito espaço perdido com blobs que ninguém mais usa: reescreve o arquivo
+        live = self.index_size + sum(blob.length for blob in self.table)
+        if self.size > COMPACT_MIN_BYTES and self.size - live > live:
+            self.compact()
+
+    def _plane_entries(self, buf, store, digests):
+        """Blocos não vazios de uma camada: [(linha do bloco, coluna do bloco, digest)]."""
+        entries = []
+        if isinstance(buf, ChunkedBuffer) and buf.chunk == CHUNK:
+            for key, blob in buf.pending.items():
+                if blob.project is self and blob.digest in self.blobs:  # nunca lido: igual ao do arquivo
+                    entries.append((*key, store(blob.digest)))
+                else:
+                    entries.extend(self._block_entries([(key, blob())], store))
+            entries.extend(self._block_entries(buf.chunks.items(), store, digests))
+        elif isinstance(buf, IndexedBuffer):
+            for key, raw in _index_tiles(buf, CHUNK):
+                entries.append((*key, store(_digest(raw), raw)))
+        else:
+            if not isinstance(buf, PixelBuffer):  # blocos de outro tamanho: recorta de novo
+                buf = PixelBuffer(buf.cols, buf.rows, buf.flatten())
+            entries.extend(self._block_entries(_tiles(buf, CHUNK), store))
+        entries.sort()
+        return entries
+
+    @staticmethod
+    def _block_entries(blocks, store, digests=None):
+        # `digests` (por id) só vale para blocos que continuam vivos durante o save
+        for (cr, cc), block in blocks:
+            digest = digests.get(id(block)) if digests is not None else None
+            if digest is None:
+                if block.count(TRANSPARENT) == len(block):
+                    continue
+                raw = _to_bytes(block)
+                digest = _digest(raw)
+                if digests is not None:
+                    digests[id(block)] = digest
+                store(digest, raw)
+            else:
+                store(digest)
+            yield cr, cc, digest
+
+    def _finish(self, f, table):
+        """Grava índice e trailer na posição atual de f. `table`: [(blob, posição no arquivo)]."""
+        positions = {blob.digest: i for i, (blob, _) in enumerate(table)}
+        meta = json.dumps(self.meta, separators=(",", ":")).encode("utf-8")
+        parts = [COUNT.pack(len(meta)), meta, COUNT.pack(len(table))]
+        parts.extend(BLOB_ENTRY.pack(blob.digest, offset, blob.length, blob.raw_length, blob.codec)
+                     for blob, offset in table)
+        parts.append(COUNT.pack(len(self.planes)))
+        for entries in self.planes:
+            parts.append(COUNT.pack(len(entries)))
+            parts.extend(CHUNK_ENTRY.pack(cr, cc, positions[blob.digest]) for cr, cc, blob in entries)
+        index = b"".join(parts)
+        start = f.tell()
+        f.write(index)
+        f.write(TRAILER.pack(start, len(index), END_MAGIC))
+        f.truncate()
+        f.flush()
+        os.fsync(f.fileno())
+        self.size = f.tell()
+        self.index_size = self.size - start
+
+    def compact(self):
+        """Reescreve o arquivo só com os blobs do índice atual, sem descomprimir nada."""
+        tmp = self.path + ".tmp"
+        table = []
+        with open(tmp, "wb") as f:
+            f.write(MAGIC)
+            for blob in self.table:
+                table.append((blob, f.tell()))
+                f.write(self.mm[blob.offset:blob.offset + blob.length])
+            self._finish(f, table)
+        self.close()
+        os.replace(tmp, self.path)
+
+        # Os mesmos objetos Blob (referenciados pelos buffers) passam a apontar para o arquivo novo
+        for blob in self.blobs.values():
+            blob.project = None
+        self.blobs = {}
+        for blob, offset in table:
+            blob.project = self
+            blob.offset = offset
+            self.blobs[blob.digest] = blob
+        self._map()
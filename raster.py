@@ -0,0 +1,168 @@
+# Rasterizadores de formas: funções puras, só com inteiros, sem Tk nem buffer
+#
+# Uma forma é calculada uma vez como trechos de linha (row, c0, c1), meio-
+# abertos e sem repetição, o mesmo formato que o balde (scanline_fill) usa.
+# O preview mostra cada trecho como um retângulo, o documento escreve cada um
+# com fill_span, o espelho sai de mirror_runs e o delta guarda os valores
+# antigos trecho a trecho. Retângulos e elipses preenchidos viram um trecho
+# por linha, sem passar célula por célula.
+#
+# bresenham_line gera pontos soltos: o traço do lápis liga os pontos com ela.
+
+
+def bresenham_line(x0, y0, x1, y1):
+    points = []
+    dx = abs(x1 - x0)
+    dy = -abs(y1 - y0)
+    sx = 1 if x0 < x1 else -1
+    sy = 1 if y0 < y1 else -1
+    err = dx + dy
+
+    while True:
+        points.append((x0, y0))
+        if x0 == x1 and y0 == y1:
+            break
+        e2 = 2 * err
+        if e2 >= dy:
+            err += dy
+            x0 += sx
+        if e2 <= dx:
+            err += dx
+            y0 += sy
+    return points
+
+
+def line_cells(r0, c0, r1, c1):
+    """Células da ferramenta linha, de (r0, c0) até (r1, c1)."""
+    dr = abs(r1 - r0)
+    dc = abs(c1 - c0)
+    sr = 1 if r0 < r1 else -1
+    sc = 1 if c0 < c1 else -1
+    err = dr - dc
+
+    while True:
+        yield r0, c0
+        if r0 == r1 and c0 == c1:
+            break
+        e2 = 2 * err
+        if e2 > -dc:
+            err -= dc
+            r0 += sr
+        if e2 < dr:
+            err += dr
+            c0 += sc
+
+
+def ellipse_cells(start_row, start_col, end_row, end_col):
+    """Contorno da elipse inscrita no retângulo (ponto médio, por quadrantes).
+
+    As variáveis de decisão são as do algoritmo clássico multiplicadas por 4,
+    para ficarem inteiras (os 0,25 e 0,5 somem) sem mudar nenhuma decisão.
+    Pode repetir células; ellipse_spans descarta as repetidas.
+    """
+    r0, r1 = min(start_row, end_row), max(start_row, end_row)
+    c0, c1 = min(start_col, end_col), max(start_col, end_col)
+
+    rx = max(1, (c1 - c0) // 2)
+    ry = max(1, (r1 - r0) // 2)
+    cx = c0 + rx
+    cy = r0 + ry
+
+    x = 0
+    y = ry
+    rx_sq = rx * rx
+    ry_sq = ry * ry
+    dx = 2 * ry_sq * x
+    dy = 2 * rx_sq * y
+
+    # Região 1
+    d1 = 4 * ry_sq - 4 * rx_sq * ry + rx_sq
+    while dx < dy:
+        yield cy + y, cx + x
+        yield cy + y, cx - x
+        yield cy - y, cx + x
+        yield cy - y, cx - x
+        if d1 < 0:
+            x += 1
+            dx += 2 * ry_sq
+            d1 += 4 * (dx + ry_sq)
+        else:
+            x += 1
+            y -= 1
+            dx += 2 * ry_sq
+            dy -= 2 * rx_sq
+            d1 += 4 * (dx - dy + ry_sq)
+
+    # Região 2
+    d2 = ry_sq * (2 * x + 1) ** 2 + 4 * rx_sq * (y - 1) ** 2 - 4 * rx_sq * ry_sq
+    while y >= 0:
+        yield cy + y, cx + x
+        yield cy + y, cx - x
+        yield cy - y, cx + x
+        yield cy - y, cx - x
+        if d2 > 0:
+            y -= 1
+            dy -= 2 * rx_sq
+            d2 += 4 * (rx_sq - dy)
+        else:
+            y -= 1
+            x += 1
+            dx += 2 * ry_sq
+            dy -= 2 * rx_sq
+            d2 += 4 * (dx - dy + rx_sq)
+
+
+def cells_to_spans(cells):
+    """Células soltas (com repetições) → trechos (row, c0, c1) ordenados."""
+    spans = []
+    last_row = last_col = None
+    for r, c in sorted(set(cells)):
+        if r == last_row and c == last_col + 1:
+            spans[-1][2] = c + 1
+        else:
+            spans.append([r, c, c + 1])
+        last_row, last_col = r, c
+    return [tuple(span) for span in spans]
+
+
+def line_spans(r0, c0, r1, c1):
+    return cells_to_spans(line_cells(r0, c0, r1, c1))
+
+
+def rect_spans(start_row, start_col, end_row, end_col, fill=False):
+    """Trechos de um retângulo dados dois cantos opostos (inclusivos)."""
+    r0, r1 = min(start_row, end_row), max(start_row, end_row)
+    c0, c1 = min(start_col, end_col), max(start_col, end_col)
+    spans = []
+    for r in range(r0, r1 + 1):
+        # Sem preenchimento, as linhas do meio só têm as duas bordas
+        if fill or r in (r0, r1) or c1 - c0 <= 1:
+            spans.append((r, c0, c1 + 1))
+        else:
+            spans.append((r, c0, c0 + 1))
+            spans.append((r, c1, c1 + 1))
+    return spans
+
+
+def ellipse_spans(start_row, start_col, end_row, end_col, fill=False):
+    """Trechos da elipse inscrita no retângulo; preenchida, um trecho por linha."""
+    cells = ellipse_cells(start_row, start_col, end_row, end_col)
+    if not fill:
+        return cells_to_spans(cells)
+    # O contorno dá as bordas de cada linha; o miolo é o intervalo entre elas
+    extent = {}
+    for r, c in cells:
+        lo, hi = extent.get(r, (c, c))
+        extent[r] = (min(lo, c), max(hi, c))
+    return [(r, lo, hi + 1) for r, (lo, hi) in sorted(extent.items())]
+
+
+def clip_spans(spans, rows, cols):
+    """Só as partes dos trechos que caem dentro de rows x cols."""
+    clipped = []
+    for r, c0, c1 in spans:
+        if 0 <= r < rows:
+            c0, c1 = max(0, c0), min(cols, c1)
+            if c0 < c1:
+                clipped.append((r, c0, c1))
+    return clipped
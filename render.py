@@ -0,0 +1,450 @@
+# Backends de renderização do canvas do PixelEditor
+import time
+import tkinter as tk
+
+from pixelbuffer import color_runs, packed_to_hex
+
+COR_1 = "#949492"
+COR_2 = "#a3a3a2"
+GRID_COLOR = "#c0c0c0"
+FRAME_MS = 16  # um quadro de tela a ~60 Hz
+RENDER_BUDGET_MS = 10  # tempo de repintura por quadro; o resto fica para o Tk e os eventos
+RENDER_SLICE_CELLS = 16 * 1024  # retângulos maiores são repintados em faixas deste tamanho
+
+
+def rect_difference(a, b):
+    """Partes do retângulo a que ficam fora de b (no máximo quatro retângulos)."""
+    ar0, ac0, ar1, ac1 = a
+    br0, bc0, br1, bc1 = b
+    if ar0 >= ar1 or ac0 >= ac1:
+        return []
+    if br0 >= br1 or bc0 >= bc1 or br0 >= ar1 or br1 <= ar0 or bc0 >= ac1 or bc1 <= ac0:
+        return [a]
+    parts = []
+    if br0 > ar0:
+        parts.append((ar0, ac0, br0, ac1))
+    if br1 < ar1:
+        parts.append((br1, ac0, ar1, ac1))
+    r0, r1 = max(ar0, br0), min(ar1, br1)
+    if bc0 > ac0:
+        parts.append((r0, ac0, r1, bc0))
+    if bc1 < ac1:
+        parts.append((r0, bc1, r1, ac1))
+    return parts
+
+
+def split_rect(rect, max_cells=RENDER_SLICE_CELLS):
+    """Divide o retângulo em faixas de linhas com no máximo `max_cells` células."""
+    r0, c0, r1, c1 = rect
+    step = max(1, max_cells // max(1, c1 - c0))
+    return [(r, c0, min(r1, r + step), c1) for r in range(r0, r1, step)]
+
+
+class ItemRenderer:
+    """Um retângulo por célula visível, criado uma vez e depois só atualizado com itemconfig.
+
+    Só as células do viewport (`view`, em células) têm item. Ao rolar, os
+    itens das células que saíram são movidos para as que entraram, então a
+    quantidade de itens depende do tamanho da janela e não do documento, e
+    não cresce durante os traços.
+    """
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.rows = 0
+        self.cols = 0
+        self.zoom = 0
+        self.show_checker = True
+        self.show_grid = False
+        self.view = (0, 0, 0, 0)  # (r0, c0, r1, c1) com itens criados
+        self.items = {}  # (row, col) -> id do retângulo
+        self.free = []  # itens escondidos, prontos para reuso
+
+    def empty_color(self, row, col):
+        """Cor de uma célula transparente (xadrez ou fundo liso)."""
+        if self.show_checker and (row + col) % 2 == 0:
+            return COR_1
+        return COR_2
+
+    def sync(self, pixels, rows, cols, zoom, show_checker=True, show_grid=False, viewport=None):
+        """Redesenha a área visível; só recria itens se a geometria mudou.
+
+        `viewport` é (r0, c0, r1, c1) em células; None mostra o documento inteiro.
+        """
+        self.show_checker = show_checker
+        if viewport is None:
+            viewport = (0, 0, rows, cols)
+        if (rows, cols, zoom) != (self.rows, self.cols, self.zoom):
+            self.show_grid = show_grid
+            self.build(rows, cols, zoom)
+            self.set_viewport(pixels, *viewport)
+            return
+
+        if show_grid != self.show_grid:
+            self.show_grid = show_grid
+            self.canvas.itemconfig("cell", outline=GRID_COLOR if show_grid else "")
+
+        self.set_viewport(pixels, *viewport)
+        self.update_region(pixels, *self.view)
+
+    def build(self, rows, cols, zoom):
+        """Descarta os itens antigos; set_viewport cria os da área visível."""
+        self.canvas.delete("cell")
+        self.rows, self.cols, self.zoom = rows, cols, zoom
+        self.view = (0, 0, 0, 0)
+        self.items = {}
+        self.free = []
+
+    def set_viewport(self, pixels, r0, c0, r1, c1):
+        """Passa a mostrar as células [r0, r1) x [c0, c1), movendo os itens que saíram."""
+        new = (max(0, r0), max(0, c0), min(self.rows, r1), min(self.cols, c1))
+        old = self.view
+        if new == old:
+            return
+        self.view = new
+        canvas, items, z = self.canvas, self.items, self.zoom
+
+        recycled = []
+        for a0, b0, a1, b1 in rect_difference(old, new):
+            for r in range(a0, a1):
+                for c in range(b0, b1):
+                    recycled.append(items.pop((r, c)))
+
+        outline = GRID_COLOR if self.show_grid else ""
+        created = False
+        for a0, b0, a1, b1 in rect_difference(new, old):
+            for r in range(a0, a1):
+                y0 = r * z
+                for c, value in enumerate(pixels.span(r, b0, b1), b0):
+                    x0 = c * z
+                    color = packed_to_hex(value) or self.empty_color(r, c)
+                    if recycled:
+                        item = recycled.pop()
+                        canvas.coords(item, x0, y0, x0 + z, y0 + z)
+                        canvas.itemconfig(item, fill=color)
+                    elif self.free:
+                        item = self.free.pop()
+                        canvas.coords(item, x0, y0, x0 + z, y0 + z)
+                        canvas.itemconfig(item, fill=color, state="normal")
+                    else:
+                        item = canvas.create_rectangle(x0, y0, x0 + z, y0 + z, fill=color,
+                                                       outline=outline, tags="cell")
+                        created = True
+                    items[r, c] = item
+
+        for item in recycled:
+            canvas.itemconfig(item, state="hidden")
+            self.free.append(item)
+        if created:
+            canvas.tag_lower("cell")
+
+    def update_region(self, pixels, r0, c0, r1, c1):
+        """Repinta as células de [r0, r1) x [c0, c1) que estão no viewport."""
+        itemconfig, items = self.canvas.itemconfig, self.items
+        v0, u0, v1, u1 = self.view
+        c0, c1 = max(u0, c0), min(u1, c1)
+        for r in range(max(v0, r0), min(v1, r1)):
+            for c, value in enumerate(pixels.span(r, c0, c1), c0):
+                itemconfig(items[r, c], fill=packed_to_hex(value) or self.empty_color(r, c))
+
+    def clear(self):
+        self.canvas.delete("cell", "grid_line")
+        self.items = {}
+        self.free = []
+        self.view = (0, 0, 0, 0)
+        self.rows = self.cols = self.zoom = 0
+
+    def item_count(self):
+        return len(self.canvas.find_all())
+
+
+class ImageRenderer:
+    """Mantém a parte visível do documento numa PhotoImage em vez de um item por célula.
+
+    `base` guarda 1 pixel por célula do viewport (transparente onde não há cor)
+    e `display` é a base ampliada pelo zoom, copiada pelo próprio Tk. Por baixo
+    fica uma imagem com o xadrez, montada a partir de um ladrilho 2x2. Ao rolar
+    para fora da área carregada, as imagens mudam de lugar e são recarregadas,
+    então a memória do Tk não depende do tamanho do documento.
+    """
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.rows = 0
+        self.cols = 0
+        self.zoom = 0
+        self.show_checker = True
+        self.show_grid = False
+        self.view = None  # (r0, c0, r1, c1) carregado nas imagens
+        self.base = None
+        self.display = None
+        self.transparent = None
+        self.tile = None
+        self.checker = None
+        self.checker_item = None
+        self.display_item = None
+
+    def sync(self, pixels, rows, cols, zoom, show_checker=True, show_grid=False, viewport=None):
+        """Redesenha a área visível com poucas chamadas em lote."""
+        if viewport is None:
+            viewport = (0, 0, rows, cols)
+        if (rows, cols, zoom) != (self.rows, self.cols, self.zoom) or self.tile is None:
+            self.build(rows, cols, zoom)
+
+        self.show_checker = show_checker
+        self.canvas.itemconfig(self.checker_item, state="normal" if show_checker else "hidden")
+        self.show_grid = show_grid
+        if not self.set_viewport(pixels, *viewport):
+            self.load(pixels)
+            self.draw_grid_lines()
+
+    def build(self, rows, cols, zoom):
+        self.clear()
+        self.rows, self.cols, self.zoom = rows, cols, zoom
+        self.transparent = tk.PhotoImage(master=self.canvas, width=1, height=1)
+
+        # Ladrilho 2x2 do xadrez, repetido pelo "copy -to" do Tk
+        self.tile = tk.PhotoImage(master=self.canvas, width=2 * zoom, height=2 * zoom)
+        self.tile.put(COR_2, to=(0, 0, 2 * zoom, 2 * zoom))
+        self.tile.put(COR_1, to=(0, 0, zoom, zoom))
+        self.tile.put(COR_1, to=(zoom, zoom, 2 * zoom, 2 * zoom))
+
+        self.checker_item = self.canvas.create_image(0, 0, anchor="nw", tags="cell")
+        self.display_item = self.canvas.create_image(0, 0, anchor="nw", tags="cell")
+        self.canvas.tag_lower("cell")
+
+    def set_viewport(self, pixels, r0, c0, r1, c1):
+        """Carrega as células [r0, r1) x [c0, c1); devolve False se já estavam carregadas."""
+        # Origem em célula par para o ladrilho do xadrez continuar alinhado
+        r0, c0 = max(0, r0 - r0 % 2), max(0, c0 - c0 % 2)
+        r1, c1 = min(self.rows, r1), min(self.cols, c1)
+        view = (r0, c0, r1, c1)
+        if view == self.view:
+            return False
+        width, height = max(1, c1 - c0), max(1, r1 - r0)
+        if self.base is None or (self.base.width(), self.base.height()) != (width, height):
+            self._make_images(width, height)
+        self.view = view
+        z = self.zoom
+        self.canvas.coords(self.checker_item, c0 * z, r0 * z)
+        self.canvas.coords(self.display_item, c0 * z, r0 * z)
+        self.load(pixels)
+        self.draw_grid_lines()
+        return True
+
+    def _make_images(self, width, height):
+        z = self.zoom
+        self.base = tk.PhotoImage(master=self.canvas, width=width, height=height)
+        self.display = tk.PhotoImage(master=self.canvas, width=width * z, height=height * z)
+        self.checker = tk.PhotoImage(master=self.canvas, width=width * z, height=height * z)
+        self._copy(self.checker, self.tile, "-to", 0, 0, width * z, height * z)
+        self.canvas.itemconfig(self.checker_item, image=self.checker)
+        self.canvas.itemconfig(self.display_item, image=self.display)
+
+    def load(self, pixels):
+        """Escreve o viewport inteiro na base e amplia de uma vez."""
+        self.base.blank()
+        # Só as partes com blocos alocados têm algo a escrever
+        for r0, c0, r1, c1 in pixels.populated(*self.view):
+            self._put_runs(pixels, r0, c0, r1, c1)
+        self.refresh(*self.view)
+
+    def update_region(self, pixels, r0, c0, r1, c1):
+        """Reescreve a parte visível de [r0, r1) x [c0, c1) e amplia só ela."""
+        if self.view is None:
+            return
+        v0, u0, v1, u1 = self.view
+        r0, c0 = max(v0, r0), max(u0, c0)
+        r1, c1 = min(v1, r1), min(u1, c1)
+        if r0 >= r1 or c0 >= c1:
+            return
+        # Limpa a região (volta a ser transparente) antes de escrever as cores
+        self._copy(self.base, self.transparent, "-to", c0 - u0, r0 - v0, c1 - u0, r1 - v0,
+                   "-compositingrule", "set")
+        self._put_runs(pixels, r0, c0, r1, c1)
+        self.refresh(r0, c0, r1, c1)
+
+    def _put_runs(self, pixels, r0, c0, r1, c1):
+        # Sequências longas de uma cor viram um put de região; as curtas
+        # são agrupadas numa lista de cores por linha. A base começa na
+        # origem do viewport.
+        put = self.base.put
+        v0, u0 = self.view[0], self.view[1]
+        for r in range(r0, r1):
+            y = r - v0
+            pending, pending_start = [], c0
+            for start, end, value in color_runs(pixels.span(r, c0, c1)):
+                start, end = start + c0 - u0, end + c0 - u0
+                opaque = value >> 24
+                if opaque and end - start < 8:
+                    if not pending:
+                        pending_start = start
+                    pending.extend([packed_to_hex(value)] * (end - start))
+                    continue
+                if pending:
+                    put("{" + " ".join(pending) + "}", to=(pending_start, y))
+                    pending = []
+                if opaque:
+                    put(packed_to_hex(value), to=(start, y, end, y + 1))
+            if pending:
+                put("{" + " ".join(pending) + "}", to=(pending_start, y))
+
+    def refresh(self, r0, c0, r1, c1):
+        """Copia a região [r0, r1) x [c0, c1) da base para a imagem ampliada."""
+        z = self.zoom
+        v0, u0 = self.view[0], self.view[1]
+        self._copy(self.display, self.base, "-from", c0 - u0, r0 - v0, c1 - u0, r1 - v0,
+                   "-to", (c0 - u0) * z, (r0 - v0) * z, "-zoom", z, z, "-compositingrule", "set")
+
+    def draw_grid_lines(self):
+        """Linhas da grade só sobre a área carregada."""
+        self.canvas.delete("grid_line")
+        if not self.show_grid:
+            return
+        z = self.zoom
+        r0, c0, r1, c1 = self.view
+        for c in range(c0, c1 + 1):
+            self.canvas.create_line(c * z, r0 * z, c * z, r1 * z, fill=GRID_COLOR, tags="grid_line")
+        for r in range(r0, r1 + 1):
+            self.canvas.create_line(c0 * z, r * z, c1 * z, r * z, fill=GRID_COLOR, tags="grid_line")
+
+    def clear(self):
+        self.canvas.delete("cell", "grid_line")
+        self.base = self.display = self.transparent = self.tile = self.checker = None
+        self.view = None
+        self.rows = self.cols = self.zoom = 0
+
+    def item_count(self):
+        return len(self.canvas.find_all())
+
+    @staticmethod
+    def _copy(dst, src, *options):
+        # PhotoImage.copy() do tkinter não aceita -from/-to/-zoom antes do Python 3.13
+        dst.tk.call(dst.name, "copy", src.name, *options)
+
+
+class PreviewLayer:
+    """Pré-visualização das formas com um pool de retângulos reaproveitados.
+
+    `show` recebe {(r0, c0, r1, c1): cor do contorno} em células e compara
+    com o que já está na tela: só os retângulos que entraram ou saíram são
+    mexidos. Itens que sobram ficam escondidos para o próximo preview, então
+    a quantidade de itens não cresce durante o arraste.
+    """
+
+    def __init__(self, canvas, fill, tag="temp_shape"):
+        self.canvas = canvas
+        self.fill = fill
+        self.tag = tag
+        self.zoom = 0
+        self.shown = {}  # retângulo -> (id do item, cor do contorno)
+        self.free = []   # itens escondidos prontos para reuso
+
+    def show(self, shapes, zoom):
+        canvas = self.canvas
+        if zoom != self.zoom:
+            # Zoom mudou: os itens visíveis precisam de novas coordenadas
+            self.zoom = zoom
+            for rect, (item, _) in self.shown.items():
+                canvas.coords(item, *self._coords(rect))
+
+        shown = self.shown
+        removed = [rect for rect in shown if rect not in shapes]
+        created = False
+        for rect, outline in shapes.items():
+            current = shown.get(rect)
+            if current is not None:
+                if current[1] != outline:
+                    canvas.itemconfig(current[0], outline=outline)
+                    shown[rect] = (current[0], outline)
+                continue
+            if removed:
+                # Reaproveita direto um item que saiu: só muda de lugar
+                item, old_outline = shown.pop(removed.pop())
+                canvas.coords(item, *self._coords(rect))
+                if old_outline != outline:
+                    canvas.itemconfig(item, outline=outline)
+            elif self.free:
+                item = self.free.pop()
+                canvas.coords(item, *self._coords(rect))
+                canvas.itemconfig(item, outline=outline, state="normal")
+            else:
+                item = canvas.create_rectangle(*self._coords(rect), fill=self.fill,
+                                               outline=outline, width=1, tags=self.tag)
+                created = True
+            shown[rect] = (item, outline)
+
+        for rect in removed:
+            item, _ = shown.pop(rect)
+            canvas.itemconfig(item, state="hidden")
+            self.free.append(item)
+        if created:
+            # Itens novos vão para o topo junto com os antigos do pool
+            canvas.tag_raise(self.tag)
+
+    def clear(self):
+        """Esconde o preview (os itens continuam no pool)."""
+        for item, _ in self.shown.values():
+            self.canvas.itemconfig(item, state="hidden")
+            self.free.append(item)
+        self.shown = {}
+
+    def _coords(self, rect):
+        r0, c0, r1, c1 = rect
+        z = self.zoom
+        return c0 * z, r0 * z, c1 * z, r1 * z
+
+
+class RenderScheduler:
+    """Junta os pedidos de repintura e os atende no máximo uma vez por quadro.
+
+    Quem altera o documento só chama request(); `render(deadline)` roda no
+    próximo quadro via `after` e devolve True se parou no `deadline` com
+    trabalho sobrando, que fica para o quadro seguinte. Com `immediate`,
+    request() repinta tudo na hora (testes e scripts sem mainloop).
+    """
+
+    def __init__(self, master, render, frame_ms=FRAME_MS, budget_ms=RENDER_BUDGET_MS, immediate=False):
+        self.master = master
+        self.render = render
+        self.frame_ms = frame_ms
+        self.budget_ms = budget_ms
+        self.immediate = immediate
+        self.job = None
+        self.last = 0.0  # início do último passe (perf_counter)
+        self.frames = 0  # passes executados
+        self.deferred = 0  # passes que estouraram o orçamento e continuaram depois
+
+    def request(self):
+        if self.immediate:
+            self.flush()
+        elif self.job is None:
+            # Espera o fim do quadro atual; uma rajada de eventos vira um só passe
+            wait = self.last + self.frame_ms / 1000 - time.perf_counter()
+            self.job = self.master.after(max(0, int(wait * 1000)), self._frame)
+
+    def _frame(self):
+        self.job = None
+        self.last = time.perf_counter()
+        self.frames += 1
+        if self.render(self.last + self.budget_ms / 1000):
+            self.deferred += 1
+            self.request()
+
+    def flush(self):
+        """Repinta agora tudo o que estiver pendente, sem orçamento."""
+        self.cancel()
+        self.last = time.perf_counter()
+        self.frames += 1
+        self.render(None)
+
+    def cancel(self):
+        if self.job is not None:
+            self.master.after_cancel(self.job)
+            self.job = None
+
+
+RENDERERS = {
+    "items": ItemRenderer,
+    "image": ImageRenderer,
+}